@@ -4,7 +4,14 @@ Flask Application - Ứng dụng quản lý chi tiêu (Modular Version)
 Cấu trúc đã được tách thành các modules:
 - config.py: Cấu hình ứng dụng
 - utils/: Utility functions
-  - excel_utils.py: Xử lý đọc/ghi Excel
+  - db_utils.py: Pool kết nối SQLite, query_db/execute_db
+  - excel_utils.py: Ghi Excel (export)
+  - excel_import.py: Import Excel theo tập hợp (Full Restore)
+  - migrations.py: Schema migrations (PRAGMA user_version)
+  - jobs.py: Job chạy nền (import/export) với tiến độ lưu trong DB
+  - snapshots.py: Snapshot/khôi phục DB bằng SQLite backup API
+  - streaming.py: Stream truy vấn thành CSV/NDJSON (có nén gzip)
+  - export_cache.py: Cache file export theo phiên bản dữ liệu (ETag)
   - decorators.py: login_required, admin_required
 - routes/: Route handlers (Blueprints)
   - auth.py: Login, Logout, Index
@@ -13,17 +20,23 @@ Cấu trúc đã được tách thành các modules:
   - api_expenses.py: API chi tiêu, calendar, reports
   - api_funds.py: API quỹ, fund links
   - api_categories.py: API danh mục
+  - api_data.py: Export/Import Excel, snapshot DB (qua job nền), export CSV/NDJSON
+  - api_jobs.py: Poll tiến độ job, tải kết quả
 """
 from flask import Flask
-import os
 from config import Config
 
 # Import blueprints
-from routes import auth, main, api_users, api_expenses, api_funds, api_categories, api_data
+from routes import auth, main, api_users, api_expenses, api_funds, api_categories, api_data, api_jobs
+from utils import db_utils, snapshots
 
 app = Flask(__name__)
 app.secret_key = Config.SECRET_KEY
 
+# Pool kết nối SQLite: mỗi request mượn một kết nối và trả lại khi kết thúc
+db_utils.init_app(app)
+snapshots.init_app(app)
+
 # Đăng ký blueprints
 app.register_blueprint(auth.bp)
 app.register_blueprint(main.bp)
@@ -32,13 +45,10 @@ app.register_blueprint(api_expenses.bp)
 app.register_blueprint(api_funds.bp)
 app.register_blueprint(api_categories.bp)
 app.register_blueprint(api_data.bp)
+app.register_blueprint(api_jobs.bp)
 
-
-from utils.db_utils import init_db
+# Tạo schema nếu chưa có và nâng cấp DB cũ lên phiên bản mới nhất (idempotent)
+db_utils.init_db()
 
 if __name__ == '__main__':
-    # Initialize DB
-    if not os.path.exists('database.db'):
-        init_db()
-        
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -15,6 +15,36 @@ class Config:
     # Đường dẫn đến SQLite DB
     DATABASE_URI = 'database.db'
     
+    # Cấu hình pool kết nối SQLite (mỗi worker giữ vài kết nối dùng lại)
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_BUSY_TIMEOUT_MS = 5000
+    DB_CACHE_SIZE_KB = 16384  # ~16MB page cache cho mỗi kết nối
+    DB_MMAP_SIZE = 64 * 1024 * 1024
+    
+    # Job chạy nền (import/export): số luồng mỗi worker, thư mục file, thời gian giữ
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOBS_DIR = 'data/jobs'
+    JOB_RETENTION_HOURS = 24
+    
+    # Cache file export Excel theo phiên bản dữ liệu
+    EXPORT_CACHE_DIR = 'data/export_cache'
+    EXPORT_CACHE_KEEP = 3
+    
+    # Số giao dịch tối đa mỗi request /api/expenses/batch
+    BATCH_MAX_ITEMS = 1000
+    
+    # Xóa user chạy nền: số giao dịch xóa mỗi transaction (giữ lock ghi ngắn)
+    USER_PURGE_BATCH = 2000
+    
+    # Đồng bộ delta (/api/sync): số thay đổi tối đa mỗi lần, số lần thay đổi giữ tombstone
+    SYNC_MAX_CHANGES = 500
+    SYNC_TOMBSTONE_KEEP = 100000
+    
+    # Snapshot nhị phân của DB: thư mục lưu, số trang chép mỗi bước, số bản giữ lại
+    SNAPSHOT_DIR = 'data/snapshots'
+    SNAPSHOT_PAGES = 1024
+    SNAPSHOT_KEEP = 10
+    
     # Cấu hình retry cho file locking
     MAX_RETRY_ATTEMPTS = 5
     RETRY_DELAY_SECONDS = 0.5
@@ -1,13 +1,97 @@
 """
 API Routes cho quản lý danh mục (categories)
 """
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, Response, request, jsonify, session
 import traceback
 from utils.decorators import login_required
-from utils.db_utils import query_db, execute_db
+from utils.db_utils import query_db, execute_db, db_connection
+from utils.categories import category_registry
+from utils.versions import VersionedCache, get_versions
 
 bp = Blueprint('api_categories', __name__)
 
+# Tăng khi đổi cấu trúc payload /api/bootstrap để client không dùng lại bản cũ qua ETag
+BOOTSTRAP_FORMAT = 1
+_bootstrap_cache = VersionedCache(max_entries=1)
+
+
+def _display(row):
+    return f"{row['icon']} {row['name']}" if row['icon'] else row['name']
+
+
+def _build_bootstrap():
+    """Toàn bộ dữ liệu tham chiếu của trang chi tiêu từ một truy vấn trên bảng categories.
+
+    Mỗi phần giữ đúng nội dung và thứ tự của endpoint lẻ tương ứng:
+    categories.<loại> ~ /api/categories?type=, category_lists.<loại> ~ /api/categories/<loại>,
+    quy_purposes* ~ /api/quy_purposes*, icons ~ /api/icons.
+    """
+    rows = query_db('SELECT id, name, type, subtype, icon FROM categories ORDER BY id')
+    
+    normal = {'chi': [], 'thu': []}
+    for row in rows:
+        if row['subtype'] == 'normal' and row['type'] in ('Chi', 'Thu') and row['name'] not in ('Thu quỹ', 'Chi quỹ'):
+            normal[row['type'].lower()].append(row)
+    
+    funds = [row for row in rows if row['subtype'] == 'fund']
+    distinct_funds, seen = [], set()
+    for row in funds:
+        if (row['name'], row['icon']) not in seen:
+            seen.add((row['name'], row['icon']))
+            distinct_funds.append(row)
+    
+    icons = []
+    for row in rows:
+        if row['icon'] and row['icon'] not in icons:
+            icons.append(row['icon'])
+    
+    return {
+        'categories': {
+            'chi': [_display(row) for row in normal['chi']],
+            'thu': [_display(row) for row in normal['thu']],
+            'quy': [_display(row) for row in sorted(distinct_funds, key=lambda r: r['name'])],
+        },
+        'category_lists': {
+            'chi': [{'row': row['id'], 'value': _display(row)} for row in normal['chi']],
+            'thu': [{'row': row['id'], 'value': _display(row)} for row in normal['thu']],
+            'quy': [{'row': row['name'], 'id': row['name'], 'value': _display(row), 'column': 'Thu quỹ'}
+                    for row in distinct_funds],
+        },
+        'quy_purposes': [{'name': row['name'], 'icon': row['icon']} for row in distinct_funds],
+        'quy_purposes_thu': [{'name': row['name'], 'icon': row['icon']} for row in funds if row['type'] == 'Thu'],
+        'quy_purposes_chi': [{'name': row['name'], 'icon': row['icon']} for row in funds if row['type'] == 'Chi'],
+        'icons': icons,
+    }
+
+
+@bp.route('/api/bootstrap', methods=['GET'])
+@login_required
+def get_bootstrap():
+    """Danh mục, mục đích quỹ và icon cho trang chi tiêu trong một response.
+
+    ETag theo phiên bản 'categories' (tăng bằng trigger khi bảng categories đổi):
+    client gửi If-None-Match trùng thì trả 304 mà không đọc bảng categories.
+    """
+    try:
+        version = get_versions(['categories'])['categories']
+        etag = f'bootstrap-{BOOTSTRAP_FORMAT}-{version}'
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            payload = _bootstrap_cache.get('bootstrap', version)
+            if payload is None:
+                payload = _build_bootstrap()
+                _bootstrap_cache.set('bootstrap', version, payload)
+            response = jsonify({'version': version, **payload})
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    except Exception as e:
+        print(f"Lỗi khi lấy dữ liệu bootstrap: {e}")
+        traceback.print_exc()
+        return jsonify({'error': f'Lỗi: {str(e)}'}), 500
+
 
 @bp.route('/api/categories', methods=['GET'])
 @login_required
@@ -92,40 +176,30 @@ def add_category():
             
         # Handle 'quy' type (add both Thu and Chi fund categories)
         if category_type.lower() == 'quy':
-            # Add Thu fund
-            try:
-                execute_db(
-                    'INSERT INTO categories (name, type, subtype, icon) VALUES (?, ?, ?, ?)',
-                    (category_name, 'Thu', 'fund', category_icon)
+            # Add Thu fund + Chi fund, bỏ qua dòng đã tồn tại
+            with db_connection() as conn:
+                conn.executemany(
+                    'INSERT INTO categories (name, type, subtype, icon) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (name, type, subtype) DO NOTHING',
+                    [(category_name, 'Thu', 'fund', category_icon), (category_name, 'Chi', 'fund', category_icon)]
                 )
-            except:
-                pass # Ignore duplicate
-                
-            # Add Chi fund
-            try:
-                execute_db(
-                    'INSERT INTO categories (name, type, subtype, icon) VALUES (?, ?, ?, ?)',
-                    (category_name, 'Chi', 'fund', category_icon)
-                )
-            except:
-                pass # Ignore duplicate
+                conn.commit()
+            category_registry.invalidate()
                 
             return jsonify({'success': True, 'message': f'Đã thêm danh mục quỹ "{category_name}" thành công'})
 
-        # Check existing
-        existing = query_db(
-            'SELECT id FROM categories WHERE name = ? AND type = ? AND subtype = ?',
-            (category_name, db_type, subtype),
-            one=True
-        )
+        # Chỉ một câu lệnh: trùng (name, type, subtype) thì không trả về id
+        with db_connection() as conn:
+            created = conn.execute(
+                'INSERT INTO categories (name, type, subtype, icon) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (name, type, subtype) DO NOTHING RETURNING id',
+                (category_name, db_type, subtype, category_icon)
+            ).fetchone()
+            conn.commit()
         
-        if existing:
+        if not created:
             return jsonify({'success': False, 'error': 'Danh mục này đã tồn tại'}), 400
-            
-        execute_db(
-            'INSERT INTO categories (name, type, subtype, icon) VALUES (?, ?, ?, ?)',
-            (category_name, db_type, subtype, category_icon)
-        )
+        category_registry.invalidate()
         
         return jsonify({'success': True, 'message': f'Đã thêm danh mục "{category_name}" thành công'})
     except Exception as e:
@@ -213,6 +287,7 @@ def update_category():
                 "UPDATE categories SET name = ?, icon = ? WHERE subtype = 'fund' AND name = ?",
                 (new_name, new_icon, old_name_key)
             )
+            category_registry.invalidate()
             return jsonify({'success': True, 'message': 'Đã cập nhật danh mục thành công'})
 
         else:
@@ -221,6 +296,7 @@ def update_category():
                 'UPDATE categories SET name = ?, icon = ? WHERE id = ?',
                 (new_name, new_icon, row_id)
             )
+            category_registry.invalidate()
             return jsonify({'success': True, 'message': 'Đã cập nhật danh mục thành công'})
             
     except Exception as e:
@@ -247,6 +323,7 @@ def delete_category():
             execute_db("DELETE FROM categories WHERE subtype = 'fund' AND name = ?", (name_to_delete,))
         else:
             execute_db('DELETE FROM categories WHERE id = ?', (row_id,))
+        category_registry.invalidate()
             
         return jsonify({'success': True, 'message': 'Đã xóa danh mục thành công'})
             
@@ -1,101 +1,268 @@
 """
-API Routes cho quản lý dữ liệu (Export/Import)
+API Routes cho quản lý dữ liệu (Export/Import Excel, Snapshot DB, CSV/NDJSON)
+
+Các thao tác nặng chạy nền qua utils.jobs: endpoint chỉ nhận yêu cầu và trả
+job id (202); client poll /api/jobs/<id> và tải kết quả khi xong.
 """
-from flask import Blueprint, request, send_file, jsonify, session
-import pandas as pd
-import io
+from flask import Blueprint, Response, request, send_file, jsonify, session
+import os
+import uuid
 from datetime import datetime
 import traceback
-from utils.decorators import admin_required
-from utils.db_utils import query_db, get_db_connection
-import sqlite3
+from utils.decorators import login_required, admin_required
+from utils.db_utils import get_db_connection, db_connection, query_db
+from utils.excel_utils import new_export_workbook, write_query_sheet
+from utils.excel_import import WorkbookReader, import_excel_workbook, IMPORT_MODES
+from utils.fund_groups import membership_graph
+from utils.categories import category_registry
+from utils.jobs import submit_job, result_path_for
+from utils.streaming import iter_query_chunks, csv_stream, ndjson_stream, encode_stream
+from utils.versions import global_data_version
+from utils import export_cache
+from utils.snapshots import (create_snapshot, restore_snapshot, list_snapshots,
+                             snapshot_path, new_snapshot_name)
 
 bp = Blueprint('api_data', __name__)
 
+# Các sheet của file backup: (tên sheet, truy vấn)
+EXPORT_SHEETS = [
+    ('Transactions', '''
+        SELECT 
+            t.id as "ID",
+            t.date as "Ngày",
+            u.username as "Username",
+            u.name as "Người dùng",
+            c.name as "Danh mục",
+            t.type as "Loại",
+            t.amount as "Số tiền",
+            t.note as "Ghi chú",
+            t.fund_purpose as "Mục đích quỹ"
+        FROM transactions t
+        LEFT JOIN users u ON t.user_id = u.id
+        LEFT JOIN categories c ON t.category_id = c.id
+        ORDER BY t.date DESC
+    '''),
+    ('Categories', 'SELECT name, type, subtype, icon FROM categories'),
+    ('Users', 'SELECT username, name, role, active FROM users WHERE deleted_at IS NULL'),
+    ('FundGroups', '''
+        SELECT g.name, u.username as created_by 
+        FROM fund_groups g 
+        LEFT JOIN users u ON g.created_by = u.id
+    '''),
+    ('GroupMembers', '''
+        SELECT g.name as group_name, u.username as user_username
+        FROM fund_group_members m
+        JOIN fund_groups g ON m.group_id = g.id
+        JOIN users u ON m.user_id = u.id
+    '''),
+]
+
+
+def _excel_cache_key(stamp):
+    # EXPORT_SHEETS nằm trong khóa: đổi cột/truy vấn khi nâng cấp code cũng làm mới cache
+    return export_cache.cache_key('excel', stamp, {'sheets': EXPORT_SHEETS})
+
+
+def _excel_download_name(path):
+    built = datetime.fromtimestamp(os.path.getmtime(path))
+    return f"full_backup_{built.strftime('%Y%m%d_%H%M%S')}.xlsx"
+
+
+def _export_excel_job(job):
+    """Ghi stream từng sheet vào workbook write-only, lưu vào cache export theo stamp dữ liệu"""
+    workbook = new_export_workbook()
+    total = 0
+    with db_connection() as conn:
+        # Một transaction đọc: stamp và mọi sheet cùng nhìn một bản chụp của DB
+        conn.execute('BEGIN')
+        try:
+            key = _excel_cache_key(global_data_version(conn))
+            cached = export_cache.lookup(key, '.xlsx')
+            if cached:
+                job.set_result(cached, _excel_download_name(cached))
+                return {'message': 'Dữ liệu không đổi, dùng lại file export đã có.'}
+            for title, sql in EXPORT_SHEETS:
+                rows = conn.execute(f'SELECT COUNT(*) FROM ({sql})').fetchone()[0]
+                job.stage(title, rows)
+                total += write_query_sheet(workbook, conn, title, sql, on_chunk=job.progress)
+        finally:
+            conn.rollback()
+
+    job.stage('Lưu file')
+    path = result_path_for(job.id, '.xlsx')
+    try:
+        workbook.save(path)
+        path = export_cache.store(path, key, '.xlsx')
+    except Exception:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    job.set_result(path, _excel_download_name(path))
+    return {'message': f'Đã export {total} dòng dữ liệu.'}
+
+
+def _import_excel_job(job, upload_path, mode, delete_missing):
+    """Import file đã upload (full hoặc incremental) trong một transaction riêng"""
+    conn = None
+    try:
+        conn = get_db_connection()
+        with WorkbookReader(upload_path) as reader:
+            importer = import_excel_workbook(conn, reader, job, mode, delete_missing)
+        conn.commit()
+        membership_graph.invalidate()
+        category_registry.invalidate()
+        return {'message': '\n'.join(importer.messages), 'errors': importer.errors}
+    except Exception:
+        if conn: conn.rollback()
+        raise
+    finally:
+        if conn: conn.close()
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+
+# Cột của export CSV/NDJSON (theo thứ tự)
+STREAM_EXPORT_COLUMNS = ('id', 'date', 'username', 'type', 'category', 'amount', 'note', 'fund_purpose')
+STREAM_EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def _stream_export_query(args):
+    """(sql, params) cho export giao dịch theo bộ lọc; ValueError/PermissionError nếu tham số sai
+
+    Không lọc user: sắp theo id (thứ tự rowid, SQLite không phải sort toàn bảng trước
+    khi trả dòng đầu). Có lọc user: theo (date, id) - đúng thứ tự index (user_id, date).
+    """
+    sql = '''
+        SELECT t.id, t.date, u.username, t.type, c.name as category,
+               t.amount, t.note, t.fund_purpose
+        FROM transactions t
+        LEFT JOIN users u ON t.user_id = u.id
+        LEFT JOIN categories c ON t.category_id = c.id
+        WHERE 1 = 1
+    '''
+    params = []
+    
+    user = args.get('user')
+    if session.get('role') != 'admin':
+        # User thường chỉ được export dữ liệu của chính mình
+        if user and user not in (str(session.get('user_id')), session.get('user')):
+            raise PermissionError('Không có quyền export dữ liệu của user khác')
+        user_id = session.get('user_id')
+    elif user:
+        row = query_db('SELECT id FROM users WHERE id = ? OR username = ?',
+                       (user if user.isdigit() else None, user), one=True)
+        if not row:
+            raise ValueError('Không tìm thấy user')
+        user_id = row['id']
+    else:
+        user_id = None
+    if user_id is not None:
+        sql += " AND t.user_id = ?"
+        params.append(user_id)
+    
+    for arg, op in (('from', '>='), ('to', '<')):
+        value = args.get(arg)
+        if value:
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                raise ValueError(f'Tham số {arg} phải có dạng YYYY-MM-DD')
+            sql += f" AND t.date {op} ?"
+            params.append(value)
+    
+    trans_type = args.get('type')
+    if trans_type:
+        sql += " AND t.type = ?"
+        params.append(trans_type)
+    
+    sql += " ORDER BY t.date, t.id" if user_id is not None else " ORDER BY t.id"
+    return sql, params
+
+
+@bp.route('/api/export/transactions.<fmt>', methods=['GET'])
+@login_required
+def export_transactions_stream(fmt):
+    """Stream giao dịch dạng CSV hoặc NDJSON trực tiếp từ cursor SQLite
+
+    Tham số: from, to (YYYY-MM-DD, nửa mở [from, to)), user (id hoặc username - chỉ admin),
+    type (Thu/Chi). Nén gzip khi client gửi Accept-Encoding: gzip.
+    """
+    if fmt not in STREAM_EXPORT_FORMATS:
+        return jsonify({'error': 'Định dạng không hỗ trợ (csv, ndjson)'}), 404
+    try:
+        sql, params = _stream_export_query(request.args)
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    chunks = iter_query_chunks(sql, params)
+    parts = csv_stream(STREAM_EXPORT_COLUMNS, chunks) if fmt == 'csv' else ndjson_stream(chunks)
+    compress = request.accept_encodings['gzip'] > 0
+    
+    response = Response(encode_stream(parts, compress), content_type=STREAM_EXPORT_FORMATS[fmt])
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    filename = f"transactions_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+
 @bp.route('/api/export/excel', methods=['GET'])
 @admin_required
-def export_excel():
-    """Xuất toàn bộ dữ liệu (Giao dịch, Users, Groups) ra Excel"""
+def download_export_excel():
+    """Tải file export Excel ứng với dữ liệu hiện tại (ETag = khóa cache)
+
+    Client đã có đúng bản (If-None-Match) -> 304; đã có trong cache -> trả file;
+    chưa có -> tạo job export (hoặc dùng lại job đang chạy cho cùng khóa) và trả 202
+    kèm job id như POST.
+    """
     try:
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            # 1. Transactions
-            sql_trans = '''
-                SELECT 
-                    t.date as "Ngày",
-                    u.username as "Username",
-                    u.name as "Người dùng",
-                    c.name as "Danh mục",
-                    t.type as "Loại",
-                    t.amount as "Số tiền",
-                    t.note as "Ghi chú",
-                    t.fund_purpose as "Mục đích quỹ"
-                FROM transactions t
-                LEFT JOIN users u ON t.user_id = u.id
-                LEFT JOIN categories c ON t.category_id = c.id
-                ORDER BY t.date DESC
-            '''
-            # Use query_db to get rows, then convert to DataFrame
-            rows_trans = query_db(sql_trans)
-            df_trans = pd.DataFrame([dict(row) for row in rows_trans])
-            df_trans.to_excel(writer, index=False, sheet_name='Transactions')
-            
-            # 1.5 Categories (New)
-            sql_cats = 'SELECT name, type, subtype, icon FROM categories'
-            rows_cats = query_db(sql_cats)
-            df_cats = pd.DataFrame([dict(row) for row in rows_cats])
-            df_cats.to_excel(writer, index=False, sheet_name='Categories')
-            
-            # 2. Users
-            sql_users = 'SELECT username, name, role, active FROM users'
-            rows_users = query_db(sql_users)
-            df_users = pd.DataFrame([dict(row) for row in rows_users])
-            df_users.to_excel(writer, index=False, sheet_name='Users')
-            
-            # 3. Fund Groups
-            sql_groups = '''
-                SELECT g.name, u.username as created_by 
-                FROM fund_groups g 
-                LEFT JOIN users u ON g.created_by = u.id
-            '''
-            rows_groups = query_db(sql_groups)
-            df_groups = pd.DataFrame([dict(row) for row in rows_groups])
-            df_groups.to_excel(writer, index=False, sheet_name='FundGroups')
-            
-            # 4. Group Members
-            sql_members = '''
-                SELECT g.name as group_name, u.username as user_username
-                FROM fund_group_members m
-                JOIN fund_groups g ON m.group_id = g.id
-                JOIN users u ON m.user_id = u.id
-            '''
-            rows_members = query_db(sql_members)
-            df_members = pd.DataFrame([dict(row) for row in rows_members])
-            df_members.to_excel(writer, index=False, sheet_name='GroupMembers')
-            
-            # Auto-adjust column width for all sheets
-            for sheet_name in writer.sheets:
-                worksheet = writer.sheets[sheet_name]
-                for idx, col in enumerate(writer.book[sheet_name].columns):
-                    max_len = 0
-                    for cell in col:
-                        try:
-                            if len(str(cell.value)) > max_len:
-                                max_len = len(str(cell.value))
-                        except:
-                            pass
-                    worksheet.column_dimensions[chr(65 + idx)].width = min(max_len + 2, 50)
-                
-        output.seek(0)
-        filename = f"full_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        key = _excel_cache_key(global_data_version())
+        if key in request.if_none_match:
+            response = Response(status=304)
+            response.set_etag(key)
+            return response
+        
+        path = export_cache.lookup(key, '.xlsx')
+        if path is None:
+            job_id = submit_job('export_excel', _export_excel_job,
+                                created_by=session.get('user_id'), key=key)
+            return jsonify({'success': True, 'job_id': job_id}), 202
         
-        return send_file(
-            output,
+        response = send_file(
+            os.path.abspath(path),
             mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
             as_attachment=True,
-            download_name=filename
+            download_name=_excel_download_name(path),
+            etag=key
         )
-        
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    except Exception as e:
+        print(f"Lỗi khi tải export excel: {e}")
+        traceback.print_exc()
+        return jsonify({'error': f'Lỗi server: {str(e)}'}), 500
+
+@bp.route('/api/export/excel', methods=['POST'])
+@admin_required
+def export_excel():
+    """Xuất toàn bộ dữ liệu (Giao dịch, Users, Groups) ra Excel
+
+    Dữ liệu không đổi từ lần export trước -> trả ngay link tải file đã cache;
+    ngược lại chạy nền và trả job id (job đang chạy cho cùng khóa thì dùng lại).
+    """
+    try:
+        key = _excel_cache_key(global_data_version())
+        if export_cache.lookup(key, '.xlsx'):
+            return jsonify({'success': True, 'cached': True, 'download_url': '/api/export/excel'})
+        job_id = submit_job('export_excel', _export_excel_job,
+                            created_by=session.get('user_id'), key=key)
+        return jsonify({'success': True, 'job_id': job_id}), 202
     except Exception as e:
         print(f"Lỗi khi export excel: {e}")
         traceback.print_exc()
@@ -104,8 +271,12 @@ def export_excel():
 @bp.route('/api/import/excel', methods=['POST'])
 @admin_required
 def import_excel():
-    """Import dữ liệu từ file Excel (Full Restore) - Optimized for Speed"""
-    conn = None
+    """Import dữ liệu từ file Excel - lưu file rồi chạy nền, trả job id
+
+    Form: mode = 'full' (mặc định, Full Restore) | 'incremental' (chỉ ghi phần khác biệt),
+    delete_missing = 1 để xóa giao dịch không có trong file (chỉ với incremental).
+    """
+    upload_path = None
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'Không có file được gửi lên'}), 400
@@ -117,256 +288,124 @@ def import_excel():
         if not file.filename.endswith(('.xlsx', '.xls')):
             return jsonify({'error': 'Chỉ hỗ trợ file Excel (.xlsx, .xls)'}), 400
 
-        # Read Excel (all sheets)
+        mode = request.form.get('mode', 'full')
+        if mode not in IMPORT_MODES:
+            return jsonify({'error': 'Chế độ import không hợp lệ'}), 400
+        delete_missing = request.form.get('delete_missing') in ('1', 'true')
+
+        # Stream của request đóng khi trả response: lưu file để job đọc lại
+        upload_path = result_path_for(f'upload_{uuid.uuid4().hex}', os.path.splitext(file.filename)[1])
+        file.save(upload_path)
         try:
-            xls = pd.ExcelFile(file)
+            with WorkbookReader(upload_path):
+                pass
         except Exception as e:
+            os.remove(upload_path)
             return jsonify({'error': f'Không thể đọc file Excel: {str(e)}'}), 400
-            
-        success_msg = []
-        errors = []
         
-        # --- START TRANSACTION ---
-        conn = get_db_connection()
-        # Turn off auto-commit behavior if any (SQLite default is usually fine but explicit commit is better)
-        
-        # --- 0. CLEAR EXISTING TRANSACTIONS (Replace Mode) ---
-        conn.execute('DELETE FROM transactions')
-        success_msg.append("Đã xóa dữ liệu giao dịch cũ.")
-        
-        # --- 1. Restore Users ---
-        users_cache = {} # username -> id
-        if 'Users' in xls.sheet_names:
-            df_users = pd.read_excel(xls, 'Users')
-            count_users = 0
-            for _, row in df_users.iterrows():
-                try:
-                    username = str(row['username']).strip()
-                    name = str(row['name']).strip()
-                    role = str(row['role']).strip()
-                    active = int(row['active'])
-                    
-                    cur = conn.execute('SELECT id FROM users WHERE username = ?', (username,))
-                    existing = cur.fetchone()
-                    
-                    if existing:
-                        users_cache[username] = existing['id']
-                    else:
-                        password_hash = generate_password_hash('123456')
-                        conn.execute('INSERT INTO users (username, password, name, role, active) VALUES (?, ?, ?, ?, ?)',
-                                (username, password_hash, name, role, active))
-                        cur = conn.execute('SELECT id FROM users WHERE username = ?', (username,))
-                        new_user = cur.fetchone()
-                        users_cache[username] = new_user['id']
-                        count_users += 1
-                except Exception as e:
-                    errors.append(f"Lỗi User {row.get('username')}: {e}")
-            success_msg.append(f"Đã thêm {count_users} users mới.")
-        
-        # Reload cache
-        cur = conn.execute('SELECT id, username FROM users')
-        for u in cur.fetchall():
-            users_cache[u['username']] = u['id']
-
-        # --- 1.5 Restore Categories ---
-        categories_cache = {} # name -> id
-        if 'Categories' in xls.sheet_names:
-            df_cats = pd.read_excel(xls, 'Categories')
-            count_cats = 0
-            for _, row in df_cats.iterrows():
-                try:
-                    name = str(row['name']).strip()
-                    cat_type = str(row['type']).strip()
-                    subtype = str(row['subtype']).strip() if 'subtype' in row and pd.notna(row['subtype']) else 'default'
-                    icon = str(row['icon']).strip() if 'icon' in row and pd.notna(row['icon']) else '📝'
-                    
-                    cur = conn.execute('SELECT id FROM categories WHERE name = ?', (name,))
-                    existing = cur.fetchone()
-                    
-                    if existing:
-                        categories_cache[name] = existing['id']
-                        # Update existing
-                        try:
-                            conn.execute('UPDATE categories SET type = ?, subtype = ?, icon = ? WHERE id = ?',
-                                    (cat_type, subtype, icon, existing['id']))
-                        except sqlite3.IntegrityError:
-                            pass # Ignore UNIQUE constraint on update
-                    else:
-                        try:
-                            conn.execute('INSERT INTO categories (name, type, subtype, icon) VALUES (?, ?, ?, ?)',
-                                    (name, cat_type, subtype, icon))
-                            cur = conn.execute('SELECT id FROM categories WHERE name = ?', (name,))
-                            new_cat = cur.fetchone()
-                            if new_cat:
-                                categories_cache[name] = new_cat['id']
-                                count_cats += 1
-                        except sqlite3.IntegrityError:
-                             # Retry fetch if race condition/duplicate
-                            cur = conn.execute('SELECT id FROM categories WHERE name = ?', (name,))
-                            existing_retry = cur.fetchone()
-                            if existing_retry:
-                                categories_cache[name] = existing_retry['id']
-
-                except Exception as e:
-                    errors.append(f"Lỗi Category {row.get('name')}: {e}")
-            success_msg.append(f"Đã đồng bộ {count_cats} danh mục mới.")
-        
-        # Reload cache
-        cur = conn.execute('SELECT id, name FROM categories')
-        for c in cur.fetchall():
-            categories_cache[c['name']] = c['id']
-
-        # --- 2. Restore Fund Groups ---
-        groups_cache = {} 
-        if 'FundGroups' in xls.sheet_names:
-            df_groups = pd.read_excel(xls, 'FundGroups')
-            count_groups = 0
-            for _, row in df_groups.iterrows():
-                try:
-                    name = str(row['name']).strip()
-                    created_by_user = str(row['created_by']).strip()
-                    creator_id = users_cache.get(created_by_user, 1)
-                    
-                    cur = conn.execute('SELECT id FROM fund_groups WHERE name = ?', (name,))
-                    existing = cur.fetchone()
-                    if existing:
-                        groups_cache[name] = existing['id']
-                    else:
-                        conn.execute('INSERT INTO fund_groups (name, created_by) VALUES (?, ?)', (name, creator_id))
-                        cur = conn.execute('SELECT id FROM fund_groups WHERE name = ?', (name,))
-                        new_group = cur.fetchone()
-                        groups_cache[name] = new_group['id']
-                        count_groups += 1
-                except Exception as e:
-                    errors.append(f"Lỗi Group {row.get('name')}: {e}")
-            success_msg.append(f"Đã thêm {count_groups} nhóm quỹ mới.")
-            
-        # Reload cache
-        cur = conn.execute('SELECT id, name FROM fund_groups')
-        for g in cur.fetchall():
-            groups_cache[g['name']] = g['id']
-
-        # --- 3. Restore Group Members ---
-        if 'GroupMembers' in xls.sheet_names:
-            df_members = pd.read_excel(xls, 'GroupMembers')
-            count_members = 0
-            for _, row in df_members.iterrows():
-                try:
-                    group_name = str(row['group_name']).strip()
-                    user_username = str(row['user_username']).strip()
-                    
-                    gid = groups_cache.get(group_name)
-                    uid = users_cache.get(user_username)
-                    
-                    if gid and uid:
-                        cur = conn.execute('SELECT id FROM fund_group_members WHERE group_id = ? AND user_id = ?', (gid, uid))
-                        existing = cur.fetchone()
-                        if not existing:
-                            conn.execute('INSERT INTO fund_group_members (group_id, user_id) VALUES (?, ?)', (gid, uid))
-                            count_members += 1
-                except Exception as e:
-                    errors.append(f"Lỗi Member {row.get('user_username')}: {e}")
-            success_msg.append(f"Đã khôi phục {count_members} thành viên nhóm.")
-
-        # --- 4. Restore Transactions ---
-        sheet_trans = 'Transactions' if 'Transactions' in xls.sheet_names else (xls.sheet_names[0] if xls.sheet_names else None)
-        if sheet_trans:
-            df = pd.read_excel(xls, sheet_trans)
-            
-            # Ensure categories cache is populated
-            if not categories_cache:
-                cur = conn.execute('SELECT id, name FROM categories')
-                for c in cur.fetchall():
-                    categories_cache[c['name']] = c['id']
-                
-            count_trans = 0
-            # Prepare batch insert data
-            trans_to_insert = []
-            
-            for index, row in df.iterrows():
-                try:
-                    # Resolve User
-                    user_id = None
-                    if 'Username' in row and pd.notna(row['Username']):
-                        user_id = users_cache.get(str(row['Username']).strip())
-                    
-                    if not user_id and 'Người dùng' in row:
-                        u_name = str(row['Người dùng']).strip()
-                        cur = conn.execute('SELECT id FROM users WHERE name = ?', (u_name,))
-                        u = cur.fetchone()
-                        if u: user_id = u['id']
-                        
-                    if not user_id:
-                         # Create user on fly?
-                        if 'Người dùng' in row:
-                             u_name = str(row['Người dùng']).strip()
-                             username = u_name.lower().replace(' ', '') + f"_{int(datetime.now().timestamp())}_{index}"
-                             password_hash = generate_password_hash('123456')
-                             conn.execute('INSERT INTO users (username, password, name, role, active) VALUES (?, ?, ?, ?, ?)',
-                                     (username, password_hash, u_name, 'user', 1))
-                             cur = conn.execute('SELECT id FROM users WHERE username = ?', (username,))
-                             new_u = cur.fetchone()
-                             user_id = new_u['id']
-                             users_cache[username] = user_id
-                    
-                    if not user_id: continue 
-                    
-                    # Resolve Category
-                    cat_name = str(row['Danh mục']).strip()
-                    cat_id = categories_cache.get(cat_name)
-                    if not cat_id:
-                        cat_type = row['Loại'] if 'Loại' in row else 'Chi'
-                        conn.execute('INSERT INTO categories (name, type, icon) VALUES (?, ?, ?)', (cat_name, cat_type, '📝'))
-                        cur = conn.execute('SELECT id FROM categories WHERE name = ?', (cat_name,))
-                        new_cat = cur.fetchone()
-                        cat_id = new_cat['id']
-                        categories_cache[cat_name] = cat_id
-                        
-                    # Normalize date
-                    date_val = pd.to_datetime(row['Ngày']).strftime('%Y-%m-%d')
-                    amount = float(row['Số tiền'])
-                    note = str(row['Ghi chú']) if 'Ghi chú' in row and pd.notna(row['Ghi chú']) else ''
-                    fund_purpose = str(row['Mục đích quỹ']) if 'Mục đích quỹ' in row and pd.notna(row['Mục đích quỹ']) else None
-                    trans_type = row['Loại']
-                    
-                    # Fund purpose check
-                    if fund_purpose:
-                        fund_purpose = fund_purpose.strip()
-                        cur = conn.execute("SELECT id FROM categories WHERE name = ? AND subtype = 'fund'", (fund_purpose,))
-                        existing_fund = cur.fetchone()
-                        if not existing_fund:
-                            conn.execute("INSERT INTO categories (name, type, subtype, icon) VALUES (?, ?, ?, ?)", 
-                                        (fund_purpose, 'Chi', 'fund', '💰'))
-                    
-                    # Add to batch
-                    trans_to_insert.append((user_id, date_val, trans_type, cat_id, amount, note, fund_purpose))
-                    count_trans += 1
-                    
-                except Exception as e:
-                    errors.append(f"Lỗi dòng {index + 2}: {e}")
-            
-            # Execute batch insert
-            if trans_to_insert:
-                conn.executemany('''
-                    INSERT INTO transactions (user_id, date, type, category_id, amount, note, fund_purpose)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', trans_to_insert)
-                
-            success_msg.append(f"Đã import {count_trans} giao dịch.")
-
-        # --- COMMIT TRANSACTION ---
-        conn.commit()
-        
-        return jsonify({
-            'success': True,
-            'message': '\n'.join(success_msg),
-            'errors': errors
-        })
+        job_id = submit_job('import_excel', _import_excel_job, upload_path, mode, delete_missing,
+                            created_by=session.get('user_id'))
+        return jsonify({'success': True, 'job_id': job_id}), 202
         
     except Exception as e:
-        if conn: conn.rollback()
+        if upload_path and os.path.exists(upload_path):
+            os.remove(upload_path)
         print(f"Lỗi khi import excel: {e}")
         traceback.print_exc()
         return jsonify({'error': f'Lỗi server: {str(e)}'}), 500
-    finally:
-        if conn: conn.close()
+
+
+def _create_snapshot_job(job):
+    job.stage('Snapshot')
+    name = create_snapshot(progress=lambda remaining, total: job.progress(total - remaining, total))
+    return {'message': f'Đã tạo snapshot {name}.'}
+
+
+def _restore_snapshot_job(job, path, uploaded=False):
+    job.stage('Khôi phục')
+    try:
+        backup_name = restore_snapshot(path)
+    except ValueError:
+        if uploaded and os.path.exists(path):
+            os.remove(path)  # file upload không hợp lệ, không giữ trong danh sách snapshot
+        raise
+    membership_graph.invalidate()
+    category_registry.invalidate()
+    return {'message': f'Đã khôi phục dữ liệu từ {os.path.basename(path)}. '
+                       f'Bản trước khi khôi phục được lưu ở {backup_name}.'}
+
+
+@bp.route('/api/backup/snapshots', methods=['GET'])
+@admin_required
+def get_snapshots():
+    """Danh sách snapshot đang lưu trên server"""
+    try:
+        return jsonify({'snapshots': list_snapshots()})
+    except Exception as e:
+        print(f"Lỗi khi lấy danh sách snapshot: {e}")
+        traceback.print_exc()
+        return jsonify({'error': f'Lỗi server: {str(e)}'}), 500
+
+@bp.route('/api/backup/snapshots', methods=['POST'])
+@admin_required
+def create_snapshot_route():
+    """Tạo snapshot nhị phân của DB (chạy nền, trả job id)"""
+    try:
+        job_id = submit_job('snapshot', _create_snapshot_job, created_by=session.get('user_id'))
+        return jsonify({'success': True, 'job_id': job_id}), 202
+    except Exception as e:
+        print(f"Lỗi khi tạo snapshot: {e}")
+        traceback.print_exc()
+        return jsonify({'error': f'Lỗi server: {str(e)}'}), 500
+
+@bp.route('/api/backup/snapshots/<name>', methods=['GET'])
+@admin_required
+def download_snapshot(name):
+    """Tải một snapshot về máy"""
+    try:
+        path = snapshot_path(name)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not os.path.exists(path):
+        return jsonify({'error': 'Không tìm thấy snapshot'}), 404
+    return send_file(os.path.abspath(path), mimetype='application/gzip',
+                     as_attachment=True, download_name=name)
+
+@bp.route('/api/backup/snapshots/<name>/restore', methods=['POST'])
+@admin_required
+def restore_snapshot_route(name):
+    """Khôi phục DB từ một snapshot đang lưu (chạy nền, trả job id)"""
+    try:
+        path = snapshot_path(name)
+        if not os.path.exists(path):
+            return jsonify({'error': 'Không tìm thấy snapshot'}), 404
+        job_id = submit_job('restore_snapshot', _restore_snapshot_job, path,
+                            created_by=session.get('user_id'))
+        return jsonify({'success': True, 'job_id': job_id}), 202
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Lỗi khi khôi phục snapshot: {e}")
+        traceback.print_exc()
+        return jsonify({'error': f'Lỗi server: {str(e)}'}), 500
+
+@bp.route('/api/backup/restore', methods=['POST'])
+@admin_required
+def upload_snapshot():
+    """Upload một snapshot (.db.gz) rồi khôi phục từ nó (chạy nền, trả job id)"""
+    try:
+        file = request.files.get('file')
+        if not file or file.filename == '':
+            return jsonify({'error': 'Chưa chọn file'}), 400
+        if not file.filename.endswith(('.db.gz', '.db')):
+            return jsonify({'error': 'Chỉ hỗ trợ file snapshot (.db.gz, .db)'}), 400
+
+        path = snapshot_path(new_snapshot_name('upload'))
+        file.save(path)
+        job_id = submit_job('restore_snapshot', _restore_snapshot_job, path, True,
+                            created_by=session.get('user_id'))
+        return jsonify({'success': True, 'job_id': job_id}), 202
+    except Exception as e:
+        print(f"Lỗi khi upload snapshot: {e}")
+        traceback.print_exc()
+        return jsonify({'error': f'Lỗi server: {str(e)}'}), 500
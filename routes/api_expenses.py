@@ -3,17 +3,149 @@ API Routes cho quản lý chi tiêu (expenses), calendar, reports
 """
 from flask import Blueprint, request, jsonify, session
 from datetime import datetime
+import base64
+import math
 import traceback
-from utils.decorators import login_required
-from utils.db_utils import query_db, execute_db
+from utils.decorators import login_required, versioned_etag
+from utils.db_utils import query_db, execute_db, db_connection
+from utils.dates import to_db_date, to_display_date
+from utils.categories import category_registry, split_display, CATEGORY_MATCH_SQL
+from utils.changelog import current_cursor, changes_since
+from config import config
 
 bp = Blueprint('api_expenses', __name__)
 
 
+def _write_with_category(sql, params, danh_muc_full, loai):
+    """Chạy câu lệnh ghi giao dịch có ``category_id`` lấy từ registry danh mục.
+
+    ``sql`` có 3 placeholder cuối cho CATEGORY_MATCH_SQL và ``params(cat_id)`` trả về
+    phần tham số còn lại. Trường hợp thường gặp (danh mục đã có trong cache) chỉ là một
+    câu lệnh SQL; nếu id trong cache đã cũ thì nạp lại registry và chạy lại một lần.
+    Không có dòng nào bị ảnh hưởng vì lý do khác (giao dịch không tồn tại/không thuộc
+    user) thì trả về 0 ngay, không nạp lại registry. Trả về số dòng bị ảnh hưởng;
+    RuntimeError nếu danh mục vẫn không khớp sau khi nạp lại (vừa bị đổi tiếp).
+    """
+    icon, cat_name = split_display(danh_muc_full)
+    for attempt in range(2):
+        cat_id = category_registry.resolve(cat_name, loai, icon)
+        with db_connection() as conn:
+            try:
+                cur = conn.execute(sql, (*params(cat_id), cat_id, cat_name, loai))
+                conn.commit()
+                stale = not cur.rowcount and not conn.execute(
+                    f'SELECT {CATEGORY_MATCH_SQL}', (cat_id, cat_name, loai)
+                ).fetchone()[0]
+            except Exception:
+                conn.rollback()
+                raise
+        if not stale:
+            return cur.rowcount
+        category_registry.refresh()
+    raise RuntimeError('Danh mục vừa bị thay đổi, vui lòng thử lại')
+
+
+def _parse_expense(data, default_loai='Chi', require_amount=True):
+    """Kiểm tra một giao dịch từ form/API, trả về (date, loai, danh_muc, so_tien, ghi_chu, quy).
+
+    Raise ValueError với thông báo cho người dùng nếu dữ liệu không hợp lệ.
+    """
+    ngay = data.get('ngay', '') # DD/MM/YYYY
+    loai = data.get('loai', default_loai)
+    danh_muc_full = data.get('danh_muc', '') # Icon + Name
+    try:
+        so_tien = float(data.get('so_tien', 0))
+    except (TypeError, ValueError):
+        raise ValueError('Số tiền không hợp lệ')
+    if not math.isfinite(so_tien):
+        # "nan"/"inf" và NaN/Infinity của JSON đều parse được bằng float()
+        raise ValueError('Số tiền không hợp lệ')
+    
+    if not ngay or not danh_muc_full or (require_amount and so_tien <= 0):
+        raise ValueError('Vui lòng điền đầy đủ thông tin')
+    try:
+        date_str = to_db_date(ngay, formats=('%d/%m/%Y',))
+    except ValueError:
+        raise ValueError('Định dạng ngày không hợp lệ')
+    return date_str, loai, danh_muc_full, so_tien, data.get('ghi_chu', ''), data.get('quy', '')
+
+
+def _month_range(year, month):
+    """Khoảng ngày nửa mở [đầu tháng, đầu tháng sau) dạng chuỗi YYYY-MM-DD"""
+    start_date = f"{year}-{month:02d}-01"
+    if month == 12:
+        end_date = f"{year+1}-01-01"
+    else:
+        end_date = f"{year}-{month+1:02d}-01"
+    return start_date, end_date
+
+
+# Ngày đã được chuẩn hóa YYYY-MM-DD nên thứ trong tuần lấy luôn từ SQLite (%w: 0 = Chủ nhật)
+_CALENDAR_SELECT = '''
+    SELECT t.id, t.date, CAST(strftime('%w', t.date) AS INTEGER) as weekday,
+           t.type, t.amount, t.note, t.fund_purpose, c.name as category_name, c.icon as category_icon
+    FROM transactions t
+    LEFT JOIN categories c ON t.category_id = c.id
+'''
+_DAY_NAMES = ['CN', 'T2', 'T3', 'T4', 'T5', 'T6', 'T7']
+
+
+def _fund_icons(conn):
+    rows = conn.execute("SELECT name, icon FROM categories WHERE subtype = 'fund'").fetchall()
+    return {row['name']: row['icon'] for row in rows}
+
+
+def _calendar_transaction(row, fund_icons):
+    """Một giao dịch dạng calendar view.
+
+    ``cot_tong``: cột tổng ngày/tháng mà giao dịch được cộng vào ('thu', 'chi'
+    hoặc '' - Chi quỹ không tính), để client tự tính lại tổng khi áp dụng /api/sync.
+    """
+    loai = row['type'].lower()
+    danh_muc = row['category_name']
+    icon = row['category_icon']
+    
+    # Handle fund icon
+    fund_purpose = row['fund_purpose']
+    quy_display = fund_purpose or ''
+    
+    if fund_purpose and fund_purpose in fund_icons:
+        icon_char = fund_icons[fund_purpose]
+        if icon_char:
+            quy_display = f"{icon_char} {fund_purpose}"
+
+    if icon:
+        danh_muc = f"{icon} {danh_muc}"
+    
+    # Thu quỹ tính như khoản chi, Chi quỹ không tính vào tổng
+    cat_name_only = row['category_name']
+    if loai == 'thu':
+        cot_tong = 'thu' if cat_name_only != 'Thu quỹ' else 'chi'
+    elif loai == 'chi':
+        cot_tong = 'chi' if cat_name_only != 'Chi quỹ' else ''
+    else:
+        cot_tong = ''
+    
+    return {
+        'row_id': row['id'],  # Use DB ID as row_id
+        'loai': loai,
+        'danh_muc': danh_muc,
+        'so_tien': row['amount'],
+        'ghi_chu': row['note'] or '',
+        'quy': quy_display,
+        'ngay': to_display_date(row['date']),
+        'cot_tong': cot_tong
+    }
+
+
 @bp.route('/api/calendar', methods=['GET'])
 @login_required
+@versioned_etag('categories', 'sync_horizon')
 def get_calendar_data():
-    """API lấy dữ liệu lịch cho calendar view"""
+    """API lấy dữ liệu lịch cho calendar view
+
+    ``sync_cursor`` trong response dùng cho /api/sync để lấy các thay đổi sau đó.
+    """
     user_id = session.get('user_id')
     if not user_id:
         return jsonify({'error': 'User not found'}), 401
@@ -27,98 +159,46 @@ def get_calendar_data():
     
     try:
         # Build query
-        sql = '''
-            SELECT t.id, t.date, t.type, t.amount, t.note, t.fund_purpose, c.name as category_name, c.icon as category_icon
-            FROM transactions t
-            LEFT JOIN categories c ON t.category_id = c.id
-            WHERE t.user_id = ?
-        '''
+        sql = _CALENDAR_SELECT + " WHERE t.user_id = ?"
         params = [user_id]
         
         if month is not None and year is not None:
             # Filter by month/year
             # SQLite date is text YYYY-MM-DD
-            start_date = f"{year}-{month:02d}-01"
-            if month == 12:
-                end_date = f"{year+1}-01-01"
-            else:
-                end_date = f"{year}-{month+1:02d}-01"
-                
+            start_date, end_date = _month_range(year, month)
             sql += " AND t.date >= ? AND t.date < ?"
             params.extend([start_date, end_date])
-            
-        # Get fund icons map
-        fund_rows = query_db("SELECT name, icon FROM categories WHERE subtype = 'fund'")
-        fund_icons = {row['name']: row['icon'] for row in fund_rows}
-            
-        rows = query_db(sql, params)
+        
+        # Sắp xếp ngay trong SQL (mới nhất trước) để nhóm theo ngày giữ đúng thứ tự
+        sql += " ORDER BY t.date DESC, t.id"
+        
+        with db_connection() as conn:
+            # Đọc cursor trước dữ liệu: thay đổi xen giữa sẽ được /api/sync gửi lại (áp dụng lại vô hại)
+            sync_cursor = current_cursor(conn)
+            # Get fund icons map
+            fund_icons = _fund_icons(conn)
+            rows = conn.execute(sql, params).fetchall()
         
         for row in rows:
             try:
-                date_str = row['date'] # YYYY-MM-DD or YYYY-MM-DD HH:MM:SS
-                # Try to parse with multiple formats
-                try:
-                    ngay = datetime.strptime(date_str, '%Y-%m-%d')
-                except ValueError:
-                    try:
-                        ngay = datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
-                    except ValueError:
-                        # Try ISO format with T
-                        ngay = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-                
-                date_key = ngay.strftime('%d/%m/%Y')
-                day_name = ['CN', 'T2', 'T3', 'T4', 'T5', 'T6', 'T7'][ngay.weekday()]
+                transaction = _calendar_transaction(row, fund_icons)
+                date_key = transaction['ngay']
                 
                 if date_key not in transactions_by_date:
                     transactions_by_date[date_key] = {
                         'date': date_key,
-                        'day_name': day_name,
+                        'day_name': _DAY_NAMES[row['weekday']],
                         'transactions': []
                     }
                     daily_totals[date_key] = {'thu': 0, 'chi': 0}
                 
-                loai = row['type'].lower()
-                so_tien = row['amount']
-                danh_muc = row['category_name']
-                icon = row['category_icon']
-                
-                # Handle fund icon
-                fund_purpose = row['fund_purpose']
-                quy_display = fund_purpose or ''
-                
-                if fund_purpose and fund_purpose in fund_icons:
-                    icon_char = fund_icons[fund_purpose]
-                    if icon_char:
-                        quy_display = f"{icon_char} {fund_purpose}"
-
-                if icon:
-                    danh_muc = f"{icon} {danh_muc}"
-                
-                transaction = {
-                    'row_id': row['id'],  # Use DB ID as row_id
-                    'loai': loai,
-                    'danh_muc': danh_muc,
-                    'so_tien': so_tien,
-                    'ghi_chu': row['note'] or '',
-                    'quy': quy_display,
-                    'ngay': date_key
-                }
                 transactions_by_date[date_key]['transactions'].append(transaction)
                 
                 # Calculate totals
-                cat_name_only = row['category_name']
-                
-                if loai == 'thu':
-                    if cat_name_only != 'Thu quỹ':
-                        daily_totals[date_key]['thu'] += so_tien
-                        monthly_summary['thu'] += so_tien
-                    else:
-                        daily_totals[date_key]['chi'] += so_tien
-                        monthly_summary['chi'] += so_tien
-                elif loai == 'chi':
-                    if cat_name_only != 'Chi quỹ':
-                        daily_totals[date_key]['chi'] += so_tien
-                        monthly_summary['chi'] += so_tien
+                cot_tong = transaction['cot_tong']
+                if cot_tong:
+                    daily_totals[date_key][cot_tong] += transaction['so_tien']
+                    monthly_summary[cot_tong] += transaction['so_tien']
             except Exception as e:
                 print(f"Error processing row: {e}")
                 continue
@@ -130,18 +210,206 @@ def get_calendar_data():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
     
-    sorted_dates = sorted(transactions_by_date.keys(), key=lambda x: datetime.strptime(x, '%d/%m/%Y'), reverse=True)
-    sorted_transactions = [transactions_by_date[date] for date in sorted_dates]
+    # Dict giữ thứ tự chèn = thứ tự ngày giảm dần từ SQL
+    sorted_transactions = list(transactions_by_date.values())
     
     return jsonify({
         'transactions_by_date': sorted_transactions,
         'daily_totals': daily_totals,
-        'monthly_summary': monthly_summary
+        'monthly_summary': monthly_summary,
+        'sync_cursor': sync_cursor
     })
 
 
+@bp.route('/api/sync', methods=['GET'])
+@login_required
+def sync_transactions():
+    """Các giao dịch của user được thêm/sửa/xóa sau cursor ``since``
+
+    ``since`` lấy từ ``sync_cursor`` của /api/calendar hoặc ``cursor`` của lần sync trước.
+    Trả về {'cursor', 'changed': [giao dịch dạng calendar + date, day_name], 'deleted': [id]};
+    {'reset': true, 'cursor'} khi client phải tải lại toàn bộ (cursor quá cũ, danh mục đã
+    đổi hoặc quá SYNC_MAX_CHANGES thay đổi).
+    """
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'User not found'}), 401
+    
+    since = request.args.get('since', '')
+    try:
+        with db_connection() as conn:
+            # Một transaction đọc: cursor mới khớp đúng tập thay đổi trả về
+            conn.execute('BEGIN')
+            try:
+                cursor = current_cursor(conn)
+                if not since:
+                    return jsonify({'cursor': cursor, 'changed': [], 'deleted': []})
+                try:
+                    result = changes_since(conn, user_id, since, config.SYNC_MAX_CHANGES)
+                except ValueError as e:
+                    return jsonify({'error': str(e)}), 400
+                if result is None:
+                    return jsonify({'reset': True, 'cursor': cursor})
+                
+                changed_ids, deleted = result
+                rows = []
+                if changed_ids:
+                    placeholders = ','.join(['?'] * len(changed_ids))
+                    rows = conn.execute(
+                        _CALENDAR_SELECT + f" WHERE t.user_id = ? AND t.id IN ({placeholders}) ORDER BY t.date DESC, t.id",
+                        [user_id, *changed_ids]
+                    ).fetchall()
+                fund_icons = _fund_icons(conn) if rows else {}
+            finally:
+                conn.rollback()
+        
+        changed = []
+        for row in rows:
+            transaction = _calendar_transaction(row, fund_icons)
+            transaction.update(date=row['date'], day_name=_DAY_NAMES[row['weekday']])
+            changed.append(transaction)
+        return jsonify({'cursor': cursor, 'changed': changed, 'deleted': deleted})
+        
+    except Exception as e:
+        print(f"Lỗi khi đồng bộ giao dịch: {e}")
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+
+# Cột tổng hợp dùng chung cho các báo cáo năm/tháng/ngày (đọc từ bảng daily_totals)
+_REPORT_SUMS = """
+    SUM(CASE WHEN type = 'Thu' THEN total ELSE 0 END) as income,
+    SUM(CASE WHEN type = 'Chi' THEN total ELSE 0 END) as expense,
+    SUM(CASE WHEN is_fund = 1 THEN total ELSE 0 END) as fund
+"""
+
+
+def _encode_cursor(date_str, row_id):
+    return base64.urlsafe_b64encode(f"{date_str}|{row_id}".encode()).decode()
+
+
+def _decode_cursor(cursor):
+    """Giải mã cursor (date, id); ValueError nếu cursor không hợp lệ"""
+    try:
+        date_str, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+        return date_str, int(row_id)
+    except Exception:
+        raise ValueError('Cursor không hợp lệ')
+
+
+@bp.route('/api/transactions', methods=['GET'])
+@login_required
+@versioned_etag('categories')
+def list_transactions():
+    """API liệt kê giao dịch có lọc, phân trang bằng cursor (keyset trên date, id - mới nhất trước)
+
+    Tham số: from, to (YYYY-MM-DD, nửa mở [from, to)), type (Thu/Chi), category_id,
+    fund_purpose, min_amount, max_amount, q (tìm trong ghi chú), limit, cursor.
+    """
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'User not found'}), 401
+    
+    try:
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+        
+        sql = '''
+            SELECT t.id, t.date, t.type, t.category_id, t.amount, t.note, t.fund_purpose,
+                   c.name as category_name, c.icon as category_icon
+            FROM transactions t
+            LEFT JOIN categories c ON t.category_id = c.id
+            WHERE t.user_id = ?
+        '''
+        params = [user_id]
+        
+        for arg, op in (('from', '>='), ('to', '<')):
+            value = request.args.get(arg)
+            if value:
+                try:
+                    datetime.strptime(value, '%Y-%m-%d')
+                except ValueError:
+                    return jsonify({'error': f'Tham số {arg} phải có dạng YYYY-MM-DD'}), 400
+                sql += f" AND t.date {op} ?"
+                params.append(value)
+        
+        trans_type = request.args.get('type')
+        if trans_type:
+            sql += " AND t.type = ?"
+            params.append(trans_type)
+        
+        category_id = request.args.get('category_id', type=int)
+        if category_id is not None:
+            sql += " AND t.category_id = ?"
+            params.append(category_id)
+        
+        fund_purpose = request.args.get('fund_purpose')
+        if fund_purpose:
+            sql += " AND t.fund_purpose = ?"
+            params.append(fund_purpose)
+        
+        min_amount = request.args.get('min_amount', type=float)
+        if min_amount is not None:
+            sql += " AND t.amount >= ?"
+            params.append(min_amount)
+        
+        max_amount = request.args.get('max_amount', type=float)
+        if max_amount is not None:
+            sql += " AND t.amount <= ?"
+            params.append(max_amount)
+        
+        q = request.args.get('q', '').strip()
+        if q:
+            sql += " AND t.note LIKE ? ESCAPE '\\'"
+            escaped = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            params.append(f"%{escaped}%")
+        
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                cursor_date, cursor_id = _decode_cursor(cursor)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            # Keyset: chỉ lấy các dòng đứng sau dòng cuối của trang trước
+            sql += " AND (t.date, t.id) < (?, ?)"
+            params.extend([cursor_date, cursor_id])
+        
+        sql += " ORDER BY t.date DESC, t.id DESC LIMIT ?"
+        params.append(limit + 1)
+        
+        rows = query_db(sql, params)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        
+        transactions = []
+        for row in rows:
+            danh_muc = row['category_name']
+            if row['category_icon']:
+                danh_muc = f"{row['category_icon']} {danh_muc}"
+            date_str = row['date']
+            transactions.append({
+                'row_id': row['id'],
+                'date': date_str,
+                'ngay': to_display_date(date_str),
+                'loai': row['type'].lower(),
+                'category_id': row['category_id'],
+                'danh_muc': danh_muc,
+                'so_tien': row['amount'],
+                'ghi_chu': row['note'] or '',
+                'quy': row['fund_purpose'] or ''
+            })
+        
+        next_cursor = _encode_cursor(rows[-1]['date'], rows[-1]['id']) if has_more else None
+        return jsonify({'transactions': transactions, 'next_cursor': next_cursor})
+        
+    except Exception as e:
+        print(f"Lỗi khi liệt kê giao dịch: {e}")
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+
 @bp.route('/api/user_yearly_report', methods=['GET'])
 @login_required
+@versioned_etag()
 def get_yearly_report():
     """API trả về báo cáo theo năm"""
     try:
@@ -151,12 +419,14 @@ def get_yearly_report():
         current_year = datetime.now().year
         start_year = current_year - years + 1
         
-        sql = '''
-            SELECT strftime('%Y', date) as year, type, amount, fund_purpose
-            FROM transactions
-            WHERE user_id = ? AND strftime('%Y', date) >= ?
+        # Lọc theo khoảng ngày trên khóa chính (user_id, date, ...) của daily_totals
+        sql = f'''
+            SELECT substr(date, 1, 4) as year, {_REPORT_SUMS}
+            FROM daily_totals
+            WHERE user_id = ? AND date >= ? AND date < ?
+            GROUP BY year
         '''
-        rows = query_db(sql, (user_id, str(start_year)))
+        rows = query_db(sql, (user_id, f"{start_year}-01-01", f"{current_year+1}-01-01"))
         
         report_data = {} # year -> {income, expense, fund}
         for y in range(start_year, current_year + 1):
@@ -165,14 +435,7 @@ def get_yearly_report():
         for row in rows:
             y = int(row['year'])
             if y in report_data:
-                amount = row['amount']
-                if row['type'] == 'Thu':
-                    report_data[y]['income'] += amount
-                elif row['type'] == 'Chi':
-                    report_data[y]['expense'] += amount
-                    
-                if row['fund_purpose']:
-                    report_data[y]['fund'] += amount
+                report_data[y].update(income=row['income'], expense=row['expense'], fund=row['fund'])
                     
         result = [report_data[y] for y in sorted(report_data.keys())]
         return jsonify({'years': result})
@@ -185,31 +448,27 @@ def get_yearly_report():
 
 @bp.route('/api/user_monthly_report', methods=['GET'])
 @login_required
+@versioned_etag()
 def get_monthly_report():
     """API trả về báo cáo theo tháng trong năm hiện tại"""
     try:
         user_id = session.get('user_id')
         current_year = datetime.now().year
         
-        sql = '''
-            SELECT strftime('%m', date) as month, type, amount, fund_purpose
-            FROM transactions
-            WHERE user_id = ? AND strftime('%Y', date) = ?
+        sql = f'''
+            SELECT substr(date, 6, 2) as month, {_REPORT_SUMS}
+            FROM daily_totals
+            WHERE user_id = ? AND date >= ? AND date < ?
+            GROUP BY month
         '''
-        rows = query_db(sql, (user_id, str(current_year)))
+        rows = query_db(sql, (user_id, f"{current_year}-01-01", f"{current_year+1}-01-01"))
         
         months_data = {m: {'month': m, 'income': 0, 'expense': 0, 'fund': 0} for m in range(1, 13)}
         
         for row in rows:
             m = int(row['month'])
-            amount = row['amount']
-            if row['type'] == 'Thu':
-                months_data[m]['income'] += amount
-            elif row['type'] == 'Chi':
-                months_data[m]['expense'] += amount
-                
-            if row['fund_purpose']:
-                months_data[m]['fund'] += amount
+            if m in months_data:
+                months_data[m].update(income=row['income'], expense=row['expense'], fund=row['fund'])
                 
         result = [months_data[m] for m in range(1, 13)]
         return jsonify({'months': result})
@@ -222,6 +481,7 @@ def get_monthly_report():
 
 @bp.route('/api/user_daily_report', methods=['GET'])
 @login_required
+@versioned_etag()
 def get_daily_report():
     """API trả về báo cáo theo ngày trong tháng hiện tại"""
     try:
@@ -234,25 +494,21 @@ def get_daily_report():
         import calendar
         days_in_month = calendar.monthrange(current_year, current_month)[1]
         
-        sql = '''
-            SELECT strftime('%d', date) as day, type, amount, fund_purpose
-            FROM transactions
-            WHERE user_id = ? AND strftime('%Y', date) = ? AND strftime('%m', date) = ?
+        start_date, end_date = _month_range(current_year, current_month)
+        sql = f'''
+            SELECT substr(date, 9, 2) as day, {_REPORT_SUMS}
+            FROM daily_totals
+            WHERE user_id = ? AND date >= ? AND date < ?
+            GROUP BY day
         '''
-        rows = query_db(sql, (user_id, str(current_year), str(current_month).zfill(2)))
+        rows = query_db(sql, (user_id, start_date, end_date))
         
         days_data = {d: {'day': d, 'income': 0, 'expense': 0, 'fund': 0} for d in range(1, days_in_month + 1)}
         
         for row in rows:
             d = int(row['day'])
-            amount = row['amount']
-            if row['type'] == 'Thu':
-                days_data[d]['income'] += amount
-            elif row['type'] == 'Chi':
-                days_data[d]['expense'] += amount
-                
-            if row['fund_purpose']:
-                days_data[d]['fund'] += amount
+            if d in days_data:
+                days_data[d].update(income=row['income'], expense=row['expense'], fund=row['fund'])
                 
         result = [days_data[d] for d in range(1, days_in_month + 1)]
         return jsonify({'days': result, 'month': current_month, 'year': current_year})
@@ -265,6 +521,7 @@ def get_daily_report():
 
 @bp.route('/api/user_category_breakdown', methods=['GET'])
 @login_required
+@versioned_etag('categories')
 def get_category_breakdown():
     """API trả về phân bổ chi tiêu theo danh mục trong tháng hiện tại"""
     try:
@@ -273,16 +530,17 @@ def get_category_breakdown():
         current_year = now.year
         current_month = now.month
         
+        start_date, end_date = _month_range(current_year, current_month)
         sql = '''
-            SELECT c.name as category_name, SUM(t.amount) as total
-            FROM transactions t
-            JOIN categories c ON t.category_id = c.id
-            WHERE t.user_id = ? AND t.type = 'Chi' 
-                AND strftime('%Y', t.date) = ? AND strftime('%m', t.date) = ?
+            SELECT c.name as category_name, SUM(d.total) as total
+            FROM daily_totals d
+            JOIN categories c ON d.category_id = c.id
+            WHERE d.user_id = ? AND d.type = 'Chi' 
+                AND d.date >= ? AND d.date < ?
             GROUP BY c.name
             ORDER BY total DESC
         '''
-        rows = query_db(sql, (user_id, str(current_year), str(current_month).zfill(2)))
+        rows = query_db(sql, (user_id, start_date, end_date))
         
         categories = []
         for row in rows:
@@ -309,59 +567,28 @@ def add_expense():
     """Thêm chi tiêu mới"""
     data = request.get_json()
     
-    ngay = data.get('ngay', '') # DD/MM/YYYY
-    loai = data.get('loai', 'Chi')
-    danh_muc_full = data.get('danh_muc', '') # Icon + Name
-    so_tien = data.get('so_tien', 0)
-    ghi_chu = data.get('ghi_chu', '')
-    quy = data.get('quy', '')
-    
-    if not ngay or not danh_muc_full or so_tien <= 0:
-        return jsonify({'error': 'Vui lòng điền đầy đủ thông tin'}), 400
+    try:
+        date_str, loai, danh_muc_full, so_tien, ghi_chu, quy = _parse_expense(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     user_id = session.get('user_id')
     
     try:
-        # Parse date
-        try:
-            date_obj = datetime.strptime(ngay, '%d/%m/%Y')
-            date_str = date_obj.strftime('%Y-%m-%d')
-        except:
-            return jsonify({'error': 'Định dạng ngày không hợp lệ'}), 400
-            
-        # Parse category
-        import re
-        match = re.search(r'[A-Za-zÀ-ỹ]', danh_muc_full)
-        if match:
-            cat_name = danh_muc_full[match.start():].strip()
-        else:
-            cat_name = danh_muc_full
-            
-        # Find category ID
-        cat = query_db('SELECT id FROM categories WHERE name = ? AND type = ?', (cat_name, loai), one=True)
-        if not cat:
-            # Create if not exists
-            icon = ''
-            if match and match.start() > 0:
-                icon = danh_muc_full[:match.start()].strip()
-                
-            execute_db(
-                'INSERT INTO categories (name, type, subtype, icon) VALUES (?, ?, ?, ?)',
-                (cat_name, loai, 'normal', icon)
-            )
-            cat = query_db('SELECT id FROM categories WHERE name = ? AND type = ?', (cat_name, loai), one=True)
-        
-        cat_id = cat['id']
-        
-        execute_db(
-            '''INSERT INTO transactions 
+        inserted = _write_with_category(
+            f'''INSERT INTO transactions 
                (user_id, date, type, category_id, amount, note, fund_purpose) 
-               VALUES (?, ?, ?, ?, ?, ?, ?)''',
-            (user_id, date_str, loai, cat_id, float(so_tien), ghi_chu, quy)
+               SELECT ?, ?, ?, ?, ?, ?, ? WHERE {CATEGORY_MATCH_SQL}''',
+            lambda cat_id: (user_id, date_str, loai, cat_id, so_tien, ghi_chu, quy),
+            danh_muc_full, loai
         )
+        if not inserted:
+            return jsonify({'error': 'Danh mục vừa bị thay đổi, vui lòng thử lại'}), 409
         
         return jsonify({'success': True, 'message': 'Thêm chi tiêu thành công!'})
         
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
     except Exception as e:
         print(f"Lỗi khi thêm chi tiêu: {e}")
         traceback.print_exc()
@@ -374,60 +601,29 @@ def update_expense(row_id):
     """Sửa giao dịch"""
     data = request.get_json()
     
-    ngay = data.get('ngay', '')
-    loai = data.get('loai', '')
-    danh_muc_full = data.get('danh_muc', '')
-    so_tien = data.get('so_tien', 0)
-    ghi_chu = data.get('ghi_chu', '')
-    quy = data.get('quy', '')
-    
-    if not ngay or not danh_muc_full:
-        return jsonify({'error': 'Vui lòng điền đầy đủ thông tin'}), 400
+    try:
+        date_str, loai, danh_muc_full, so_tien, ghi_chu, quy = _parse_expense(data, default_loai='', require_amount=False)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
         
     user_id = session.get('user_id')
     
     try:
-        # Parse date
-        date_obj = datetime.strptime(ngay, '%d/%m/%Y')
-        date_str = date_obj.strftime('%Y-%m-%d')
-        
-        # Parse category
-        import re
-        match = re.search(r'[A-Za-zÀ-ỹ]', danh_muc_full)
-        if match:
-            cat_name = danh_muc_full[match.start():].strip()
-        else:
-            cat_name = danh_muc_full
-            
-        cat = query_db('SELECT id FROM categories WHERE name = ? AND type = ?', (cat_name, loai), one=True)
-        if not cat:
-             # Create if not exists
-            icon = ''
-            if match and match.start() > 0:
-                icon = danh_muc_full[:match.start()].strip()
-            execute_db(
-                'INSERT INTO categories (name, type, subtype, icon) VALUES (?, ?, ?, ?)',
-                (cat_name, loai, 'normal', icon)
-            )
-            cat = query_db('SELECT id FROM categories WHERE name = ? AND type = ?', (cat_name, loai), one=True)
-            
-        cat_id = cat['id']
-        
-        # Update
-        # Verify ownership
-        trans = query_db('SELECT id FROM transactions WHERE id = ? AND user_id = ?', (row_id, user_id), one=True)
-        if not trans:
-            return jsonify({'error': 'Không tìm thấy giao dịch'}), 404
-            
-        execute_db(
-            '''UPDATE transactions 
+        # Kiểm tra quyền sở hữu ngay trong câu UPDATE: 0 dòng = không phải giao dịch của user
+        updated = _write_with_category(
+            f'''UPDATE transactions 
                SET date=?, type=?, category_id=?, amount=?, note=?, fund_purpose=?
-               WHERE id=?''',
-            (date_str, loai, cat_id, float(so_tien), ghi_chu, quy, row_id)
+               WHERE id=? AND user_id=? AND {CATEGORY_MATCH_SQL}''',
+            lambda cat_id: (date_str, loai, cat_id, so_tien, ghi_chu, quy, row_id, user_id),
+            danh_muc_full, loai
         )
+        if not updated:
+            return jsonify({'error': 'Không tìm thấy giao dịch'}), 404
         
         return jsonify({'success': True, 'message': 'Sửa giao dịch thành công!'})
         
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
     except Exception as e:
         print(f"Lỗi khi sửa chi tiêu: {e}")
         traceback.print_exc()
@@ -454,3 +650,196 @@ def delete_expense(row_id):
         print(f"Lỗi khi xóa chi tiêu: {e}")
         traceback.print_exc()
         return jsonify({'error': f'Lỗi: {str(e)}'}), 500
+
+
+def _batch_items(data, key):
+    """Mảng các mục của request hàng loạt: body là mảng JSON hoặc object có ``key``"""
+    items = data.get(key) if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        raise ValueError('Dữ liệu phải là một mảng không rỗng')
+    if len(items) > config.BATCH_MAX_ITEMS:
+        raise ValueError(f'Tối đa {config.BATCH_MAX_ITEMS} mục mỗi lần')
+    return items
+
+
+def _parse_batch(items, parse, item_type=dict):
+    """Kiểm tra từng mục; trả về (các mục hợp lệ [(index, giá trị)], results với lỗi đã điền)"""
+    valid, results = [], [None] * len(items)
+    for index, item in enumerate(items):
+        try:
+            if not isinstance(item, item_type) or isinstance(item, bool):
+                raise ValueError('Mục không hợp lệ')
+            valid.append((index, parse(item)))
+        except ValueError as e:
+            results[index] = {'index': index, 'success': False, 'error': str(e)}
+    return valid, results
+
+
+def _write_batch(parsed, write):
+    """Chạy ``write(conn, cat_ids)`` cho các giao dịch đã kiểm tra trong một transaction ghi.
+
+    Danh mục được resolve một lần cho mỗi (tên, loại) khác nhau qua registry, rồi kiểm tra
+    lại bằng một truy vấn trong chính transaction; id cũ (worker khác vừa đổi danh mục)
+    thì nạp lại registry và chạy lại một lần. ``cat_ids``: {danh_muc hiển thị + loại: id}.
+    """
+    names = {}
+    for date_str, loai, danh_muc_full, *rest in parsed:
+        icon, cat_name = split_display(danh_muc_full)
+        names.setdefault((danh_muc_full, loai), (cat_name, loai, icon))
+    
+    for attempt in range(2):
+        cat_ids = {key: category_registry.resolve(*value) for key, value in names.items()}
+        by_name = {(name, loai): cat_ids[key] for key, (name, loai, icon) in names.items()}
+        with db_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if not by_name or category_registry.matches(conn, by_name):
+                    result = write(conn, cat_ids)
+                    conn.commit()
+                    return result
+                conn.rollback()
+            except Exception:
+                conn.rollback()
+                raise
+        category_registry.refresh()
+    raise RuntimeError('Danh mục vừa bị thay đổi, vui lòng thử lại')
+
+
+def _owned_ids(conn, user_id, ids):
+    placeholders = ','.join(['?'] * len(ids))
+    rows = conn.execute(
+        f'SELECT id FROM transactions WHERE user_id = ? AND id IN ({placeholders})', [user_id, *ids]
+    ).fetchall()
+    return {r['id'] for r in rows}
+
+
+def _batch_response(results, verb):
+    done = sum(1 for r in results if r['success'])
+    return jsonify({
+        'success': done == len(results),
+        'message': f'Đã {verb} {done}/{len(results)} giao dịch.',
+        'results': results
+    })
+
+
+@bp.route('/api/expenses/batch', methods=['POST'])
+@login_required
+def add_expenses_batch():
+    """Thêm nhiều giao dịch trong một lần ghi
+
+    Body: mảng giao dịch (cùng trường như POST /api/expenses) hoặc {'items': [...]}.
+    Mục không hợp lệ được báo lỗi riêng; các mục hợp lệ được ghi cùng một transaction.
+    Trả về results theo thứ tự gửi lên: {'index', 'success', 'row_id' | 'error'}.
+    """
+    user_id = session.get('user_id')
+    try:
+        valid, results = _parse_batch(_batch_items(request.get_json(silent=True), 'items'), _parse_expense)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        def write(conn, cat_ids):
+            conn.executemany(
+                '''INSERT INTO transactions 
+                   (user_id, date, type, category_id, amount, note, fund_purpose) 
+                   VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                [(user_id, date_str, loai, cat_ids[(danh_muc_full, loai)], so_tien, ghi_chu, quy)
+                 for index, (date_str, loai, danh_muc_full, so_tien, ghi_chu, quy) in valid]
+            )
+            # Transaction đang giữ lock ghi nên id mới liên tiếp và kết thúc ở last_insert_rowid
+            # (rowid do trigger chèn vào bảng khác không làm đổi giá trị này)
+            last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+            return range(last_id - len(valid) + 1, last_id + 1)
+        
+        row_ids = _write_batch([item for index, item in valid], write) if valid else []
+        for (index, item), row_id in zip(valid, row_ids):
+            results[index] = {'index': index, 'success': True, 'row_id': row_id}
+        return _batch_response(results, 'thêm')
+        
+    except Exception as e:
+        print(f"Lỗi khi thêm chi tiêu hàng loạt: {e}")
+        traceback.print_exc()
+        return jsonify({'error': f'Lỗi: {str(e)}'}), 500
+
+
+@bp.route('/api/expenses/batch', methods=['PUT'])
+@login_required
+def update_expenses_batch():
+    """Sửa nhiều giao dịch trong một lần ghi
+
+    Body: mảng {'row_id', ...các trường như PUT /api/expenses/<id>} hoặc {'items': [...]}.
+    """
+    user_id = session.get('user_id')
+    
+    def parse(item):
+        row_id = item.get('row_id')
+        if not isinstance(row_id, int) or isinstance(row_id, bool):
+            raise ValueError('Thiếu row_id')
+        return (row_id, *_parse_expense(item, default_loai='', require_amount=False))
+    
+    try:
+        valid, results = _parse_batch(_batch_items(request.get_json(silent=True), 'items'), parse)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        def write(conn, cat_ids):
+            owned = _owned_ids(conn, user_id, [row_id for index, (row_id, *rest) in valid])
+            conn.executemany(
+                '''UPDATE transactions 
+                   SET date=?, type=?, category_id=?, amount=?, note=?, fund_purpose=?
+                   WHERE id=?''',
+                [(date_str, loai, cat_ids[(danh_muc_full, loai)], so_tien, ghi_chu, quy, row_id)
+                 for index, (row_id, date_str, loai, danh_muc_full, so_tien, ghi_chu, quy) in valid
+                 if row_id in owned]
+            )
+            return owned
+        
+        owned = _write_batch([item[1:] for index, item in valid], write) if valid else set()
+        for index, (row_id, *rest) in valid:
+            if row_id in owned:
+                results[index] = {'index': index, 'success': True, 'row_id': row_id}
+            else:
+                results[index] = {'index': index, 'success': False, 'row_id': row_id, 'error': 'Không tìm thấy giao dịch'}
+        return _batch_response(results, 'sửa')
+        
+    except Exception as e:
+        print(f"Lỗi khi sửa chi tiêu hàng loạt: {e}")
+        traceback.print_exc()
+        return jsonify({'error': f'Lỗi: {str(e)}'}), 500
+
+
+@bp.route('/api/expenses/batch', methods=['DELETE'])
+@login_required
+def delete_expenses_batch():
+    """Xóa nhiều giao dịch trong một lần ghi. Body: mảng id hoặc {'ids': [...]}"""
+    user_id = session.get('user_id')
+    try:
+        valid, results = _parse_batch(_batch_items(request.get_json(silent=True), 'ids'), int, item_type=int)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        owned = set()
+        if valid:
+            with db_connection() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    owned = _owned_ids(conn, user_id, [row_id for index, row_id in valid])
+                    conn.executemany('DELETE FROM transactions WHERE id = ?', [(row_id,) for row_id in owned])
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+        
+        for index, row_id in valid:
+            if row_id in owned:
+                results[index] = {'index': index, 'success': True, 'row_id': row_id}
+            else:
+                results[index] = {'index': index, 'success': False, 'row_id': row_id, 'error': 'Không tìm thấy giao dịch'}
+        return _batch_response(results, 'xóa')
+        
+    except Exception as e:
+        print(f"Lỗi khi xóa chi tiêu hàng loạt: {e}")
+        traceback.print_exc()
+        return jsonify({'error': f'Lỗi: {str(e)}'}), 500
@@ -4,14 +4,16 @@ API Routes cho quản lý quỹ (funds) và fund groups
 from flask import Blueprint, request, jsonify, session
 from datetime import datetime
 import traceback
-from utils.decorators import login_required, admin_required
+from utils.decorators import login_required, admin_required, versioned_etag
 from utils.db_utils import query_db, execute_db
+from utils.fund_groups import membership_graph
 
 bp = Blueprint('api_funds', __name__)
 
 
 @bp.route('/api/fund_summary', methods=['GET'])
 @login_required
+@versioned_etag('categories', 'users', fund_group=True)
 def get_fund_summary():
     """Lấy tổng hợp quỹ theo mục đích cho các user trong cùng nhóm quỹ"""
     try:
@@ -20,24 +22,7 @@ def get_fund_summary():
             return jsonify({'error': 'User not found'}), 401
             
         # Get all users in same fund groups as current user
-        linked_ids = {user_id}
-        
-        # Get all groups where current user is a member
-        user_groups = query_db('''
-            SELECT group_id FROM fund_group_members WHERE user_id = ?
-        ''', (user_id,))
-        
-        if user_groups:
-            # Get all members in those groups
-            group_ids = [g['group_id'] for g in user_groups]
-            placeholders = ','.join(['?'] * len(group_ids))
-            members = query_db(f'''
-                SELECT DISTINCT user_id FROM fund_group_members 
-                WHERE group_id IN ({placeholders})
-            ''', group_ids)
-            
-            for m in members:
-                linked_ids.add(m['user_id'])
+        linked_ids = membership_graph.linked_user_ids(user_id)
             
         # Get names for these users
         placeholders = ','.join(['?'] * len(linked_ids))
@@ -53,7 +38,17 @@ def get_fund_summary():
         if not purposes:
             purposes = [{'name': 'Tiết kiệm', 'icon': '💰'}]
             
-        # 3. Calculate totals
+        # 3. Calculate totals - một truy vấn GROUP BY cho mọi mục đích và mọi user
+        balance_rows = query_db(f'''
+            SELECT fund_purpose, user_id,
+                   SUM(CASE WHEN type = 'Thu' THEN amount ELSE 0 END)
+                   - SUM(CASE WHEN type = 'Chi' THEN amount ELSE 0 END) as balance
+            FROM transactions
+            WHERE user_id IN ({placeholders}) AND fund_purpose IS NOT NULL AND fund_purpose != ''
+            GROUP BY fund_purpose, user_id
+        ''', list(linked_ids))
+        balances = {(r['fund_purpose'], r['user_id']): r['balance'] for r in balance_rows}
+        
         result = []
         for purpose in purposes:
             p_name = purpose['name']
@@ -61,22 +56,7 @@ def get_fund_summary():
             
             for uid in linked_ids:
                 u_name = user_map.get(uid, f'User {uid}') # Safe lookup
-                
-                # Sum Thu
-                thu = query_db('''
-                    SELECT SUM(amount) as total FROM transactions 
-                    WHERE user_id = ? AND type = 'Thu' AND fund_purpose = ?
-                ''', (uid, p_name), one=True)
-                thu_amount = thu['total'] if thu and thu['total'] else 0
-                
-                # Sum Chi
-                chi = query_db('''
-                    SELECT SUM(amount) as total FROM transactions 
-                    WHERE user_id = ? AND type = 'Chi' AND fund_purpose = ?
-                ''', (uid, p_name), one=True)
-                chi_amount = chi['total'] if chi and chi['total'] else 0
-                
-                amount = thu_amount - chi_amount
+                amount = balances.get((p_name, uid), 0)
                 row_data['users'][u_name] = amount
                 row_data['total'] += amount
                 
@@ -137,39 +117,74 @@ def get_quy_purposes_chi():
 # FUND GROUPS API (New - replaces fund_links)
 # ============================================
 
+# Số thành viên của nhóm fg trong cùng câu truy vấn danh sách nhóm (dùng index UNIQUE(group_id, user_id))
+_MEMBER_COUNT_SQL = '(SELECT COUNT(*) FROM fund_group_members c WHERE c.group_id = fg.id) as member_count'
+
+
+def _members_by_group(group_ids):
+    """Thành viên của nhiều nhóm trong một truy vấn: {group_id: [{'id', 'name'}]}"""
+    members = {group_id: [] for group_id in group_ids}
+    if not group_ids:
+        return members
+    placeholders = ','.join(['?'] * len(group_ids))
+    rows = query_db(f'''
+        SELECT fgm.group_id, u.id, u.name, u.username
+        FROM fund_group_members fgm
+        JOIN users u ON fgm.user_id = u.id
+        WHERE fgm.group_id IN ({placeholders})
+        ORDER BY fgm.group_id, fgm.user_id
+    ''', list(group_ids))
+    for m in rows:
+        members[m['group_id']].append({'id': m['id'], 'name': m['name'] or m['username']})
+    return members
+
+
+def _group_to_dict(g, members=None):
+    group = {
+        'id': g['id'],
+        'name': g['name'],
+        'created_at': g['created_at'],
+        'created_by': g['creator_name'] or g['creator_username'],
+        'member_count': g['member_count']
+    }
+    if members is not None:
+        group['members'] = members.get(g['id'], [])
+    return group
+
+
+def _include_members():
+    return 'members' in request.args.get('include', '').split(',')
+
+
 @bp.route('/api/fund_groups', methods=['GET'])
 @login_required
+@versioned_etag('users', fund_group=True)
 def get_fund_groups():
-    """Lấy danh sách tất cả nhóm quỹ mà user tham gia"""
+    """Lấy danh sách tất cả nhóm quỹ mà user tham gia
+
+    Tham số: include=members để kèm danh sách thành viên của từng nhóm.
+    """
     try:
         user_id = session.get('user_id')
         
         # Get all groups where user is a member
-        groups = query_db('''
+        groups = query_db(f'''
             SELECT fg.id, fg.name, fg.created_at, fg.created_by,
-                   u.name as creator_name, u.username as creator_username
+                   u.name as creator_name, u.username as creator_username,
+                   {_MEMBER_COUNT_SQL}
             FROM fund_groups fg
             JOIN fund_group_members fgm ON fg.id = fgm.group_id
-            JOIN users u ON fg.created_by = u.id
+            LEFT JOIN users u ON fg.created_by = u.id
             WHERE fgm.user_id = ?
             ORDER BY fg.created_at DESC
         ''', (user_id,))
         
+        members = _members_by_group([g['id'] for g in groups]) if _include_members() else None
         result = []
         for g in groups:
-            # Get member count
-            members = query_db('''
-                SELECT COUNT(*) as count FROM fund_group_members WHERE group_id = ?
-            ''', (g['id'],), one=True)
-            
-            result.append({
-                'id': g['id'],
-                'name': g['name'],
-                'created_at': g['created_at'],
-                'created_by': g['creator_name'] or g['creator_username'],
-                'member_count': members['count'] if members else 0,
-                'is_owner': g['created_by'] == user_id
-            })
+            group = _group_to_dict(g, members)
+            group['is_owner'] = g['created_by'] == user_id
+            result.append(group)
             
         return jsonify({'groups': result})
     except Exception as e:
@@ -215,7 +230,8 @@ def create_fund_group():
                     )
                 except:
                     pass  # Ignore duplicates
-                    
+        
+        membership_graph.invalidate()
         return jsonify({'success': True, 'message': 'Tạo nhóm quỹ thành công', 'group_id': group_id})
         
     except Exception as e:
@@ -251,6 +267,7 @@ def delete_fund_group(group_id):
         # Delete members first (due to foreign key)
         execute_db('DELETE FROM fund_group_members WHERE group_id = ?', (group_id,))
         execute_db('DELETE FROM fund_groups WHERE id = ?', (group_id,))
+        membership_graph.invalidate()
         return jsonify({'success': True, 'message': 'Xóa nhóm quỹ thành công'})
     except Exception as e:
         print(f"Lỗi khi xóa fund group: {e}")
@@ -259,6 +276,7 @@ def delete_fund_group(group_id):
 
 @bp.route('/api/fund_groups/<int:group_id>/members', methods=['GET'])
 @login_required
+@versioned_etag('users', fund_group=True)
 def get_group_members(group_id):
     """Lấy danh sách thành viên của nhóm"""
     try:
@@ -302,6 +320,7 @@ def add_group_member(group_id):
             'INSERT INTO fund_group_members (group_id, user_id, joined_at) VALUES (?, ?, ?)',
             (group_id, user_id, joined_at)
         )
+        membership_graph.invalidate()
         
         return jsonify({'success': True, 'message': 'Thêm thành viên thành công'})
         
@@ -319,6 +338,7 @@ def remove_group_member(group_id, user_id):
             'DELETE FROM fund_group_members WHERE group_id = ? AND user_id = ?',
             (group_id, user_id)
         )
+        membership_graph.invalidate()
         return jsonify({'success': True, 'message': 'Xóa thành viên thành công'})
     except Exception as e:
         print(f"Lỗi khi xóa group member: {e}")
@@ -328,37 +348,42 @@ def remove_group_member(group_id, user_id):
 @bp.route('/api/fund_groups/all', methods=['GET'])
 @admin_required
 def get_all_fund_groups():
-    """Admin: Lấy tất cả nhóm quỹ"""
+    """Admin: Lấy tất cả nhóm quỹ, nhóm mới nhất trước, phân trang bằng cursor (keyset trên id)
+
+    Tham số: limit, cursor (next_cursor của trang trước), include=members.
+    """
     try:
-        groups = query_db('''
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+        
+        sql = f'''
             SELECT fg.id, fg.name, fg.created_at, fg.created_by,
-                   u.name as creator_name, u.username as creator_username
+                   u.name as creator_name, u.username as creator_username,
+                   {_MEMBER_COUNT_SQL}
             FROM fund_groups fg
-            JOIN users u ON fg.created_by = u.id
-            ORDER BY fg.created_at DESC
-        ''')
+            LEFT JOIN users u ON fg.created_by = u.id
+        '''
+        params = []
         
-        result = []
-        for g in groups:
-            # Get members
-            members = query_db('''
-                SELECT u.id, u.name, u.username
-                FROM fund_group_members fgm
-                JOIN users u ON fgm.user_id = u.id
-                WHERE fgm.group_id = ?
-            ''', (g['id'],))
-            
-            result.append({
-                'id': g['id'],
-                'name': g['name'],
-                'created_at': g['created_at'],
-                'created_by': g['creator_name'] or g['creator_username'],
-                'members': [{'id': m['id'], 'name': m['name'] or m['username']} for m in members]
-            })
-            
-        return jsonify({'groups': result})
+        cursor = request.args.get('cursor')
+        if cursor:
+            if not cursor.isdigit():
+                return jsonify({'error': 'Cursor không hợp lệ'}), 400
+            sql += " WHERE fg.id < ?"
+            params.append(int(cursor))
+        
+        sql += " ORDER BY fg.id DESC LIMIT ?"
+        params.append(limit + 1)
+        
+        groups = query_db(sql, params)
+        has_more = len(groups) > limit
+        groups = groups[:limit]
+        
+        members = _members_by_group([g['id'] for g in groups]) if _include_members() else None
+        result = [_group_to_dict(g, members) for g in groups]
+        
+        next_cursor = str(groups[-1]['id']) if has_more else None
+        return jsonify({'groups': result, 'next_cursor': next_cursor})
     except Exception as e:
         print(f"Lỗi khi lấy all fund groups: {e}")
         traceback.print_exc()
         return jsonify({'error': str(e), 'groups': []}), 500
-
@@ -0,0 +1,60 @@
+"""
+API Routes cho job chạy nền (poll tiến độ, tải kết quả)
+"""
+from flask import Blueprint, send_file, jsonify
+import os
+import traceback
+from utils.decorators import admin_required
+from utils.jobs import get_job, list_recent_jobs, job_to_dict
+
+bp = Blueprint('api_jobs', __name__)
+
+
+@bp.route('/api/jobs', methods=['GET'])
+@admin_required
+def list_jobs():
+    """Các job gần đây (mới nhất trước)"""
+    try:
+        return jsonify({'jobs': [job_to_dict(job) for job in list_recent_jobs()]})
+    except Exception as e:
+        print(f"Lỗi khi lấy danh sách job: {e}")
+        traceback.print_exc()
+        return jsonify({'error': f'Lỗi server: {str(e)}'}), 500
+
+
+@bp.route('/api/jobs/<job_id>', methods=['GET'])
+@admin_required
+def get_job_status(job_id):
+    """Trạng thái và tiến độ của một job"""
+    try:
+        job = get_job(job_id)
+        if not job:
+            return jsonify({'error': 'Không tìm thấy job'}), 404
+        return jsonify(job_to_dict(job))
+    except Exception as e:
+        print(f"Lỗi khi lấy trạng thái job: {e}")
+        traceback.print_exc()
+        return jsonify({'error': f'Lỗi server: {str(e)}'}), 500
+
+
+@bp.route('/api/jobs/<job_id>/download', methods=['GET'])
+@admin_required
+def download_job_result(job_id):
+    """Tải file kết quả của job đã hoàn thành"""
+    try:
+        job = get_job(job_id)
+        if not job:
+            return jsonify({'error': 'Không tìm thấy job'}), 404
+        if job['status'] != 'done' or not job['result_path']:
+            return jsonify({'error': 'Job chưa có kết quả để tải'}), 409
+        if not os.path.exists(job['result_path']):
+            return jsonify({'error': 'File kết quả đã hết hạn'}), 410
+        return send_file(
+            os.path.abspath(job['result_path']),
+            as_attachment=True,
+            download_name=job['result_name']
+        )
+    except Exception as e:
+        print(f"Lỗi khi tải kết quả job: {e}")
+        traceback.print_exc()
+        return jsonify({'error': f'Lỗi server: {str(e)}'}), 500
@@ -6,6 +6,9 @@ from datetime import datetime
 import traceback
 from utils.decorators import login_required, admin_required
 from utils.db_utils import query_db, execute_db
+from utils.fund_groups import membership_graph
+from utils.jobs import submit_job
+from utils.user_purge import soft_delete_user, purge_user
 from werkzeug.security import generate_password_hash, check_password_hash
 
 bp = Blueprint('api_users', __name__)
@@ -36,7 +39,7 @@ def get_all_users():
         return jsonify({'error': 'Không có quyền truy cập'}), 403
     
     try:
-        users_rows = query_db('SELECT * FROM users')
+        users_rows = query_db('SELECT * FROM users WHERE deleted_at IS NULL')
         users = []
         for row in users_rows:
             users.append({
@@ -66,7 +69,9 @@ def add_user():
     
     try:
         # Check existing
-        existing = query_db('SELECT id FROM users WHERE username = ?', (username,), one=True)
+        existing = query_db('SELECT id, deleted_at FROM users WHERE username = ?', (username,), one=True)
+        if existing and existing['deleted_at']:
+            return jsonify({'error': 'Tài khoản cùng tên đang được xóa, vui lòng thử lại sau'}), 400
         if existing:
             return jsonify({'error': 'Tên đăng nhập đã tồn tại'}), 400
         
@@ -100,7 +105,7 @@ def update_user(username):
         return jsonify({'error': 'Tên đăng nhập không được để trống'}), 400
     
     try:
-        user = query_db('SELECT * FROM users WHERE username = ?', (username,), one=True)
+        user = query_db('SELECT * FROM users WHERE username = ? AND deleted_at IS NULL', (username,), one=True)
         if not user:
             return jsonify({'error': 'Không tìm thấy tài khoản'}), 404
         
@@ -117,7 +122,7 @@ def update_user(username):
         if password:
             hashed_password = generate_password_hash(password)
             execute_db(
-                'UPDATE users SET username=?, password=?, name=?, role=?, active=? WHERE id=?',
+                'UPDATE users SET username=?, password=?, name=?, role=?, active=?, must_change_password=0 WHERE id=?',
                 (new_username, hashed_password, new_name, role, active, user_id)
             )
         else:
@@ -140,10 +145,19 @@ def update_user(username):
         return jsonify({'error': f'Lỗi: {str(e)}'}), 500
 
 
+def _purge_user_job(job, user_id, username):
+    job.stage('Xóa giao dịch')
+    deleted = purge_user(user_id, progress=job.progress)
+    return {'message': f'Đã xóa tài khoản "{username}" và {deleted} giao dịch.'}
+
+
 @bp.route('/api/users/<username>', methods=['DELETE'])
 @admin_required
 def delete_user(username):
-    """Xóa user"""
+    """Xóa user: xóa mềm ngay, giao dịch được xóa dần ở nền (trả về job id).
+
+    Gọi lại với user đang xóa dở (job trước bị dừng) sẽ chạy tiếp phần còn lại.
+    """
     if session.get('user') == username:
         return jsonify({'error': 'Không thể xóa tài khoản của chính bạn'}), 400
         
@@ -152,16 +166,12 @@ def delete_user(username):
         if not user:
             return jsonify({'error': 'Không tìm thấy tài khoản'}), 404
             
-        # Delete related data first (optional, or rely on cascade if configured, but sqlite default is off)
-        # We should probably keep transactions but maybe nullify user_id or just delete them?
-        # For now, let's delete the user. Transactions will be orphaned or we can delete them.
-        # Let's delete transactions for clean up.
-        execute_db('DELETE FROM transactions WHERE user_id = ?', (user['id'],))
-        execute_db('DELETE FROM fund_links WHERE user1_id = ? OR user2_id = ?', (user['id'], user['id']))
-        execute_db('DELETE FROM fund_group_members WHERE user_id = ?', (user['id'],))
-        execute_db('DELETE FROM users WHERE id = ?', (user['id'],))
+        soft_delete_user(user['id'])
+        membership_graph.invalidate()
         
-        return jsonify({'success': True, 'message': 'Xóa tài khoản thành công!'})
+        job_id = submit_job('purge_user', _purge_user_job, user['id'], username,
+                            created_by=session.get('user_id'))
+        return jsonify({'success': True, 'job_id': job_id}), 202
     except Exception as e:
         print(f"Exception in delete_user: {e}")
         traceback.print_exc()
@@ -191,7 +201,8 @@ def change_password():
             return jsonify({'error': 'Mật khẩu hiện tại không đúng'}), 400
             
         hashed_new_password = generate_password_hash(new_password)
-        execute_db('UPDATE users SET password = ? WHERE id = ?', (hashed_new_password, user['id']))
+        execute_db('UPDATE users SET password = ?, must_change_password = 0 WHERE id = ?', (hashed_new_password, user['id']))
+        session.pop('must_change_password', None)
         
         return jsonify({'success': True, 'message': 'Đổi mật khẩu thành công!'})
     except Exception as e:
@@ -3,6 +3,7 @@ Routes cho authentication: login, logout, index
 """
 from flask import Blueprint, render_template, redirect, url_for, request, session, flash
 from utils.db_utils import query_db
+from utils.versions import get_versions
 from werkzeug.security import check_password_hash
 
 bp = Blueprint('auth', __name__)
@@ -21,13 +22,20 @@ def login():
         username = request.form.get('username', '').strip()
         password = request.form.get('password', '').strip()
         
-        user = query_db('SELECT * FROM users WHERE username = ?', (username,), one=True)
+        # Đọc stamp 'users' trước user: xóa mềm xen giữa hai lần đọc làm stamp cũ -> decorator kiểm lại
+        users_version = get_versions(['users'])['users']
+        user = query_db('SELECT * FROM users WHERE username = ? AND deleted_at IS NULL', (username,), one=True)
         
         if user and check_password_hash(user['password'], password):
             session['user'] = user['username']
             session['name'] = user['name']
             session['role'] = user['role']
             session['user_id'] = user['id'] # Store ID in session for easier access
+            session['users_version'] = users_version
+            if user['must_change_password']:
+                # User tạo hàng loạt khi import đang dùng mật khẩu tạm
+                session['must_change_password'] = True
+                flash('Bạn đang dùng mật khẩu tạm, vui lòng đổi mật khẩu.', 'info')
             return redirect(url_for('main.dashboard'))
         else:
             flash('Tên đăng nhập hoặc mật khẩu không đúng!', 'error')
@@ -5,10 +5,55 @@ from flask import Blueprint, render_template, session
 from datetime import datetime
 from utils.decorators import login_required, admin_required
 from utils.db_utils import query_db
+from utils.versions import VersionedCache
+from utils.fund_groups import membership_graph
 
 bp = Blueprint('main', __name__)
 
 
+# Cache tổng hợp dashboard theo (user, tháng), hợp lệ khi stamp phiên bản không đổi
+_summary_cache = VersionedCache(max_entries=512)
+
+
+def _compute_dashboard_summary(user_id, linked_ids, start_date, end_date):
+    """Tính tổng thu/chi tháng của user và tổng quỹ (mọi thời điểm) của nhóm"""
+    # 1. Thu/chi cá nhân trong tháng - một truy vấn tổng hợp có điều kiện.
+    # 'Thu quỹ' (type 'Thu') là tiền rời tài khoản cá nhân vào quỹ nên tính là chi;
+    # 'Chi quỹ' là tiền chi từ quỹ nên không tính vào chi cá nhân.
+    personal = query_db('''
+        SELECT
+            SUM(CASE WHEN d.type = 'Thu' AND (c.name != 'Thu quỹ' OR c.name IS NULL)
+                     THEN d.total ELSE 0 END) as income,
+            SUM(CASE WHEN d.type = 'Chi' AND (c.name != 'Chi quỹ' OR c.name IS NULL)
+                     THEN d.total ELSE 0 END) as expense_normal,
+            SUM(CASE WHEN d.type = 'Thu' AND c.name = 'Thu quỹ'
+                     THEN d.total ELSE 0 END) as expense_fund
+        FROM daily_totals d
+        LEFT JOIN categories c ON d.category_id = c.id
+        WHERE d.user_id = ? AND d.date >= ? AND d.date < ?
+    ''', (user_id, start_date, end_date), one=True)
+    
+    total_income = personal['income'] or 0
+    total_expense = (personal['expense_normal'] or 0) + (personal['expense_fund'] or 0)
+    
+    # 2. Tổng quỹ của cả nhóm (mọi thời điểm): Thu có fund_purpose trừ Chi có fund_purpose
+    placeholders = ','.join(['?'] * len(linked_ids))
+    fund = query_db(f'''
+        SELECT SUM(CASE WHEN type = 'Thu' THEN total
+                        WHEN type = 'Chi' THEN -total
+                        ELSE 0 END) as total
+        FROM daily_totals
+        WHERE user_id IN ({placeholders}) AND is_fund = 1
+    ''', list(linked_ids), one=True)
+    
+    return {
+        'total_income': total_income,
+        'total_expense': total_expense,
+        'balance': total_income - total_expense,
+        'total_fund': fund['total'] or 0
+    }
+
+
 @bp.route('/dashboard')
 @login_required
 def dashboard():
@@ -36,96 +81,29 @@ def dashboard():
         'total_fund': 0
     }
     
+    if session.get('must_change_password'):
+        # Mật khẩu tạm dùng chung cho cả lần import: chưa đổi thì không hiện số liệu
+        return render_template('dashboard.html', current_user=current_user, summary=summary)
+    
     try:
-        # 1. Calculate Personal Income and Expense for Current Month
-        start_date = f"{current_year}-{current_month:02d}-01"
-        if current_month == 12:
-            end_date = f"{current_year+1}-01-01"
-        else:
-            end_date = f"{current_year}-{current_month+1:02d}-01"
-            
-        # Calculate Total Income (excluding 'Thu quỹ')
-        sql_income = '''
-            SELECT SUM(t.amount) as total
-            FROM transactions t
-            LEFT JOIN categories c ON t.category_id = c.id
-            WHERE t.user_id = ? AND t.date >= ? AND t.date < ? 
-            AND t.type = 'Thu' AND (c.name != 'Thu quỹ' OR c.name IS NULL)
-        '''
-        res_income = query_db(sql_income, (user_id, start_date, end_date), one=True)
-        summary['total_income'] = res_income['total'] if res_income and res_income['total'] else 0
-
-        # Calculate Total Expense (excluding 'Chi quỹ', but including 'Thu quỹ' as it's money leaving personal account)
-        # Note: 'Thu quỹ' transactions are type='Thu' but logically are personal expenses (transfer to fund).
-        # However, the original code logic was:
-        # if type == 'Thu' and cat == 'Thu quỹ': total_expense += amount
-        # if type == 'Chi' and cat != 'Chi quỹ': total_expense += amount
-        
-        # Expense part 1: Normal expenses (Type 'Chi', not 'Chi quỹ')
-        sql_expense_normal = '''
-            SELECT SUM(t.amount) as total
-            FROM transactions t
-            LEFT JOIN categories c ON t.category_id = c.id
-            WHERE t.user_id = ? AND t.date >= ? AND t.date < ? 
-            AND t.type = 'Chi' AND (c.name != 'Chi quỹ' OR c.name IS NULL)
-        '''
-        res_exp_normal = query_db(sql_expense_normal, (user_id, start_date, end_date), one=True)
-        exp_normal = res_exp_normal['total'] if res_exp_normal and res_exp_normal['total'] else 0
-        
-        # Expense part 2: Fund contributions (Type 'Thu', cat 'Thu quỹ')
-        sql_expense_fund = '''
-            SELECT SUM(t.amount) as total
-            FROM transactions t
-            LEFT JOIN categories c ON t.category_id = c.id
-            WHERE t.user_id = ? AND t.date >= ? AND t.date < ? 
-            AND t.type = 'Thu' AND c.name = 'Thu quỹ'
-        '''
-        res_exp_fund = query_db(sql_expense_fund, (user_id, start_date, end_date), one=True)
-        exp_fund = res_exp_fund['total'] if res_exp_fund and res_exp_fund['total'] else 0
-        
-        summary['total_expense'] = exp_normal + exp_fund
-                
-        summary['balance'] = summary['total_income'] - summary['total_expense']
-        
-        # 2. Calculate Total Fund (All time, Fund Groups)
-        linked_ids = {user_id}
-        
-        # Get all groups where current user is a member
-        user_groups = query_db('''
-            SELECT group_id FROM fund_group_members WHERE user_id = ?
-        ''', (user_id,))
+        # Stamp đổi khi giao dịch của bất kỳ ai trong nhóm đổi, khi thành viên nhóm đổi
+        # (tập user đổi) hoặc khi danh mục đổi tên/xóa
+        linked_ids, versions = membership_graph.linked_with_versions(user_id, ['categories'])
+        stamp = tuple(sorted(versions.items()))
+        cache_key = (user_id, current_year, current_month)
         
-        if user_groups:
-            # Get all members in those groups
-            group_ids = [g['group_id'] for g in user_groups]
-            placeholders_g = ','.join(['?'] * len(group_ids))
-            members = query_db(f'''
-                SELECT DISTINCT user_id FROM fund_group_members 
-                WHERE group_id IN ({placeholders_g})
-            ''', group_ids)
-            
-            for m in members:
-                linked_ids.add(m['user_id'])
+        cached = _summary_cache.get(cache_key, stamp)
+        if cached is not None:
+            summary = cached
+        else:
+            start_date = f"{current_year}-{current_month:02d}-01"
+            if current_month == 12:
+                end_date = f"{current_year+1}-01-01"
+            else:
+                end_date = f"{current_year}-{current_month+1:02d}-01"
             
-        placeholders = ','.join(['?'] * len(linked_ids))
-        
-        # Sum all 'Thu' with fund_purpose (Income to fund)
-        sql_fund_in = f'''
-            SELECT SUM(amount) as total FROM transactions 
-            WHERE user_id IN ({placeholders}) AND type = 'Thu' AND fund_purpose IS NOT NULL AND fund_purpose != ''
-        '''
-        res_in = query_db(sql_fund_in, list(linked_ids), one=True)
-        fund_in = res_in['total'] if res_in and res_in['total'] else 0
-        
-        # Sum all 'Chi' with fund_purpose (Expense from fund)
-        sql_fund_out = f'''
-            SELECT SUM(amount) as total FROM transactions 
-            WHERE user_id IN ({placeholders}) AND type = 'Chi' AND fund_purpose IS NOT NULL AND fund_purpose != ''
-        '''
-        res_out = query_db(sql_fund_out, list(linked_ids), one=True)
-        fund_out = res_out['total'] if res_out and res_out['total'] else 0
-        
-        summary['total_fund'] = fund_in - fund_out
+            summary = _compute_dashboard_summary(user_id, linked_ids, start_date, end_date)
+            _summary_cache.set(cache_key, stamp, summary)
         
     except Exception as e:
         print(f"Error calculating dashboard summary: {e}")
@@ -159,14 +137,16 @@ def admin():
     all_users = []
     if session.get('role') == 'admin':
         try:
-            rows = query_db('SELECT id, username, name, role, active FROM users')
+            rows = query_db('SELECT id, username, name, role, active, deleted_at FROM users')
             for row in rows:
                 all_users.append({
                     'id': row['id'],
                     'username': row['username'],
                     'name': row['name'],
                     'role': row['role'],
-                    'active': bool(row['active'])
+                    'active': bool(row['active']),
+                    # Đã xóa mềm nhưng job dọn dữ liệu chưa xong (nút Xóa chạy tiếp)
+                    'deleting': row['deleted_at'] is not None
                 })
         except Exception as e:
             print(f"Error loading users for admin: {e}")
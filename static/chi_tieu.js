@@ -1,6 +1,37 @@
 // Đợi DOM load xong
 document.addEventListener('DOMContentLoaded', function () {
 
+    // Dữ liệu tham chiếu (danh mục, mục đích quỹ, icon) tải một lần qua /api/bootstrap.
+    // cache: 'no-cache' -> trình duyệt gửi If-None-Match, server trả 304 nếu danh mục không đổi.
+    let bootstrapPromise = null;
+
+    function loadBootstrap(refresh = false) {
+        if (!bootstrapPromise || refresh) {
+            bootstrapPromise = fetch('/api/bootstrap', { cache: 'no-cache' })
+                .then(async res => {
+                    const data = await res.json();
+                    if (!res.ok) throw new Error(data.error || 'Không tải được danh mục');
+                    return data;
+                })
+                .catch(err => {
+                    bootstrapPromise = null;
+                    throw err;
+                });
+        }
+        return bootstrapPromise;
+    }
+
+    // Gọi sau khi thêm/sửa/xóa danh mục
+    function refreshBootstrap() {
+        return loadBootstrap(true).catch(err => console.error('Lỗi tải lại danh mục:', err));
+    }
+
+    // Khóa loại danh mục trong payload bootstrap (giống cách server hiểu tham số type)
+    function bootstrapKey(type) {
+        const lower = (type || '').toLowerCase();
+        return (lower === 'thu' || lower === 'quy') ? lower : 'chi';
+    }
+
     // Load mục đích quỹ
     let quyPurposes = [];
     let quyPurposesThu = [];
@@ -8,10 +39,8 @@ document.addEventListener('DOMContentLoaded', function () {
 
     async function loadQuyPurposes() {
         try {
-            const res = await fetch('/api/quy_purposes');
-            const data = await res.json();
-            if (!res.ok) throw new Error(data.error || 'Không tải được mục đích quỹ');
-            quyPurposes = data.purposes || [];
+            const data = await loadBootstrap();
+            quyPurposes = data.quy_purposes || [];
             // Cập nhật dropdown cho tab Chi tiêu/Thu nhập
             const purposeSelect = document.getElementById('muc-dich-quy');
             if (purposeSelect) {
@@ -26,13 +55,8 @@ document.addEventListener('DOMContentLoaded', function () {
     async function loadQuyPurposesThu() {
         try {
             console.log('Đang load mục đích quỹ Thu...');
-            const res = await fetch('/api/quy_purposes_thu');
-            if (!res.ok) {
-                const errorData = await res.json().catch(() => ({}));
-                throw new Error(errorData.error || 'Không tải được mục đích quỹ Thu');
-            }
-            const data = await res.json();
-            quyPurposesThu = data.purposes || [];
+            const data = await loadBootstrap();
+            quyPurposesThu = data.quy_purposes_thu || [];
             console.log('Mục đích quỹ Thu nhận được:', quyPurposesThu);
 
             const purposeGrid = document.getElementById('muc-dich-quy-thu-grid');
@@ -69,13 +93,8 @@ document.addEventListener('DOMContentLoaded', function () {
     async function loadQuyPurposesChi() {
         try {
             console.log('Đang load mục đích quỹ Chi...');
-            const res = await fetch('/api/quy_purposes_chi');
-            if (!res.ok) {
-                const errorData = await res.json().catch(() => ({}));
-                throw new Error(errorData.error || 'Không tải được mục đích quỹ Chi');
-            }
-            const data = await res.json();
-            quyPurposesChi = data.purposes || [];
+            const data = await loadBootstrap();
+            quyPurposesChi = data.quy_purposes_chi || [];
             console.log('Mục đích quỹ Chi nhận được:', quyPurposesChi);
 
             const purposeGrid = document.getElementById('muc-dich-quy-chi-grid');
@@ -113,8 +132,8 @@ document.addEventListener('DOMContentLoaded', function () {
     async function loadCategories(type = 'Chi') {
         try {
             console.log(`Đang load danh mục ${type}...`);
-            const response = await fetch(`/api/categories?type=${type}`);
-            const data = await response.json();
+            const bootstrap = await loadBootstrap();
+            const data = { categories: bootstrap.categories[bootstrapKey(type)] || [] };
             console.log(`Danh mục ${type} nhận được:`, data);
 
             const categoriesGrid = document.getElementById('categories-grid');
@@ -578,11 +597,9 @@ document.addEventListener('DOMContentLoaded', function () {
                     document.querySelectorAll('.chi-cat').forEach(b => b.classList.remove('active'));
                     firstCategory.classList.add('active');
                 }
-                // Luôn reset lichData để khi chuyển sang lịch sẽ reload dữ liệu mới
-                lichData = null;
-                // Nếu đang ở view lịch, reload dữ liệu ngay
+                // Nếu đang ở view lịch, cập nhật ngay (khi chuyển sang lịch cũng sẽ đồng bộ)
                 if (lichSection && lichSection.style.display !== 'none') {
-                    loadLichData(true).then(data => {
+                    syncLichData().then(data => {
                         if (data) {
                             renderLichCalendar();
                             renderLichTransactions();
@@ -775,6 +792,7 @@ document.addEventListener('DOMContentLoaded', function () {
     }
 
     let lichData = null;
+    let lichDataPeriod = null; // "năm-tháng" của lichData
     let lichCurrentDate = new Date();
     let lichPopupDate = new Date(); // Date cho popup calendar
 
@@ -786,9 +804,11 @@ document.addEventListener('DOMContentLoaded', function () {
         const month = lichCurrentDate.getMonth() + 1; // JavaScript month is 0-based
 
         try {
-            const response = await fetch(`/api/calendar?month=${month}&year=${year}`);
+            // cache: 'no-cache' -> trình duyệt gửi kèm If-None-Match, dữ liệu không đổi thì server trả 304
+            const response = await fetch(`/api/calendar?month=${month}&year=${year}`, { cache: 'no-cache' });
             const data = await response.json();
             lichData = data;
+            lichDataPeriod = `${year}-${String(month).padStart(2, '0')}`;
             return data;
         } catch (error) {
             console.error('Lỗi khi load dữ liệu lịch:', error);
@@ -796,6 +816,75 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     }
 
+    // Cập nhật lichData bằng các thay đổi từ /api/sync thay vì tải lại cả tháng
+    async function syncLichData() {
+        const year = lichCurrentDate.getFullYear();
+        const month = lichCurrentDate.getMonth() + 1;
+        const period = `${year}-${String(month).padStart(2, '0')}`;
+        if (!lichData || !lichData.sync_cursor || lichDataPeriod !== period) {
+            return loadLichData(true);
+        }
+
+        try {
+            const response = await fetch(`/api/sync?since=${encodeURIComponent(lichData.sync_cursor)}`);
+            const changes = await response.json();
+            // reset: cursor quá cũ hoặc danh mục đã đổi -> tải lại cả tháng
+            if (!response.ok || changes.reset) return loadLichData(true);
+            applyLichChanges(changes, period);
+            return lichData;
+        } catch (error) {
+            console.error('Lỗi khi đồng bộ dữ liệu lịch:', error);
+            return loadLichData(true);
+        }
+    }
+
+    function applyLichChanges(changes, period) {
+        const touched = new Set([...changes.deleted, ...changes.changed.map(t => t.row_id)]);
+        const groups = lichData.transactions_by_date;
+
+        // Bỏ bản cũ của các giao dịch đã sửa/xóa
+        groups.forEach(group => {
+            group.transactions = group.transactions.filter(t => !touched.has(t.row_id));
+        });
+
+        // Thêm bản mới của các giao dịch thuộc tháng đang xem
+        changes.changed.forEach(trans => {
+            if (!trans.date.startsWith(period)) return;
+            let group = groups.find(g => g.date === trans.ngay);
+            if (!group) {
+                group = { date: trans.ngay, day_name: trans.day_name, transactions: [] };
+                groups.push(group);
+            }
+            group.transactions.push(trans);
+        });
+
+        // Giữ thứ tự như /api/calendar: ngày mới nhất trước, trong ngày theo id tăng dần
+        const dateKey = d => d.split('/').reverse().join('-');
+        lichData.transactions_by_date = groups
+            .filter(group => group.transactions.length > 0)
+            .sort((a, b) => dateKey(b.date).localeCompare(dateKey(a.date)));
+        lichData.transactions_by_date.forEach(group => group.transactions.sort((a, b) => a.row_id - b.row_id));
+
+        // Tính lại tổng ngày/tháng theo cột tổng server gán cho từng giao dịch
+        const dailyTotals = {};
+        const summary = { thu: 0, chi: 0, tong: 0 };
+        lichData.transactions_by_date.forEach(group => {
+            const totals = { thu: 0, chi: 0 };
+            group.transactions.forEach(t => {
+                if (t.cot_tong) {
+                    totals[t.cot_tong] += t.so_tien;
+                    summary[t.cot_tong] += t.so_tien;
+                }
+            });
+            dailyTotals[group.date] = totals;
+        });
+        summary.tong = summary.thu - summary.chi;
+
+        lichData.daily_totals = dailyTotals;
+        lichData.monthly_summary = summary;
+        lichData.sync_cursor = changes.cursor;
+    }
+
     // Render calendar
     function renderLichCalendar() {
         const calendarDays = document.getElementById('lich-calendar-days');
@@ -1048,9 +1137,8 @@ document.addEventListener('DOMContentLoaded', function () {
             if (!res.ok) throw new Error(data.error || 'Xóa thất bại');
 
             alert('Đã xóa giao dịch thành công!');
-            // Reload calendar data
-            lichData = null;
-            loadLichData(true).then(data => {
+            // Cập nhật calendar data
+            syncLichData().then(data => {
                 if (data) {
                     renderLichCalendar();
                     renderLichTransactions();
@@ -1107,9 +1195,8 @@ document.addEventListener('DOMContentLoaded', function () {
         console.log('[MODAL] Fetching categories for API type:', apiType);
 
         try {
-            const res = await fetch(`/api/categories?type=${apiType}`);
-            const data = await res.json();
-            categories = data.categories || [];
+            const data = await loadBootstrap();
+            categories = data.categories[bootstrapKey(apiType)] || [];
             console.log('[MODAL] Loaded', categories.length, 'categories:', categories.slice(0, 3));
         } catch (err) {
             console.error('[MODAL] Error fetching categories:', err);
@@ -1215,9 +1302,8 @@ document.addEventListener('DOMContentLoaded', function () {
 
             // Fetch new categories
             try {
-                const res = await fetch(`/api/categories?type=${newApiType}`);
-                const data = await res.json();
-                const newCategories = data.categories || [];
+                const data = await loadBootstrap();
+                const newCategories = data.categories[bootstrapKey(newApiType)] || [];
 
                 console.log('[MODAL] Loaded', newCategories.length, 'new categories');
 
@@ -1313,8 +1399,8 @@ document.addEventListener('DOMContentLoaded', function () {
                 alert('Đã cập nhật giao dịch thành công!');
                 modal.remove();
 
-                // Reload calendar
-                loadLichData(true).then(() => {
+                // Cập nhật calendar
+                syncLichData().then(() => {
                     renderLichCalendar();
                     renderLichTransactions();
                     updateLichSummary();
@@ -1368,7 +1454,7 @@ document.addEventListener('DOMContentLoaded', function () {
         if (wrap) wrap.innerHTML = '<div class="chi-cat placeholder">Đang tải...</div>';
         if (wrapMonths) wrapMonths.innerHTML = '<div class="chi-cat placeholder">Đang tải...</div>';
         try {
-            const res = await fetch('/api/user_yearly_report?years=5');
+            const res = await fetch('/api/user_yearly_report?years=5', { cache: 'no-cache' });
             const data = await res.json();
             if (!res.ok) throw new Error(data.error || 'Không tải được báo cáo');
             const items = data.years || [];
@@ -1462,7 +1548,7 @@ document.addEventListener('DOMContentLoaded', function () {
 
             // Monthly report (current year)
             if (chartElMonths && window.Chart) {
-                const resMonth = await fetch('/api/user_monthly_report');
+                const resMonth = await fetch('/api/user_monthly_report', { cache: 'no-cache' });
                 const dataMonth = await resMonth.json();
                 if (!resMonth.ok) throw new Error(dataMonth.error || 'Không tải được báo cáo tháng');
                 const months = dataMonth.months || [];
@@ -1548,7 +1634,7 @@ document.addEventListener('DOMContentLoaded', function () {
         if (!chartEl || !window.Chart) return;
 
         try {
-            const res = await fetch('/api/user_daily_report');
+            const res = await fetch('/api/user_daily_report', { cache: 'no-cache' });
             const data = await res.json();
             if (!res.ok) throw new Error(data.error || 'Không tải được báo cáo ngày');
 
@@ -1639,7 +1725,7 @@ document.addEventListener('DOMContentLoaded', function () {
         if (!chartEl || !window.Chart) return;
 
         try {
-            const res = await fetch('/api/user_category_breakdown');
+            const res = await fetch('/api/user_category_breakdown', { cache: 'no-cache' });
             const data = await res.json();
             if (!res.ok) throw new Error(data.error || 'Không tải được phân bổ danh mục');
 
@@ -1789,9 +1875,8 @@ document.addEventListener('DOMContentLoaded', function () {
                 chiTabs.style.display = 'none';
             }
 
-            // Load và render lịch (force reload để lấy dữ liệu mới nhất)
-            lichData = null; // Reset để reload dữ liệu mới
-            loadLichData(true).then(data => {
+            // Load và render lịch (đồng bộ thay đổi mới nhất; tháng khác thì tải lại)
+            syncLichData().then(data => {
                 if (data) {
                     renderLichCalendar();
                     renderLichTransactions();
@@ -1854,8 +1939,7 @@ document.addEventListener('DOMContentLoaded', function () {
 
     async function loadIcons() {
         try {
-            const response = await fetch('/api/icons');
-            const data = await response.json();
+            const data = await loadBootstrap();
 
             if (data.icons && data.icons.length > 0 && iconList) {
                 // Xóa tất cả options
@@ -1918,6 +2002,7 @@ document.addEventListener('DOMContentLoaded', function () {
 
                 if (data.success) {
                     alert(data.message);
+                    await refreshBootstrap();
                     // Reset form
                     categoryForm.reset();
                     document.getElementById('category-type').value = 'Chi';
@@ -1967,8 +2052,8 @@ document.addEventListener('DOMContentLoaded', function () {
         categoryListContainer.innerHTML = '<div class="chi-cat placeholder">Đang tải...</div>';
 
         try {
-            const response = await fetch(`/api/categories/${type}`);
-            const data = await response.json();
+            const bootstrap = await loadBootstrap();
+            const data = { categories: bootstrap.category_lists[bootstrapKey(type)] || [] };
 
             if (data.categories && data.categories.length > 0) {
                 categoryListContainer.innerHTML = '';
@@ -2074,6 +2159,7 @@ document.addEventListener('DOMContentLoaded', function () {
 
             if (data.success) {
                 alert(data.message);
+                await refreshBootstrap();
                 loadCategoryList();
                 // Reload danh sách trong form nếu đang ở tab tương ứng
                 if (currentType === type ||
@@ -2150,6 +2236,7 @@ document.addEventListener('DOMContentLoaded', function () {
 
                 if (data.success) {
                     alert(data.message);
+                    await refreshBootstrap();
                     if (editCategoryModal) {
                         editCategoryModal.style.display = 'none';
                     }
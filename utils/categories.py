@@ -0,0 +1,102 @@
+"""
+Registry danh mục trong process cho đường ghi giao dịch
+
+Mỗi worker nạp bảng categories một lần và giữ bảng tra (name, type) -> id cho
+danh mục của giao dịch thêm/sửa từ form.
+
+Registry không đọc stamp 'categories' trước mỗi lần dùng: câu lệnh ghi giao
+dịch tự kiểm tra id lấy từ cache còn đúng (xem ``CATEGORY_MATCH_SQL``); nếu không
+khớp (worker khác đã đổi tên/xóa danh mục) thì nạp lại registry và thử lại.
+Các endpoint CRUD danh mục gọi ``invalidate()`` để chính worker đó nạp lại ngay.
+"""
+import re
+import threading
+from utils.db_utils import db_connection, query_db
+
+# Điều kiện "id danh mục trong cache vẫn mang đúng (name, type)" để ghép vào câu lệnh ghi
+CATEGORY_MATCH_SQL = 'EXISTS (SELECT 1 FROM categories WHERE id = ? AND name = ? AND type = ?)'
+
+_NAME_START = re.compile(r'[A-Za-zÀ-ỹ]')
+
+
+def split_display(value):
+    """Tách chuỗi hiển thị "<icon> <tên>" thành (icon, tên)"""
+    match = _NAME_START.search(value)
+    if not match:
+        return '', value
+    return value[:match.start()].strip(), value[match.start():].strip()
+
+
+class CategoryRegistry:
+    """Bảng tra danh mục trong một worker"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._by_type = {}  # (name, type) -> id
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+
+    def refresh(self):
+        """Nạp lại toàn bộ bảng tra từ DB"""
+        rows = query_db('SELECT id, name, type FROM categories ORDER BY id')
+        by_type = {}
+        for r in rows:
+            # Trùng (name, type) ở hai subtype: giữ id nhỏ nhất như SELECT không ORDER BY trước đây
+            by_type.setdefault((r['name'], r['type']), r['id'])
+        with self._lock:
+            self._by_type = by_type
+            self._loaded = True
+
+    def cached_id(self, name, type_):
+        """id theo (name, type) từ cache, không truy vấn DB (None nếu chưa biết)"""
+        if not self._loaded:
+            self.refresh()
+        return self._by_type.get((name, type_))
+
+    def resolve(self, name, type_, icon='', subtype='normal'):
+        """id danh mục (name, type), tạo mới nếu chưa có.
+
+        Tạo bằng INSERT ... ON CONFLICT DO NOTHING RETURNING id nên hai request
+        cùng tạo một danh mục không sinh lỗi UNIQUE; bên thua đọc lại id đã có.
+        """
+        cat_id = self.cached_id(name, type_)
+        if cat_id is not None:
+            return cat_id
+        with db_connection() as conn:
+            try:
+                row = conn.execute(
+                    'INSERT INTO categories (name, type, subtype, icon) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (name, type, subtype) DO NOTHING RETURNING id',
+                    (name, type_, subtype, icon)
+                ).fetchone()
+                if row is None:
+                    row = conn.execute(
+                        'SELECT id FROM categories WHERE name = ? AND type = ? ORDER BY id LIMIT 1',
+                        (name, type_)
+                    ).fetchone()
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        cat_id = row[0]
+        with self._lock:
+            self._by_type.setdefault((name, type_), cat_id)
+        return cat_id
+
+    def matches(self, conn, ids):
+        """Các id đã resolve ``{(name, type): id}`` còn đúng trong DB không (một truy vấn).
+
+        Dùng cho ghi hàng loạt, nơi không ghép được CATEGORY_MATCH_SQL vào từng dòng.
+        """
+        placeholders = ','.join(['?'] * len(ids))
+        rows = conn.execute(
+            f'SELECT id, name, type FROM categories WHERE id IN ({placeholders})', list(ids.values())
+        ).fetchall()
+        current = {r['id']: (r['name'], r['type']) for r in rows}
+        return all(current.get(cat_id) == key for key, cat_id in ids.items())
+
+
+category_registry = CategoryRegistry()
@@ -0,0 +1,136 @@
+"""
+Nhật ký thay đổi giao dịch (transaction_changes) cho đồng bộ delta
+
+Mỗi giao dịch có một dòng cho mỗi user từng sở hữu nó: ``seq`` là số thứ tự
+của lần thay đổi gần nhất, ``deleted`` = 1 là tombstone (đã xóa hoặc đã chuyển
+sang user khác). Bảng được ghi bằng trigger trên transactions nên mọi đường ghi
+đều được tính; số thứ tự lấy từ bộ đếm 'sync' trong data_versions.
+
+Cursor trả cho client có dạng "<seq>.<phiên bản categories>": đổi tên/icon danh
+mục làm đổi cách hiển thị giao dịch mà không có dòng nào trong nhật ký, nên
+client phải tải lại toàn bộ. Cursor nhỏ hơn mốc 'sync_horizon' (tombstone cũ đã
+bị dọn, hoặc DB vừa được khôi phục từ snapshot - xem snapshots.restore_snapshot)
+cũng buộc tải lại.
+"""
+from config import config
+
+SYNC_SCOPE = 'sync'
+HORIZON_SCOPE = 'sync_horizon'
+
+_TRACKED_COLUMNS = 'user_id, date, type, category_id, amount, note, fund_purpose'
+
+
+def _log_sql(ref, deleted, where=''):
+    return f'''
+        INSERT INTO data_versions (scope, version) VALUES ('{SYNC_SCOPE}', 1)
+        ON CONFLICT (scope) DO UPDATE SET version = version + 1;
+        INSERT INTO transaction_changes (user_id, tx_id, seq, deleted)
+        SELECT COALESCE({ref}.user_id, 0), {ref}.id,
+               (SELECT version FROM data_versions WHERE scope = '{SYNC_SCOPE}'), {deleted}
+        {where}
+        ON CONFLICT (user_id, tx_id) DO UPDATE SET seq = excluded.seq, deleted = excluded.deleted;
+    '''
+
+
+TRANSACTION_CHANGES_SCHEMA = [
+    '''
+        CREATE TABLE IF NOT EXISTS transaction_changes (
+            user_id INTEGER NOT NULL,
+            tx_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            deleted INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, tx_id)
+        ) WITHOUT ROWID
+    ''',
+    '''
+        CREATE INDEX IF NOT EXISTS idx_transaction_changes_user_seq
+        ON transaction_changes (user_id, seq)
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_changes_tx_insert
+        AFTER INSERT ON transactions
+        BEGIN
+            {_log_sql('NEW', 0, 'WHERE true')}
+        END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_changes_tx_delete
+        AFTER DELETE ON transactions
+        BEGIN
+            {_log_sql('OLD', 1, 'WHERE true')}
+        END
+    ''',
+    # Chỉ các cột dữ liệu: cập nhật content_hash (import incremental) không phải thay đổi
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_changes_tx_update
+        AFTER UPDATE OF {_TRACKED_COLUMNS} ON transactions
+        BEGIN
+            {_log_sql('OLD', 1, 'WHERE OLD.user_id IS NOT NEW.user_id')}
+            {_log_sql('NEW', 0, 'WHERE true')}
+        END
+    ''',
+    f'''
+        INSERT OR IGNORE INTO data_versions (scope, version) VALUES ('{HORIZON_SCOPE}', 0)
+    ''',
+]
+
+
+def _version(conn, scope):
+    row = conn.execute('SELECT version FROM data_versions WHERE scope = ?', (scope,)).fetchone()
+    return row[0] if row else 0
+
+
+def current_cursor(conn):
+    return f"{_version(conn, SYNC_SCOPE)}.{_version(conn, 'categories')}"
+
+
+def parse_cursor(cursor):
+    """(seq, phiên bản categories); ValueError nếu cursor sai dạng"""
+    try:
+        seq, categories = cursor.split('.')
+        return int(seq), int(categories)
+    except (AttributeError, ValueError):
+        raise ValueError('Cursor không hợp lệ')
+
+
+def changes_since(conn, user_id, since, limit):
+    """Các thay đổi của user sau cursor ``since``.
+
+    Trả về (changed_ids, deleted_ids), hoặc None khi client phải tải lại toàn bộ
+    (cursor cũ/lạ, danh mục đã đổi, hoặc nhiều hơn ``limit`` thay đổi).
+    Gọi trong một transaction đọc cùng với ``current_cursor`` để cursor mới khớp dữ liệu.
+    """
+    seq, categories_version = parse_cursor(since)
+    if (seq < _version(conn, HORIZON_SCOPE) or seq > _version(conn, SYNC_SCOPE)
+            or categories_version != _version(conn, 'categories')):
+        return None
+    rows = conn.execute(
+        'SELECT tx_id, deleted FROM transaction_changes WHERE user_id = ? AND seq > ? LIMIT ?',
+        (user_id, seq, limit + 1)
+    ).fetchall()
+    if len(rows) > limit:
+        return None
+    changed = [r[0] for r in rows if not r[1]]
+    deleted = [r[0] for r in rows if r[1]]
+    return changed, deleted
+
+
+def prune_changes(conn, keep=None):
+    """Xóa tombstone cũ hơn ``keep`` lần thay đổi gần nhất và nâng mốc 'sync_horizon'.
+
+    Dòng của giao dịch còn tồn tại được giữ (mỗi giao dịch chỉ một dòng). Trả về số dòng đã xóa.
+    """
+    keep = config.SYNC_TOMBSTONE_KEEP if keep is None else keep
+    cutoff = _version(conn, SYNC_SCOPE) - keep
+    if cutoff <= _version(conn, HORIZON_SCOPE):
+        return 0
+    deleted = conn.execute(
+        'DELETE FROM transaction_changes WHERE deleted = 1 AND seq <= ?', (cutoff,)
+    ).rowcount
+    conn.execute(
+        'INSERT INTO data_versions (scope, version) VALUES (?, ?) '
+        'ON CONFLICT (scope) DO UPDATE SET version = excluded.version',
+        (HORIZON_SCOPE, cutoff)
+    )
+    conn.commit()
+    return deleted
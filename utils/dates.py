@@ -0,0 +1,52 @@
+"""
+Chuẩn hóa ngày giao dịch
+
+Cột transactions.date luôn được lưu dạng 'YYYY-MM-DD' để lọc theo khoảng,
+nhóm và sắp xếp chỉ bằng so sánh chuỗi. Mọi đường ghi phải đi qua
+``to_db_date``; DB còn có trigger từ chối giá trị sai dạng.
+"""
+from datetime import date, datetime
+
+DB_DATE_FORMAT = '%Y-%m-%d'
+# Pattern GLOB dùng trong trigger kiểm tra ở DB
+DB_DATE_GLOB = '[0-9][0-9][0-9][0-9]-[0-1][0-9]-[0-3][0-9]'
+
+_INPUT_FORMATS = (
+    '%Y-%m-%d',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%S',
+    '%d/%m/%Y',
+    '%Y/%m/%d',
+)
+
+
+def to_db_date(value, formats=_INPUT_FORMATS):
+    """Chuyển ngày (str/date/datetime/pandas Timestamp) về 'YYYY-MM-DD'.
+
+    ``formats`` truyền vào thì chỉ nhận đúng các định dạng đó; dạng ISO khác
+    (có múi giờ, ...) chỉ được thử thêm với danh sách mặc định.
+    Raise ValueError nếu không nhận dạng được.
+    """
+    if isinstance(value, (datetime, date)):
+        # pandas.Timestamp là subclass của datetime
+        return value.strftime(DB_DATE_FORMAT)
+    if value is None:
+        raise ValueError('Thiếu ngày')
+    text = str(value).strip()
+    for fmt in formats:
+        try:
+            return datetime.strptime(text, fmt).strftime(DB_DATE_FORMAT)
+        except ValueError:
+            continue
+    if formats is _INPUT_FORMATS:
+        try:
+            return datetime.fromisoformat(text.replace('Z', '+00:00')).strftime(DB_DATE_FORMAT)
+        except ValueError:
+            pass
+    raise ValueError(f'Định dạng ngày không hợp lệ: {text}')
+
+
+def to_display_date(db_date):
+    """'YYYY-MM-DD' -> 'DD/MM/YYYY' (định dạng hiển thị / nhập ở giao diện) bằng cắt chuỗi."""
+    return f"{db_date[8:10]}/{db_date[5:7]}/{db_date[0:4]}"
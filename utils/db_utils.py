@@ -1,16 +1,153 @@
 import sqlite3
 import os
+import queue
+import threading
+from contextlib import contextmanager
+import click
+from flask import g, has_app_context
 from config import config
 from werkzeug.security import generate_password_hash
+from utils.rollups import rebuild_daily_totals
 
-def get_db_connection():
-    """Establishes a connection to the SQLite database."""
-    conn = sqlite3.connect(config.DATABASE_URI)
+
+def _configure_connection(conn):
+    """Áp dụng các PRAGMA cho một kết nối mới (chỉ chạy một lần khi tạo kết nối)."""
     conn.row_factory = sqlite3.Row
+    conn.execute(f'PRAGMA busy_timeout = {int(config.DB_BUSY_TIMEOUT_MS)}')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA cache_size = -{int(config.DB_CACHE_SIZE_KB)}')
+    conn.execute(f'PRAGMA mmap_size = {int(config.DB_MMAP_SIZE)}')
+    # Quy tắc ON DELETE của các khóa ngoại (migration 12) chỉ có hiệu lực khi bật
+    conn.execute('PRAGMA foreign_keys = ON')
     return conn
 
+
+def _connect():
+    conn = sqlite3.connect(
+        config.DATABASE_URI,
+        timeout=config.DB_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+    )
+    return _configure_connection(conn)
+
+
+class ConnectionPool:
+    """Pool nhỏ các kết nối SQLite sống lâu, dùng chung trong một worker process.
+
+    Mỗi request (app context) mượn đúng một kết nối qua ``get_db()`` và trả lại
+    khi teardown, nên các luồng không bao giờ dùng chung một kết nối cùng lúc.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._idle = queue.LifoQueue(maxsize=max_size)
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._wal_ready = False
+
+    def _check_fork(self):
+        # Gunicorn fork worker sau khi import app: kết nối kế thừa từ process cha
+        # không được dùng lại, bỏ chúng đi (không close để không đụng vào file lock của cha)
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._idle = queue.LifoQueue(maxsize=self.max_size)
+                    self._pid = os.getpid()
+
+    def acquire(self):
+        self._check_fork()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        conn = _connect()
+        if not self._wal_ready:
+            # journal_mode=WAL được lưu trong file DB, chỉ cần bật một lần
+            conn.execute('PRAGMA journal_mode = WAL')
+            self._wal_ready = True
+        return conn
+
+    def release(self, conn):
+        if self._pid != os.getpid():
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except (queue.Full, sqlite3.Error):
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Trả về pool của process hiện tại (tạo lười ở lần dùng đầu tiên)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(config.DB_POOL_SIZE)
+    return _pool
+
+
+def get_db():
+    """Lấy kết nối gắn với app context hiện tại (mượn từ pool ở lần gọi đầu)."""
+    if 'db' not in g:
+        g.db = get_pool().acquire()
+    return g.db
+
+
+def close_db(exception=None):
+    """Trả kết nối của app context về pool."""
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool().release(conn)
+
+
+def init_app(app):
+    """Đăng ký teardown trả kết nối về pool và các lệnh CLI quản trị DB."""
+    app.teardown_appcontext(close_db)
+    app.cli.add_command(rebuild_rollups_command)
+
+
+@click.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Dựng lại bảng daily_totals từ transactions (flask --app app rebuild-rollups)."""
+    with db_connection() as conn:
+        count = rebuild_daily_totals(conn)
+        conn.commit()
+    click.echo(f'Đã dựng lại daily_totals: {count} dòng.')
+
+
+@contextmanager
+def db_connection():
+    """Kết nối dùng cho một thao tác: của app context nếu có, nếu không thì mượn tạm từ pool."""
+    if has_app_context():
+        yield get_db()
+        return
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+def get_db_connection():
+    """Mở một kết nối riêng (không qua pool) cho các tác vụ dài như import; người gọi tự close."""
+    return _connect()
+
 def init_db():
-    """Initializes the database with the required schema."""
+    """Initializes the database with the required schema, then applies pending migrations."""
     conn = get_db_connection()
     cursor = conn.cursor()
     
@@ -92,26 +229,31 @@ def init_db():
     ''')
     
     conn.commit()
+    
+    # Import muộn: các module migration import ngược lại db_utils
+    from utils.migrations import run_migrations
+    from utils.changelog import prune_changes
+    applied = run_migrations(conn)
+    if applied:
+        print(f"Đã áp dụng migration schema: {applied}")
+    prune_changes(conn)
     conn.close()
 
 def query_db(query, args=(), one=False):
     """Executes a query and returns the results."""
-    conn = get_db_connection()
-    cur = conn.execute(query, args)
-    rv = cur.fetchall()
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        cur = conn.execute(query, args)
+        rv = cur.fetchall()
+        conn.commit()
     return (rv[0] if rv else None) if one else rv
 
 def execute_db(query, args=()):
     """Executes a modification query (INSERT, UPDATE, DELETE)."""
-    conn = get_db_connection()
-    try:
-        cur = conn.execute(query, args)
-        conn.commit()
-        last_row_id = cur.lastrowid
-        conn.close()
-        return last_row_id
-    except Exception as e:
-        conn.close()
-        raise e
+    with db_connection() as conn:
+        try:
+            cur = conn.execute(query, args)
+            conn.commit()
+            return cur.lastrowid
+        except Exception:
+            conn.rollback()
+            raise
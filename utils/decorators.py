@@ -1,16 +1,59 @@
 """
-Decorators cho authentication và authorization
+Decorators cho authentication, authorization và HTTP conditional GET
 """
+import hashlib
+import json
+from datetime import date
 from functools import wraps
-from flask import session, redirect, url_for, flash
+from flask import Response, session, redirect, url_for, flash, request, make_response, jsonify
+from utils.db_utils import query_db
+from utils.fund_groups import membership_graph
+from utils.versions import get_versions, user_scope
+
+
+# Các endpoint vẫn dùng được khi user còn phải đổi mật khẩu tạm (tạo khi import):
+# dashboard chỉ hiện form đổi mật khẩu, không tính số liệu (xem main.dashboard)
+PASSWORD_CHANGE_ENDPOINTS = {'main.dashboard', 'api_users.change_password'}
+
+
+def _password_change_required():
+    """Response chặn request nếu user chưa đổi mật khẩu tạm, None nếu được đi tiếp"""
+    if not session.get('must_change_password') or request.endpoint in PASSWORD_CHANGE_ENDPOINTS:
+        return None
+    if request.path.startswith('/api/'):
+        return jsonify({'error': 'Vui lòng đổi mật khẩu tạm trước khi tiếp tục'}), 403
+    return redirect(url_for('main.dashboard'))
+
+
+def _deleted_user_session():
+    """Response đăng xuất nếu user của session đã bị xóa (mềm hoặc hẳn), None nếu còn
+
+    Session mang stamp 'users' lúc kiểm tra gần nhất (đặt khi login); stamp chưa đổi thì
+    không có user nào bị xóa kể từ đó, chỉ tốn một lần đọc data_versions.
+    """
+    version = get_versions(['users'])['users']
+    if session.get('users_version') == version:
+        return None
+    user = query_db('SELECT deleted_at FROM users WHERE id = ?', (session.get('user_id'),), one=True)
+    if user is None or user['deleted_at']:
+        session.clear()
+        if request.path.startswith('/api/'):
+            return jsonify({'error': 'Tài khoản đã bị xóa'}), 401
+        flash('Tài khoản đã bị xóa!', 'error')
+        return redirect(url_for('auth.login'))
+    session['users_version'] = version
+    return None
 
 
 def login_required(f):
-    """Decorator để yêu cầu đăng nhập"""
+    """Decorator để yêu cầu đăng nhập (và đã đổi mật khẩu tạm nếu có)"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user' not in session:
             return redirect(url_for('auth.login'))
+        blocked = _deleted_user_session() or _password_change_required()
+        if blocked:
+            return blocked
         return f(*args, **kwargs)
     return decorated_function
 
@@ -21,8 +64,51 @@ def admin_required(f):
     def decorated_function(*args, **kwargs):
         if 'user' not in session:
             return redirect(url_for('auth.login'))
+        blocked = _deleted_user_session() or _password_change_required()
+        if blocked:
+            return blocked
         if session.get('role') != 'admin':
             flash('Bạn không có quyền truy cập trang này!', 'error')
             return redirect(url_for('main.dashboard'))
         return f(*args, **kwargs)
     return decorated_function
+
+
+def versioned_etag(*scopes, fund_group=False):
+    """Decorator ETag cho GET API theo user: trả 304 trước khi chạy truy vấn nào của view.
+
+    ETag = hash(path, user, tham số request, ngày hiện tại, phiên bản dữ liệu). Phiên
+    bản là bộ đếm data_versions do trigger tăng ở mọi đường ghi: 'user:<id>' của user
+    đang đăng nhập (hoặc của mọi user cùng nhóm quỹ nếu ``fund_group``, kèm stamp
+    'fund_groups') và các ``scopes`` thêm vào (vd. 'categories' khi response có tên
+    danh mục). Ngày nằm trong khóa vì các báo cáo "tháng này/năm nay" đổi theo ngày.
+    Trường hợp thường gặp chỉ tốn một truy vấn đọc data_versions.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            user_id = session.get('user_id')
+            if not user_id:
+                return f(*args, **kwargs)
+            if fund_group:
+                _, versions = membership_graph.linked_with_versions(user_id, scopes)
+            else:
+                versions = get_versions([user_scope(user_id), *scopes])
+            key = json.dumps([
+                request.path, user_id, sorted(request.args.items(multi=True)),
+                date.today().isoformat(), sorted(versions.items())
+            ])
+            etag = hashlib.sha1(key.encode('utf-8')).hexdigest()
+            
+            if etag in request.if_none_match:
+                response = Response(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return decorated_function
+    return decorator
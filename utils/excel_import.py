@@ -0,0 +1,550 @@
+"""
+Import dữ liệu từ file backup Excel (Full Restore)
+
+Pipeline xử lý theo tập hợp thay vì từng dòng:
+1. Chuẩn hóa cột bằng các phép vector của pandas
+2. Tra users / categories / nhóm quỹ / mục đích quỹ trên các map trong bộ nhớ
+3. Tạo các bản ghi còn thiếu bằng một executemany cho mỗi loại
+4. Chèn giao dịch theo lô lớn
+
+Số câu lệnh SQL vì thế tỉ lệ với số loại dữ liệu, không tỉ lệ với số dòng.
+Sheet giao dịch được đọc stream (WorkbookReader) và xử lý theo từng khối
+nên bộ nhớ không phụ thuộc kích thước file.
+
+Hai chế độ cho giao dịch:
+- 'full': xóa toàn bộ rồi chèn lại (Full Restore)
+- 'incremental': so dấu vân tay (transactions.content_hash) với DB, chỉ
+  thêm/sửa/(tùy chọn) xóa các dòng khác biệt -> chi phí ghi tỉ lệ với số thay đổi
+"""
+import hashlib
+from collections import defaultdict
+from datetime import datetime
+import pandas as pd
+from openpyxl import load_workbook
+from werkzeug.security import generate_password_hash
+from utils.dates import to_db_date
+
+INSERT_BATCH_SIZE = 5000
+IMPORT_CHUNK_SIZE = 5000
+DEFAULT_IMPORT_PASSWORD = '123456'
+IMPORT_MODES = ('full', 'incremental')
+
+# Các cột giao dịch được chèn/so sánh; mỗi dòng đã chuẩn bị là
+# (*TX_COLUMNS, content_hash, source_id) với source_id = cột ID của file (có thể None)
+TX_COLUMNS = ('user_id', 'date', 'type', 'category_id', 'amount', 'note', 'fund_purpose')
+
+
+def _text(df, column, default=None):
+    """Cột dạng chuỗi đã strip; ô trống (NaN) -> default. Thiếu cột -> toàn default."""
+    if column not in df.columns:
+        return pd.Series(default, index=df.index, dtype=object)
+    col = df[column]
+    return col.astype(str).str.strip().astype(object).where(col.notna(), default)
+
+
+def _rows(df):
+    """Các dòng của DataFrame dạng tuple kiểu Python (sqlite3 không bind được kiểu numpy)"""
+    return list(df.astype(object).itertuples(index=False, name=None))
+
+
+def content_hash(user_id, date, tx_type, category_id, amount, note, fund_purpose):
+    """Dấu vân tay nội dung một giao dịch (None và '' coi như nhau)"""
+    parts = (
+        '' if user_id is None else str(int(user_id)),
+        date or '',
+        tx_type or '',
+        '' if category_id is None else str(int(category_id)),
+        repr(float(amount)),
+        note or '',
+        fund_purpose or '',
+    )
+    return hashlib.blake2b('\x1f'.join(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _to_db_dates(col):
+    """Chuẩn hóa cột ngày; giá trị không đọc được -> None"""
+    if pd.api.types.is_datetime64_any_dtype(col):
+        return col.dt.strftime('%Y-%m-%d').astype(object).where(col.notna(), None)
+
+    def convert(value):
+        try:
+            return to_db_date(value)
+        except (TypeError, ValueError):
+            return None
+    return col.map(convert)
+
+
+class WorkbookReader:
+    """Đọc file import theo sheet mà không nạp cả workbook vào bộ nhớ.
+
+    .xlsx được mở bằng openpyxl read-only: các dòng được parse dần từ XML và gom
+    thành DataFrame IMPORT_CHUNK_SIZE dòng, nên bộ nhớ đỉnh chỉ phụ thuộc cỡ khối.
+    .xls (định dạng nhị phân cũ) không stream được, vẫn đọc qua pandas.
+    """
+
+    def __init__(self, path):
+        self._workbook = None
+        self._xls = None
+        if str(path).lower().endswith('.xlsx'):
+            self._workbook = load_workbook(path, read_only=True, data_only=True)
+            self.sheet_names = list(self._workbook.sheetnames)
+        else:
+            self._xls = pd.ExcelFile(path)
+            self.sheet_names = list(self._xls.sheet_names)
+
+    def close(self):
+        if self._workbook is not None:
+            self._workbook.close()
+        if self._xls is not None:
+            self._xls.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def row_count(self, sheet_name):
+        """Số dòng dữ liệu theo kích thước ghi trong file (None nếu file không ghi)"""
+        if self._workbook is None:
+            return None
+        max_row = self._workbook[sheet_name].max_row
+        return max(max_row - 1, 0) if max_row else None
+
+    def iter_chunks(self, sheet_name, chunk_size=IMPORT_CHUNK_SIZE):
+        """Các DataFrame liên tiếp của sheet (dòng đầu là tên cột).
+
+        Index của mỗi khối là vị trí 0-based của dòng dữ liệu trong sheet (như pd.read_excel)
+        để thông báo lỗi theo số dòng vẫn đúng; dòng trống hoàn toàn bị bỏ qua.
+        """
+        if self._workbook is None:
+            df = pd.read_excel(self._xls, sheet_name)
+            for start in range(0, len(df), chunk_size):
+                yield df.iloc[start:start + chunk_size]
+            return
+
+        rows = self._workbook[sheet_name].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        keep = [i for i, name in enumerate(header) if name is not None]
+        columns = [header[i] for i in keep]
+        values, index = [], []
+        for position, row in enumerate(rows):
+            record = [row[i] if i < len(row) else None for i in keep]
+            if all(v is None for v in record):
+                continue
+            values.append(record)
+            index.append(position)
+            if len(values) >= chunk_size:
+                yield pd.DataFrame(values, columns=columns, index=index)
+                values, index = [], []
+        if values:
+            yield pd.DataFrame(values, columns=columns, index=index)
+
+    def read(self, sheet_name):
+        """Cả sheet thành một DataFrame (cho các sheet nhỏ: Users, Categories, ...)"""
+        chunks = list(self.iter_chunks(sheet_name))
+        return pd.concat(chunks) if chunks else pd.DataFrame()
+
+
+class ExcelImporter:
+    """Khôi phục dữ liệu vào DB qua một kết nối; người gọi tự commit/rollback."""
+
+    def __init__(self, conn, job=None):
+        self.conn = conn
+        self.job = job  # JobContext (utils.jobs) để báo tiến độ, có thể None
+        self.messages = []
+        self.errors = []
+        self.users_by_username = {}
+        self.users_by_name = {}
+        self.deleting_usernames = set()  # user đã xóa mềm, đang chờ job purge
+        self.categories = {}  # (name, type) -> id, ưu tiên subtype 'normal'
+        self.categories_by_name = {}
+        self.fund_purposes = set()
+        self.groups = {}
+        self._provisional_hash = None
+        self.diff = None  # số lượng thay đổi của chế độ incremental
+        self._load_maps()
+
+    # --- Maps trong bộ nhớ ---
+
+    def _load_users(self):
+        self.users_by_username, self.users_by_name, self.deleting_usernames = {}, {}, set()
+        for r in self.conn.execute('SELECT id, username, name, deleted_at FROM users ORDER BY id'):
+            if r['deleted_at'] is not None:
+                # Dữ liệu gắn vào user đang xóa sẽ bị purge xóa theo: không ánh xạ tới họ
+                self.deleting_usernames.add(r['username'])
+                continue
+            self.users_by_username[r['username']] = r['id']
+            if r['name'] is not None:
+                self.users_by_name.setdefault(r['name'], r['id'])
+
+    def _load_categories(self):
+        self.categories, self.categories_by_name, self.fund_purposes = {}, {}, set()
+        rows = self.conn.execute(
+            "SELECT id, name, type, subtype FROM categories ORDER BY subtype != 'normal', id"
+        )
+        for r in rows:
+            self.categories.setdefault((r['name'], r['type']), r['id'])
+            self.categories_by_name.setdefault(r['name'], r['id'])
+            if r['subtype'] == 'fund':
+                self.fund_purposes.add(r['name'])
+
+    def _load_groups(self):
+        self.groups = {r['name']: r['id'] for r in self.conn.execute('SELECT id, name FROM fund_groups ORDER BY id')}
+
+    def _load_maps(self):
+        self._load_users()
+        self._load_categories()
+        self._load_groups()
+
+    def _insert_users(self, rows):
+        """rows: [(username, name, role, active)] -> chèn với mật khẩu tạm, buộc đổi ở lần đăng nhập đầu.
+
+        Hash mật khẩu tạm chỉ tính một lần cho cả lần import (PBKDF2 cố ý chậm,
+        băm riêng cho từng user sẽ làm import hàng trăm user mất vài phút).
+        """
+        rows = list(rows)
+        if not rows:
+            return
+        if self._provisional_hash is None:
+            self._provisional_hash = generate_password_hash(DEFAULT_IMPORT_PASSWORD)
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO users (username, password, name, role, active, must_change_password) '
+            'VALUES (?, ?, ?, ?, ?, 1)',
+            [(u, self._provisional_hash, n, r, a) for u, n, r, a in rows]
+        )
+        self._load_users()
+
+    # --- Các bước import ---
+
+    def clear_transactions(self):
+        self.conn.execute('DELETE FROM transactions')
+        self.messages.append("Đã xóa dữ liệu giao dịch cũ.")
+
+    def import_users(self, df):
+        if 'username' not in df.columns:
+            self.errors.append("Sheet Users thiếu cột username")
+            return
+        usernames = _text(df, 'username')
+        users = pd.DataFrame({
+            'username': usernames,
+            'name': _text(df, 'name').fillna(usernames),
+            'role': _text(df, 'role', 'user'),
+            'active': pd.to_numeric(df['active'], errors='coerce').fillna(1).astype(int)
+                      if 'active' in df.columns else 1,
+        }).dropna(subset=['username'])
+        deleting = users['username'].isin(self.deleting_usernames)
+        for username in users.loc[deleting, 'username'].drop_duplicates():
+            self.errors.append(f"User {username} đang được xóa, không import lại được")
+        new_users = users[~users['username'].isin(self.users_by_username.keys()) & ~deleting].drop_duplicates('username')
+        self._insert_users(_rows(new_users))
+        self.messages.append(f"Đã thêm {len(new_users)} users mới.")
+
+    def import_categories(self, df):
+        if 'name' not in df.columns or 'type' not in df.columns:
+            self.errors.append("Sheet Categories thiếu cột name/type")
+            return
+        cats = pd.DataFrame({
+            'name': _text(df, 'name'),
+            'type': _text(df, 'type'),
+            'subtype': _text(df, 'subtype', 'default'),
+            'icon': _text(df, 'icon', '📝'),
+        }).dropna(subset=['name', 'type']).drop_duplicates(['name', 'type', 'subtype'], keep='last')
+        existing = {tuple(r) for r in self.conn.execute('SELECT name, type, subtype FROM categories')}
+        rows = _rows(cats)
+        # Danh mục đã có (trùng name, type, subtype) chỉ cập nhật icon; chưa có thì thêm mới
+        self.conn.executemany(
+            'INSERT INTO categories (name, type, subtype, icon) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (name, type, subtype) DO UPDATE SET icon = excluded.icon',
+            rows
+        )
+        count_new = sum(1 for r in rows if r[:3] not in existing)
+        self._load_categories()
+        self.messages.append(f"Đã đồng bộ {count_new} danh mục mới.")
+
+    def import_groups(self, df):
+        if 'name' not in df.columns:
+            self.errors.append("Sheet FundGroups thiếu cột name")
+            return
+        groups = pd.DataFrame({
+            'name': _text(df, 'name'),
+            # Người tạo không còn (đã xóa, hoặc ô trống do ON DELETE SET NULL) -> NULL
+            'created_by': _text(df, 'created_by').map(self.users_by_username)
+                          .map(lambda v: None if pd.isna(v) else int(v)),
+        }).dropna(subset=['name']).drop_duplicates('name')
+        new_groups = groups[~groups['name'].isin(self.groups.keys())]
+        self.conn.executemany(
+            'INSERT INTO fund_groups (name, created_by) VALUES (?, ?)',
+            _rows(new_groups)
+        )
+        self._load_groups()
+        self.messages.append(f"Đã thêm {len(new_groups)} nhóm quỹ mới.")
+
+    def import_members(self, df):
+        members = pd.DataFrame({
+            'group_id': _text(df, 'group_name').map(self.groups),
+            'user_id': _text(df, 'user_username').map(self.users_by_username),
+        }).dropna().astype(int).drop_duplicates()
+        existing = {tuple(r) for r in self.conn.execute('SELECT group_id, user_id FROM fund_group_members')}
+        new_members = [r for r in _rows(members) if r not in existing]
+        self.conn.executemany(
+            'INSERT INTO fund_group_members (group_id, user_id) VALUES (?, ?)',
+            new_members
+        )
+        self.messages.append(f"Đã khôi phục {len(new_members)} thành viên nhóm.")
+
+    def _resolve_users(self, df, blocked):
+        """Cột user_id cho từng dòng giao dịch; tạo user mới cho tên chưa có.
+
+        Dòng ``blocked`` (Username của user đang xóa) giữ user_id rỗng, không tra theo tên.
+        """
+        user_ids = _text(df, 'Username').map(self.users_by_username)
+        if 'Người dùng' not in df.columns:
+            return user_ids
+
+        names = _text(df, 'Người dùng').where(~blocked, None)
+        missing = user_ids.isna() & names.notna()
+        user_ids[missing] = names[missing].map(self.users_by_name)
+
+        unknown = names[user_ids.isna() & names.notna()].drop_duplicates()
+        if not unknown.empty:
+            stamp = int(datetime.now().timestamp())
+            self._insert_users(
+                (f"{name.lower().replace(' ', '')}_{stamp}_{index}", name, 'user', 1)
+                for index, name in unknown.items()
+            )
+            still_missing = user_ids.isna() & names.notna()
+            user_ids[still_missing] = names[still_missing].map(self.users_by_name)
+        return user_ids
+
+    def _resolve_categories(self, names, types):
+        """Cột category_id; tạo danh mục thường còn thiếu bằng một executemany"""
+        keys = pd.Series(list(zip(names, types)), index=names.index)
+        cat_ids = keys.map(self.categories)
+        cat_ids = cat_ids.where(cat_ids.notna(), names.map(self.categories_by_name))
+
+        missing = keys[cat_ids.isna() & names.notna()].drop_duplicates()
+        if not missing.empty:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO categories (name, type, icon) VALUES (?, ?, ?)',
+                [(name, cat_type if isinstance(cat_type, str) else 'Chi', '📝') for name, cat_type in missing]
+            )
+            self._load_categories()
+            cat_ids = keys.map(self.categories)
+            cat_ids = cat_ids.where(cat_ids.notna(), names.map(self.categories_by_name))
+        return cat_ids
+
+    def _ensure_fund_purposes(self, purposes):
+        new_purposes = set(purposes.dropna()) - self.fund_purposes - {''}
+        if new_purposes:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO categories (name, type, subtype, icon) VALUES (?, 'Chi', 'fund', '💰')",
+                [(p,) for p in sorted(new_purposes)]
+            )
+            self._load_categories()
+
+    def prepare_transactions(self, df, row_offset=0):
+        """Chuẩn hóa một khối dòng giao dịch -> list tuple (*TX_COLUMNS, content_hash, source_id).
+
+        ``row_offset`` cộng vào index của ``df`` (0-based trong sheet) khi báo lỗi theo số dòng.
+        """
+        if df.empty:
+            return []
+        for column in ('Ngày', 'Danh mục', 'Loại', 'Số tiền'):
+            if column not in df.columns:
+                message = f"Sheet giao dịch thiếu cột {column}"
+                if message not in self.errors:
+                    self.errors.append(message)
+                return []
+
+        blocked = _text(df, 'Username').isin(self.deleting_usernames)
+        for index in df.index[blocked]:
+            self.errors.append(f"Lỗi dòng {row_offset + index + 2}: user đang được xóa")
+        trans = pd.DataFrame({
+            'user_id': self._resolve_users(df, blocked),
+            'date': _to_db_dates(df['Ngày']),
+            'type': _text(df, 'Loại'),
+            'category_name': _text(df, 'Danh mục'),
+            'amount': pd.to_numeric(df['Số tiền'], errors='coerce'),
+            'note': _text(df, 'Ghi chú', ''),
+            'fund_purpose': _text(df, 'Mục đích quỹ'),
+            'source_id': pd.to_numeric(df['ID'], errors='coerce') if 'ID' in df.columns else None,
+        })
+        trans = trans[trans['user_id'].notna()]
+
+        # Số tiền vô hạn ("inf") bị trigger ở DB từ chối (migration 13): báo lỗi theo dòng
+        invalid = trans['date'].isna() | ~trans['amount'].abs().lt(float('inf')) | trans['type'].isna()
+        for index in trans.index[invalid]:
+            self.errors.append(f"Lỗi dòng {row_offset + index + 2}: ngày, loại hoặc số tiền không hợp lệ")
+        trans = trans[~invalid]
+        if trans.empty:
+            return []
+
+        trans['category_id'] = self._resolve_categories(trans['category_name'], trans['type'])
+        self._ensure_fund_purposes(trans['fund_purpose'])
+
+        trans['user_id'] = trans['user_id'].astype(int)
+        trans['category_id'] = trans['category_id'].map(lambda v: None if pd.isna(v) else int(v))
+        source_ids = trans['source_id'].map(lambda v: None if pd.isna(v) else int(v))
+        return [
+            (*row, content_hash(*row), source_id)
+            for row, source_id in zip(_rows(trans[list(TX_COLUMNS)]), source_ids)
+        ]
+
+    def _stage(self, name, total=None):
+        if self.job:
+            self.job.stage(name, total)
+
+    def _progress(self, processed):
+        if self.job:
+            self.job.progress(processed)
+
+    def insert_transactions(self, rows):
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            self.conn.executemany('''
+                INSERT INTO transactions (user_id, date, type, category_id, amount, note, fund_purpose, content_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [row[:8] for row in rows[start:start + INSERT_BATCH_SIZE]])
+        return len(rows)
+
+    def import_transactions(self, chunks, total=None):
+        """Full Restore giao dịch từ các khối DataFrame (``WorkbookReader.iter_chunks``)"""
+        self._stage('Transactions', total)
+        count = read = 0
+        for chunk in chunks:
+            count += self.insert_transactions(self.prepare_transactions(chunk))
+            read += len(chunk)
+            self._progress(read)
+        self.messages.append(f"Đã import {count} giao dịch.")
+
+    # --- Chế độ incremental ---
+
+    def _backfill_hashes(self):
+        """Tính content_hash cho các dòng chưa có (ghi qua app, hoặc bị trigger xóa khi sửa)"""
+        rows = self.conn.execute(f'''
+            SELECT id, {', '.join(TX_COLUMNS)} FROM transactions WHERE content_hash IS NULL
+        ''').fetchall()
+        self.conn.executemany(
+            'UPDATE transactions SET content_hash = ? WHERE id = ?',
+            [(content_hash(*row[1:]), row[0]) for row in rows]
+        )
+
+    def begin_sync(self):
+        """Nạp dấu vân tay các giao dịch hiện có để so với file theo từng khối"""
+        self._backfill_hashes()
+        self._hash_by_id = {}
+        self._ids_by_hash = defaultdict(list)
+        for row_id, row_hash in self.conn.execute('SELECT id, content_hash FROM transactions'):
+            self._hash_by_id[row_id] = row_hash
+            self._ids_by_hash[row_hash].append(row_id)
+        self._claimed = set()
+        self.diff = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0, 'missing': 0}
+
+    def sync_chunk(self, rows):
+        """Ghi phần khác biệt của một khối dòng đã chuẩn bị.
+
+        Dòng có ID trùng giao dịch trong DB được so theo ID (khác hash -> cập nhật);
+        dòng còn lại khớp theo hash với giao dịch chưa được nhận, không khớp -> thêm mới.
+        Nếu giao dịch mà ID trỏ tới đã bị khối trước nhận theo hash, dòng đó được thêm
+        mới: nội dung cuối cùng của bảng vẫn đúng, chỉ khác id.
+        """
+        inserts, updates, by_hash = [], [], []
+        # Trong khối, dòng có ID được xét trước để khớp theo hash không "giành" mất giao dịch đó
+        for row in rows:
+            source_id = row[-1]
+            if source_id in self._hash_by_id and source_id not in self._claimed:
+                self._claimed.add(source_id)
+                if self._hash_by_id[source_id] == row[7]:
+                    self.diff['unchanged'] += 1
+                else:
+                    updates.append((*row[:8], source_id))
+            else:
+                by_hash.append(row)
+        for row in by_hash:
+            candidates = self._ids_by_hash.get(row[7], [])
+            while candidates and candidates[-1] in self._claimed:
+                candidates.pop()
+            if candidates:
+                self._claimed.add(candidates.pop())
+                self.diff['unchanged'] += 1
+            else:
+                inserts.append(row)
+
+        self.insert_transactions(inserts)
+        self.conn.executemany('''
+            UPDATE transactions
+            SET user_id = ?, date = ?, type = ?, category_id = ?, amount = ?, note = ?,
+                fund_purpose = ?, content_hash = ?
+            WHERE id = ?
+        ''', updates)
+        self.diff['inserted'] += len(inserts)
+        self.diff['updated'] += len(updates)
+
+    def finish_sync(self, delete_missing=False):
+        """Giao dịch trong DB không được dòng nào nhận là "thiếu", chỉ xóa khi ``delete_missing``"""
+        missing = [(row_id,) for row_id in self._hash_by_id if row_id not in self._claimed]
+        if delete_missing:
+            self.conn.executemany('DELETE FROM transactions WHERE id = ?', missing)
+            self.diff['deleted'] = len(missing)
+        self.diff['missing'] = len(missing)
+        return self.diff
+
+    def import_transactions_incremental(self, chunks, total=None, delete_missing=False):
+        """Import incremental từ các khối DataFrame; trả về dict số lượng thay đổi"""
+        self._stage('Transactions', total)
+        error_count = len(self.errors)
+        self.begin_sync()
+        read = 0
+        for chunk in chunks:
+            self.sync_chunk(self.prepare_transactions(chunk))
+            read += len(chunk)
+            self._progress(read)
+        if delete_missing and len(self.errors) > error_count:
+            # Dòng lỗi bị bỏ qua sẽ trông như "thiếu" -> không xóa gì để tránh mất dữ liệu
+            self.errors.append("File có dòng giao dịch lỗi: bỏ qua bước xóa giao dịch không có trong file")
+            delete_missing = False
+        diff = self.finish_sync(delete_missing)
+        message = (f"Đồng bộ giao dịch: thêm {diff['inserted']}, cập nhật {diff['updated']}, "
+                   f"xóa {diff['deleted']}, giữ nguyên {diff['unchanged']}.")
+        if not delete_missing and diff['missing']:
+            message += f" {diff['missing']} giao dịch trong DB không có trong file (giữ lại)."
+        self.messages.append(message)
+        return diff
+
+
+def import_excel_workbook(conn, reader, job=None, mode='full', delete_missing=False):
+    """Import từ ``WorkbookReader`` trong một transaction của ``conn`` (người gọi commit).
+
+    ``mode``: 'full' (xóa hết giao dịch rồi chèn lại) hoặc 'incremental' (chỉ ghi phần
+    khác biệt; ``delete_missing`` xóa giao dịch không có trong file).
+    Sheet giao dịch được đọc và ghi theo khối IMPORT_CHUNK_SIZE dòng.
+    ``job`` (JobContext) nhận tiến độ từng bước khi chạy nền. Trả về ExcelImporter chứa messages/errors.
+    """
+    importer = ExcelImporter(conn, job)
+    if mode == 'full':
+        importer.clear_transactions()
+
+    if 'Users' in reader.sheet_names:
+        importer._stage('Users')
+        importer.import_users(reader.read('Users'))
+    if 'Categories' in reader.sheet_names:
+        importer._stage('Categories')
+        importer.import_categories(reader.read('Categories'))
+    if 'FundGroups' in reader.sheet_names:
+        importer._stage('FundGroups')
+        importer.import_groups(reader.read('FundGroups'))
+    if 'GroupMembers' in reader.sheet_names:
+        importer._stage('GroupMembers')
+        importer.import_members(reader.read('GroupMembers'))
+
+    sheet_trans = 'Transactions' if 'Transactions' in reader.sheet_names else (reader.sheet_names[0] if reader.sheet_names else None)
+    if sheet_trans:
+        chunks = reader.iter_chunks(sheet_trans)
+        total = reader.row_count(sheet_trans)
+        if mode == 'full':
+            importer.import_transactions(chunks, total)
+        else:
+            importer.import_transactions_incremental(chunks, total, delete_missing)
+    return importer
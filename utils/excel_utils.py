@@ -0,0 +1,50 @@
+"""
+Xử lý đọc/ghi Excel cho backup/restore
+
+Ghi dùng workbook write-only của openpyxl: từng dòng được đẩy thẳng từ
+cursor SQLite xuống file tạm theo từng lô, nên bộ nhớ không phụ thuộc
+kích thước bảng.
+"""
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+
+EXPORT_CHUNK_SIZE = 2000
+MAX_COLUMN_WIDTH = 50
+
+
+def _column_widths(conn, sql, params, headers):
+    """Độ rộng cột tính bằng MAX(length(...)) trong SQL thay vì duyệt từng ô"""
+    columns = ', '.join(f'MAX(length("{h}"))' for h in headers)
+    row = conn.execute(f'SELECT {columns} FROM ({sql})', params).fetchone()
+    return [min(max(len(h), row[i] or 0) + 2, MAX_COLUMN_WIDTH) for i, h in enumerate(headers)]
+
+
+def write_query_sheet(workbook, conn, title, sql, params=(), chunk_size=EXPORT_CHUNK_SIZE, on_chunk=None):
+    """Ghi kết quả một truy vấn thành một sheet (dòng đầu là tên cột). Trả về số dòng dữ liệu.
+
+    ``on_chunk(count)`` (tùy chọn) được gọi sau mỗi lô với tổng số dòng đã ghi.
+    """
+    headers = [d[0] for d in conn.execute(f'SELECT * FROM ({sql}) LIMIT 0', params).description]
+
+    sheet = workbook.create_sheet(title)
+    # Workbook write-only: phải đặt độ rộng cột trước khi ghi dòng
+    for idx, width in enumerate(_column_widths(conn, sql, params, headers), start=1):
+        sheet.column_dimensions[get_column_letter(idx)].width = width
+    sheet.append(headers)
+
+    count = 0
+    cur = conn.execute(sql, params)
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        for row in rows:
+            sheet.append(tuple(row))
+        count += len(rows)
+        if on_chunk:
+            on_chunk(count)
+    return count
+
+
+def new_export_workbook():
+    return Workbook(write_only=True)
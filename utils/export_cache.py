@@ -0,0 +1,44 @@
+"""
+Cache file export trên đĩa theo phiên bản dữ liệu
+
+Khóa cache = hash(loại export, định dạng, tham số, stamp) với stamp là
+``global_data_version`` lúc đọc dữ liệu. DB không đổi -> cùng khóa -> dùng lại
+file đã tạo; khóa cũng là ETag (strong) của response tải file.
+"""
+import hashlib
+import json
+import os
+from config import config
+
+
+def cache_dir():
+    os.makedirs(config.EXPORT_CACHE_DIR, exist_ok=True)
+    return config.EXPORT_CACHE_DIR
+
+
+def cache_key(kind, stamp, params=None):
+    payload = json.dumps([kind, stamp, params or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def cache_path(key, suffix):
+    return os.path.join(cache_dir(), f'{key}{suffix}')
+
+
+def lookup(key, suffix):
+    """Đường dẫn file đã cache của khóa (None nếu chưa có)"""
+    path = cache_path(key, suffix)
+    return path if os.path.exists(path) else None
+
+
+def store(tmp_path, key, suffix):
+    """Đưa file vừa tạo vào cache (đổi tên nguyên tử), xóa các bản cũ vượt EXPORT_CACHE_KEEP"""
+    path = cache_path(key, suffix)
+    os.replace(tmp_path, path)
+    files = sorted(
+        (os.path.join(cache_dir(), name) for name in os.listdir(cache_dir())),
+        key=os.path.getmtime, reverse=True
+    )
+    for old in files[config.EXPORT_CACHE_KEEP:]:
+        os.remove(old)
+    return path
@@ -0,0 +1,83 @@
+"""
+Cache đồ thị thành viên nhóm quỹ: user -> nhóm -> các thành viên cùng nhóm
+
+Mỗi worker dựng đồ thị một lần từ fund_group_members và giữ trong bộ nhớ.
+Đồ thị được đánh dấu bằng phiên bản 'fund_groups' trong data_versions (tăng
+bằng trigger), nên khi một worker khác sửa nhóm thì worker này thấy stamp
+khác và tự dựng lại. Các endpoint sửa nhóm gọi thêm ``invalidate()`` để
+chính worker đó không phải chờ đến lần kiểm tra stamp.
+"""
+import threading
+from utils.db_utils import query_db
+from utils.versions import get_versions, user_scope
+
+FUND_GROUPS_SCOPE = 'fund_groups'
+
+
+class MembershipGraph:
+    """Đồ thị thành viên nhóm quỹ trong một worker"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._user_groups = {}   # user_id -> set(group_id)
+        self._group_members = {}  # group_id -> set(user_id)
+
+    def invalidate(self):
+        with self._lock:
+            self._version = None
+
+    def refresh(self, version):
+        """Dựng lại đồ thị nếu phiên bản đang giữ khác ``version``."""
+        if self._version is not None and self._version == version:
+            return
+        rows = query_db('SELECT group_id, user_id FROM fund_group_members')
+        user_groups, group_members = {}, {}
+        for r in rows:
+            user_groups.setdefault(r['user_id'], set()).add(r['group_id'])
+            group_members.setdefault(r['group_id'], set()).add(r['user_id'])
+        with self._lock:
+            self._user_groups = user_groups
+            self._group_members = group_members
+            self._version = version
+
+    def _ensure_fresh(self):
+        self.refresh(get_versions([FUND_GROUPS_SCOPE])[FUND_GROUPS_SCOPE])
+
+    def _linked_from_cache(self, user_id):
+        linked = {user_id}
+        for group_id in self._user_groups.get(user_id, ()):
+            linked |= self._group_members.get(group_id, set())
+        return linked
+
+    def groups_of(self, user_id):
+        self._ensure_fresh()
+        return set(self._user_groups.get(user_id, ()))
+
+    def members_of(self, group_id):
+        self._ensure_fresh()
+        return set(self._group_members.get(group_id, ()))
+
+    def linked_user_ids(self, user_id):
+        """Tập user cùng nhóm quỹ với user_id (gồm cả chính user đó)."""
+        self._ensure_fresh()
+        return self._linked_from_cache(user_id)
+
+    def linked_with_versions(self, user_id, extra_scopes=()):
+        """Tập user cùng nhóm + phiên bản dữ liệu của họ và ``extra_scopes``.
+
+        Trường hợp thường gặp chỉ tốn một truy vấn: đọc cùng lúc stamp
+        'fund_groups' và phiên bản của các user lấy từ đồ thị đang cache.
+        Nếu đồ thị đã cũ thì dựng lại và đọc lại phiên bản.
+        """
+        while True:
+            linked = self._linked_from_cache(user_id)
+            scopes = [FUND_GROUPS_SCOPE, *extra_scopes, *(user_scope(uid) for uid in linked)]
+            versions = get_versions(scopes)
+            if self._version is not None and versions[FUND_GROUPS_SCOPE] == self._version:
+                del versions[FUND_GROUPS_SCOPE]
+                return linked, versions
+            self.refresh(versions[FUND_GROUPS_SCOPE])
+
+
+membership_graph = MembershipGraph()
@@ -0,0 +1,299 @@
+"""
+Chạy tác vụ nặng (import/export) ở nền
+
+Request chỉ ghi một dòng vào bảng ``jobs`` rồi đẩy việc sang ThreadPoolExecutor
+của worker process và trả ngay job id; client poll trạng thái qua /api/jobs/<id>.
+Trạng thái/tiến độ nằm trong DB nên worker nào nhận request poll cũng trả lời được.
+
+Bảng jobs ở file SQLite riêng (JOBS_DIR/jobs.db): job import giữ write lock của
+database.db suốt transaction, nếu ghi tiến độ vào cùng file thì sẽ tự chặn mình.
+
+Vòng đời: queued -> running -> done | failed.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import datetime
+from config import config
+
+JOBS_SCHEMA = [
+    '''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY NOT NULL,
+            kind TEXT NOT NULL,            -- 'import_excel', 'export_excel', ...
+            job_key TEXT,                  -- job cùng kind + key đang chạy thì dùng lại
+            status TEXT NOT NULL,          -- 'queued', 'running', 'done', 'failed'
+            stage TEXT,                    -- bước đang chạy (hiển thị cho người dùng)
+            processed_rows INTEGER NOT NULL DEFAULT 0,
+            total_rows INTEGER,
+            message TEXT,
+            errors TEXT,                   -- JSON list
+            result_path TEXT,
+            result_name TEXT,
+            pid INTEGER,                   -- worker process giữ job (ghi ngay lúc queued)
+            created_by INTEGER,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            finished_at TEXT
+        )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs (created_at)',
+]
+
+# Cột thêm sau khi bảng jobs đã có (jobs.db cũ không qua CREATE TABLE mới)
+JOBS_ADDED_COLUMNS = {
+    'job_key': 'TEXT',
+}
+
+# Ghi tiến độ xuống DB không dày hơn mức này (giây)
+PROGRESS_INTERVAL = 0.5
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_schema_ready = set()
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _get_executor():
+    """Executor của process hiện tại (tạo lười, tạo lại sau khi gunicorn fork)."""
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=config.JOB_WORKERS, thread_name_prefix='job')
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def jobs_dir():
+    os.makedirs(config.JOBS_DIR, exist_ok=True)
+    return config.JOBS_DIR
+
+
+def _connect():
+    path = os.path.join(jobs_dir(), 'jobs.db')
+    conn = sqlite3.connect(path, timeout=config.DB_BUSY_TIMEOUT_MS / 1000)
+    conn.row_factory = sqlite3.Row
+    if path not in _schema_ready:
+        conn.execute('PRAGMA journal_mode = WAL')
+        for statement in JOBS_SCHEMA:
+            conn.execute(statement)
+        existing = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+        for name, decl in JOBS_ADDED_COLUMNS.items():
+            if name not in existing:
+                conn.execute(f'ALTER TABLE jobs ADD COLUMN {name} {decl}')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_kind_key ON jobs (kind, job_key)')
+        conn.commit()
+        _schema_ready.add(path)
+    return conn
+
+
+def _query(query, args=(), one=False):
+    with closing(_connect()) as conn:
+        rv = conn.execute(query, args).fetchall()
+    return (rv[0] if rv else None) if one else rv
+
+
+def _execute(query, args=()):
+    with closing(_connect()) as conn:
+        with conn:
+            conn.execute(query, args)
+
+
+def result_path_for(job_id, suffix):
+    """Đường dẫn file kết quả / file upload của một job trong thư mục jobs"""
+    return os.path.join(jobs_dir(), f'{job_id}{suffix}')
+
+
+class JobContext:
+    """Handle truyền cho hàm chạy nền để báo tiến độ và đặt file kết quả."""
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.processed = 0
+        self.total = None
+        self._last_write = 0.0
+
+    def _write(self, **fields):
+        fields['updated_at'] = _now()
+        columns = ', '.join(f'{name} = ?' for name in fields)
+        _execute(f'UPDATE jobs SET {columns} WHERE id = ?', (*fields.values(), self.id))
+
+    def stage(self, name, total=None):
+        """Bắt đầu một bước mới; đặt lại bộ đếm dòng"""
+        self.processed = 0
+        self.total = total
+        self._write(stage=name, processed_rows=0, total_rows=total)
+        self._last_write = time.monotonic()
+
+    def progress(self, processed, total=None):
+        """Cập nhật số dòng đã xử lý của bước hiện tại (ghi DB có giãn cách)"""
+        self.processed = processed
+        if total is not None:
+            self.total = total
+        now = time.monotonic()
+        if now - self._last_write >= PROGRESS_INTERVAL or (self.total and processed >= self.total):
+            self._write(processed_rows=processed, total_rows=self.total)
+            self._last_write = now
+
+    def set_result(self, path, name):
+        self._write(result_path=path, result_name=name)
+
+
+def _run(job_id, func, args):
+    ctx = JobContext(job_id)
+    try:
+        _execute("UPDATE jobs SET status = 'running', pid = ?, updated_at = ? WHERE id = ?",
+                 (os.getpid(), _now(), job_id))
+        result = func(ctx, *args) or {}
+        _execute('''
+            UPDATE jobs SET status = 'done', message = ?, errors = ?,
+                   updated_at = ?, finished_at = ?
+            WHERE id = ?
+        ''', (result.get('message'), json.dumps(result.get('errors') or [], ensure_ascii=False),
+              _now(), _now(), job_id))
+    except Exception as e:
+        if isinstance(e, ValueError):
+            # Lỗi dữ liệu đầu vào (file không hợp lệ, ...): báo nguyên văn cho người dùng
+            message = str(e)
+        else:
+            print(f"Lỗi khi chạy job {job_id}: {e}")
+            traceback.print_exc()
+            message = f'Lỗi server: {str(e)}'
+        _execute('''
+            UPDATE jobs SET status = 'failed', message = ?, updated_at = ?, finished_at = ?
+            WHERE id = ?
+        ''', (message, _now(), _now(), job_id))
+
+
+def submit_job(kind, func, *args, created_by=None, key=None):
+    """Ghi job vào bảng jobs và chạy ``func(ctx, *args)`` ở nền. Trả về job id.
+
+    ``func`` trả về dict tùy chọn {'message': ..., 'errors': [...]}; exception -> failed.
+    Có ``key``: nếu đã có job cùng kind + key đang queued/running thì trả id của job đó
+    thay vì tạo job mới (vd. nhiều lần bấm export cùng một phiên bản dữ liệu).
+    """
+    cleanup_expired_jobs()
+    job_id = uuid.uuid4().hex
+    now = _now()
+    with closing(_connect()) as conn:
+        # BEGIN IMMEDIATE: hai request cùng key (kể cả ở hai worker) không cùng chèn job
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if key is not None:
+                rows = conn.execute('''
+                    SELECT * FROM jobs
+                    WHERE kind = ? AND job_key = ? AND status IN ('queued', 'running')
+                    ORDER BY created_at DESC
+                ''', (kind, key)).fetchall()
+                for row in rows:
+                    if not _orphaned(row):
+                        conn.rollback()
+                        return row['id']
+            # pid ghi ngay từ lúc queued: job nằm trong hàng đợi executor của process này,
+            # process chết thì job không bao giờ chạy nữa
+            conn.execute('''
+                INSERT INTO jobs (id, kind, job_key, status, pid, created_by, created_at, updated_at)
+                VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)
+            ''', (job_id, kind, key, os.getpid(), created_by, now, now))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    _get_executor().submit(_run, job_id, func, args)
+    return job_id
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def _orphaned(job):
+    """Job chưa xong nhưng process giữ nó không còn sống
+
+    Job 'queued' không có pid được tạo trước khi pid ghi lúc queued, tức là từ một
+    process đã restart: cũng coi là mồ côi.
+    """
+    if job['status'] not in ('queued', 'running'):
+        return False
+    if not job['pid']:
+        return job['status'] == 'queued'
+    return not _pid_alive(job['pid'])
+
+
+def get_job(job_id):
+    """Dòng jobs dạng dict (None nếu không có).
+
+    Job 'queued'/'running' mà worker giữ nó đã chết (gunicorn restart) được đánh dấu failed.
+    """
+    row = _query('SELECT * FROM jobs WHERE id = ?', (job_id,), one=True)
+    if row is None:
+        return None
+    job = dict(row)
+    if _orphaned(job):
+        _execute('''
+            UPDATE jobs SET status = 'failed', message = ?, updated_at = ?, finished_at = ?
+            WHERE id = ? AND status = ?
+        ''', ('Worker xử lý đã dừng giữa chừng', _now(), _now(), job_id, job['status']))
+        return get_job(job_id)
+    return job
+
+
+def list_recent_jobs(limit=50):
+    return [dict(r) for r in _query('SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?', (limit,))]
+
+
+def job_to_dict(job):
+    """Dạng JSON trả cho client (không lộ đường dẫn file trên server)"""
+    progress = None
+    if job['total_rows']:
+        progress = round(min(job['processed_rows'] / job['total_rows'], 1.0) * 100, 1)
+    return {
+        'id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'stage': job['stage'],
+        'processed_rows': job['processed_rows'],
+        'total_rows': job['total_rows'],
+        'progress': progress,
+        'message': job['message'],
+        'errors': json.loads(job['errors']) if job['errors'] else [],
+        'has_result': bool(job['result_path']) and job['status'] == 'done',
+        'created_at': job['created_at'],
+        'finished_at': job['finished_at'],
+    }
+
+
+def cleanup_expired_jobs():
+    """Xóa các job đã xong quá JOB_RETENTION_HOURS cùng file kết quả của chúng"""
+    cutoff = datetime.fromtimestamp(time.time() - config.JOB_RETENTION_HOURS * 3600).strftime('%Y-%m-%d %H:%M:%S')
+    rows = _query(
+        "SELECT id, result_path FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+        (cutoff,)
+    )
+    own_dir = os.path.abspath(jobs_dir())
+    for row in rows:
+        path = row['result_path']
+        # Chỉ xóa file nằm trong JOBS_DIR; kết quả trỏ vào cache export do cache tự dọn
+        if path and os.path.dirname(os.path.abspath(path)) == own_dir and os.path.exists(path):
+            os.remove(path)
+    if rows:
+        _execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (cutoff,)
+        )
@@ -0,0 +1,335 @@
+"""
+Schema migrations có đánh số phiên bản
+
+Phiên bản schema được lưu trong ``PRAGMA user_version`` của file DB.
+Mỗi migration là một hàm nhận kết nối SQLite; thứ tự trong MIGRATIONS
+chính là số phiên bản (migration đầu tiên = phiên bản 1). Khi thêm
+migration mới chỉ được nối vào cuối danh sách, không sửa các migration cũ.
+"""
+from utils.rollups import DAILY_TOTALS_SCHEMA, INFINITE_AMOUNT_SQL, rebuild_daily_totals
+from utils.versions import (
+    DATA_VERSIONS_SCHEMA, FUND_GROUP_VERSION_TRIGGERS, USER_VERSION_TRIGGERS, USERS_UPDATE_VERSION_TRIGGER,
+)
+from utils.dates import DB_DATE_GLOB, to_db_date
+from utils.changelog import TRANSACTION_CHANGES_SCHEMA
+
+
+def _m001_transaction_indexes(conn):
+    """Index cho các truy vấn nóng trên bảng transactions"""
+    # Calendar / dashboard / báo cáo: lọc theo user và khoảng ngày
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_transactions_user_date
+        ON transactions (user_id, date)
+    ''')
+    # Tổng thu/chi theo loại trong khoảng ngày (covering cho SUM(amount))
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_transactions_user_type_date
+        ON transactions (user_id, type, date, category_id, amount)
+    ''')
+    # Tổng quỹ theo mục đích (covering cho SUM(amount))
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_transactions_user_fund_type
+        ON transactions (user_id, fund_purpose, type, amount)
+    ''')
+
+
+def _m002_group_member_indexes(conn):
+    """Index tra nhóm quỹ theo user (UNIQUE(group_id, user_id) chỉ phục vụ tra theo group)"""
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_fund_group_members_user
+        ON fund_group_members (user_id, group_id)
+    ''')
+
+
+def _m003_daily_totals(conn):
+    """Bảng tổng hợp theo ngày + trigger đồng bộ, dựng lại từ dữ liệu hiện có"""
+    for statement in DAILY_TOTALS_SCHEMA:
+        conn.execute(statement)
+    rebuild_daily_totals(conn)
+
+
+def _m004_data_versions(conn):
+    """Bộ đếm phiên bản dữ liệu theo user/categories cho các cache trong worker"""
+    for statement in DATA_VERSIONS_SCHEMA:
+        conn.execute(statement)
+
+
+def _m005_fund_group_versions(conn):
+    """Stamp 'fund_groups' cho cache đồ thị thành viên nhóm quỹ giữa các worker"""
+    for statement in FUND_GROUP_VERSION_TRIGGERS:
+        conn.execute(statement)
+
+
+def _m006_transaction_category_index(conn):
+    """Index cho /api/transactions lọc theo danh mục, giữ thứ tự (date, id) cho keyset"""
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_transactions_user_category_date
+        ON transactions (user_id, category_id, date)
+    ''')
+
+
+def _m007_canonical_dates(conn):
+    """Đưa mọi transactions.date về 'YYYY-MM-DD' và chặn giá trị sai dạng ở DB"""
+    rows = conn.execute(
+        f"SELECT id, date FROM transactions WHERE date NOT GLOB '{DB_DATE_GLOB}'"
+    ).fetchall()
+    fixed, unparsed = [], []
+    for row_id, value in rows:
+        try:
+            fixed.append((to_db_date(value), row_id))
+        except ValueError:
+            unparsed.append(row_id)
+    conn.executemany('UPDATE transactions SET date = ? WHERE id = ?', fixed)
+    if unparsed:
+        print(f"Không chuẩn hóa được ngày của {len(unparsed)} giao dịch: {unparsed[:20]}")
+    
+    for event in ('INSERT', 'UPDATE OF date'):
+        name = 'insert' if event == 'INSERT' else 'update'
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_transactions_date_check_{name}
+            BEFORE {event} ON transactions
+            WHEN NEW.date NOT GLOB '{DB_DATE_GLOB}'
+            BEGIN
+                SELECT RAISE(ABORT, 'transactions.date phải có dạng YYYY-MM-DD');
+            END
+        ''')
+
+
+def _m008_must_change_password(conn):
+    """Cờ buộc đổi mật khẩu cho user được tạo hàng loạt (import) với mật khẩu tạm"""
+    columns = {r[1] for r in conn.execute('PRAGMA table_info(users)')}
+    if 'must_change_password' not in columns:
+        conn.execute('ALTER TABLE users ADD COLUMN must_change_password INTEGER NOT NULL DEFAULT 0')
+
+
+def _m009_transaction_content_hash(conn):
+    """Dấu vân tay nội dung giao dịch cho import incremental (excel_import.content_hash).
+
+    Đường ghi của app không tính hash: dòng mới có hash NULL, và trigger xóa hash khi
+    nội dung dòng bị sửa. Import incremental tính bù các hash NULL trước khi so sánh.
+    """
+    columns = {r[1] for r in conn.execute('PRAGMA table_info(transactions)')}
+    if 'content_hash' not in columns:
+        conn.execute('ALTER TABLE transactions ADD COLUMN content_hash TEXT')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_transactions_content_hash
+        ON transactions (content_hash)
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_content_hash_reset
+        AFTER UPDATE OF user_id, date, type, category_id, amount, note, fund_purpose ON transactions
+        WHEN NEW.content_hash IS OLD.content_hash AND NEW.content_hash IS NOT NULL
+        BEGIN
+            UPDATE transactions SET content_hash = NULL WHERE id = NEW.id;
+        END
+    ''')
+
+
+def _m010_user_versions(conn):
+    """Bộ đếm phiên bản cho users và nhóm quỹ mới/đổi tên (stamp của cache export)"""
+    for statement in USER_VERSION_TRIGGERS:
+        conn.execute(statement)
+
+
+def _m011_transaction_changes(conn):
+    """Nhật ký thay đổi giao dịch + tombstone cho /api/sync"""
+    for statement in TRANSACTION_CHANGES_SCHEMA:
+        conn.execute(statement)
+
+
+def _rebuild_table(conn, table, create_sql):
+    """Tạo lại bảng theo ``create_sql`` (SQLite không ALTER được ràng buộc), giữ dữ liệu,
+    index, trigger và bộ đếm AUTOINCREMENT. Chỉ chạy khi foreign_keys đang tắt."""
+    extras = [r[0] for r in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+        (table,)
+    )]
+    sequence = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+    columns = ', '.join(r[1] for r in conn.execute(f'PRAGMA table_info({table})'))
+    conn.execute(create_sql.format(table=f'{table}_new'))
+    conn.execute(f'INSERT INTO {table}_new ({columns}) SELECT {columns} FROM {table}')
+    conn.execute(f'DROP TABLE {table}')
+    conn.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+    if sequence:
+        # Giữ bộ đếm cũ để id của dòng đã xóa không bị cấp lại. Bảng rỗng lúc dựng lại thì
+        # bảng mới chưa có dòng trong sqlite_sequence; bảng này không có khóa UNIQUE nên
+        # INSERT OR REPLACE sẽ thêm dòng trùng -> xóa rồi chèn lại.
+        current = conn.execute('SELECT MAX(seq) FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()[0]
+        conn.execute('DELETE FROM sqlite_sequence WHERE name = ?', (table,))
+        conn.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)',
+                     (table, max(sequence[0], current or 0)))
+    for statement in extras:
+        conn.execute(statement)
+
+
+def _m012_foreign_keys(conn):
+    """Cột users.deleted_at (xóa mềm) + quy tắc ON DELETE cho các khóa ngoại.
+
+    Từ phiên bản này mọi kết nối bật ``PRAGMA foreign_keys``: xóa user thì giao dịch,
+    liên kết quỹ và tư cách thành viên nhóm bị xóa theo, nhóm quỹ user đã tạo giữ lại
+    với created_by NULL; xóa danh mục thì giao dịch giữ lại với category_id NULL.
+    Dòng mồ côi có sẵn được dọn theo đúng các quy tắc đó trước khi dựng lại bảng.
+    """
+    columns = {r[1] for r in conn.execute('PRAGMA table_info(users)')}
+    if 'deleted_at' not in columns:
+        conn.execute('ALTER TABLE users ADD COLUMN deleted_at TEXT')
+
+    orphans = conn.execute(
+        'DELETE FROM transactions WHERE user_id NOT IN (SELECT id FROM users)'
+    ).rowcount
+    if orphans:
+        print(f"Đã xóa {orphans} giao dịch của user không còn tồn tại")
+    conn.execute('UPDATE transactions SET category_id = NULL WHERE category_id NOT IN (SELECT id FROM categories)')
+    conn.execute('''
+        DELETE FROM fund_links
+        WHERE user1_id NOT IN (SELECT id FROM users) OR user2_id NOT IN (SELECT id FROM users)
+    ''')
+    conn.execute('UPDATE fund_groups SET created_by = NULL WHERE created_by NOT IN (SELECT id FROM users)')
+    conn.execute('''
+        DELETE FROM fund_group_members
+        WHERE group_id NOT IN (SELECT id FROM fund_groups) OR user_id NOT IN (SELECT id FROM users)
+    ''')
+
+    _rebuild_table(conn, 'transactions', '''
+        CREATE TABLE {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            date TEXT NOT NULL, -- YYYY-MM-DD
+            type TEXT NOT NULL, -- 'Thu' or 'Chi'
+            category_id INTEGER,
+            amount REAL NOT NULL,
+            note TEXT,
+            fund_purpose TEXT, -- For 'Thu quỹ'/'Chi quỹ'
+            content_hash TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
+            FOREIGN KEY (category_id) REFERENCES categories (id) ON DELETE SET NULL
+        )
+    ''')
+    _rebuild_table(conn, 'fund_links', '''
+        CREATE TABLE {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user1_id INTEGER,
+            user2_id INTEGER,
+            created_at TEXT,
+            FOREIGN KEY (user1_id) REFERENCES users (id) ON DELETE CASCADE,
+            FOREIGN KEY (user2_id) REFERENCES users (id) ON DELETE CASCADE,
+            UNIQUE(user1_id, user2_id)
+        )
+    ''')
+    _rebuild_table(conn, 'fund_groups', '''
+        CREATE TABLE {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            created_by INTEGER,
+            created_at TEXT,
+            FOREIGN KEY (created_by) REFERENCES users (id) ON DELETE SET NULL
+        )
+    ''')
+    _rebuild_table(conn, 'fund_group_members', '''
+        CREATE TABLE {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id INTEGER,
+            user_id INTEGER,
+            joined_at TEXT,
+            FOREIGN KEY (group_id) REFERENCES fund_groups (id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
+            UNIQUE(group_id, user_id)
+        )
+    ''')
+    # ON DELETE SET NULL khi xóa danh mục tra giao dịch theo category_id
+    # (index (user_id, category_id, date) không dùng được khi không lọc user)
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_transactions_category
+        ON transactions (category_id)
+    ''')
+
+    violations = conn.execute('PRAGMA foreign_key_check').fetchall()
+    if violations:
+        raise RuntimeError(f"Vi phạm khóa ngoại sau migration: {[tuple(v) for v in violations[:20]]}")
+
+
+def _m013_finite_amounts(conn):
+    """Chặn transactions.amount vô hạn ở DB (NaN đã bị NOT NULL chặn).
+
+    Trigger daily_totals trừ OLD.amount khi xóa/sửa: inf - inf = NaN, SQLite lưu thành
+    NULL và vi phạm NOT NULL, nên dòng vô hạn đã lọt vào không xóa được nữa. Các dòng
+    đó bị xóa ở đây (daily_totals dựng lại sau khi xóa).
+    """
+    infinite = INFINITE_AMOUNT_SQL.format(ref='transactions')
+    ids = [r[0] for r in conn.execute(f'SELECT id FROM transactions WHERE {infinite}')]
+    if ids:
+        conn.execute('DELETE FROM daily_totals')
+        conn.execute(f'DELETE FROM transactions WHERE {infinite}')
+        rebuild_daily_totals(conn)
+        print(f"Đã xóa {len(ids)} giao dịch có số tiền không hữu hạn: {ids[:20]}")
+
+    for event in ('INSERT', 'UPDATE OF amount'):
+        name = 'insert' if event == 'INSERT' else 'update'
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_transactions_amount_check_{name}
+            BEFORE {event} ON transactions
+            WHEN {INFINITE_AMOUNT_SQL.format(ref='NEW')}
+            BEGIN
+                SELECT RAISE(ABORT, 'transactions.amount phải là số hữu hạn');
+            END
+        ''')
+
+
+def _m014_user_deleted_version(conn):
+    """Xóa mềm user (chỉ đổi deleted_at khi user đã inactive, không trong nhóm) cũng tăng stamp 'users'"""
+    conn.execute('DROP TRIGGER IF EXISTS trg_versions_users_update')
+    conn.execute(USERS_UPDATE_VERSION_TRIGGER)
+
+
+MIGRATIONS = [
+    _m001_transaction_indexes,
+    _m002_group_member_indexes,
+    _m003_daily_totals,
+    _m004_data_versions,
+    _m005_fund_group_versions,
+    _m006_transaction_category_index,
+    _m007_canonical_dates,
+    _m008_must_change_password,
+    _m009_transaction_content_hash,
+    _m010_user_versions,
+    _m011_transaction_changes,
+    _m012_foreign_keys,
+    _m013_finite_amounts,
+    _m014_user_deleted_version,
+]
+
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def run_migrations(conn):
+    """Áp dụng các migration chưa chạy, trả về danh sách phiên bản vừa áp dụng.
+
+    Dùng BEGIN IMMEDIATE để các worker khởi động cùng lúc không chạy trùng:
+    worker đến sau sẽ chờ lock rồi đọc lại user_version đã được cập nhật.
+    Khóa ngoại tắt trong lúc chạy (PRAGMA này không đổi được giữa transaction)
+    để việc dựng lại bảng cha không kích hoạt ON DELETE ở bảng con.
+    """
+    applied = []
+    if get_schema_version(conn) >= len(MIGRATIONS):
+        return applied
+
+    foreign_keys = conn.execute('PRAGMA foreign_keys').fetchone()[0]
+    conn.execute('PRAGMA foreign_keys = OFF')
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        current = get_schema_version(conn)
+        for version, migration in enumerate(MIGRATIONS, start=1):
+            if version <= current:
+                continue
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {version}')
+            applied.append(version)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute(f'PRAGMA foreign_keys = {int(foreign_keys)}')
+    return applied
@@ -0,0 +1,101 @@
+"""
+Bảng tổng hợp theo ngày (daily_totals)
+
+Mỗi dòng là tổng tiền của một user trong một ngày theo (loại, danh mục, có
+thuộc quỹ hay không). Bảng được giữ đồng bộ bằng trigger trên transactions
+nên mọi đường ghi (API chi tiêu, import Excel, xóa user...) đều tự cập nhật.
+Dashboard và các báo cáo đọc từ đây thay vì cộng lại giao dịch gốc.
+"""
+
+# Số tiền vô hạn (9e999 là +Inf trong SQLite): bị trigger ở transactions từ chối
+# (migration 13) vì không trừ ngược được khỏi total
+INFINITE_AMOUNT_SQL = 'abs({ref}.amount) >= 9e999'
+
+# Khóa của một giao dịch trong daily_totals; category_id/user_id NULL được gộp về 0
+_KEY_COLUMNS = 'user_id, date, type, category_id, is_fund'
+
+
+def _key_values(ref):
+    return (
+        f"COALESCE({ref}.user_id, 0), substr({ref}.date, 1, 10), {ref}.type, "
+        f"COALESCE({ref}.category_id, 0), "
+        f"({ref}.fund_purpose IS NOT NULL AND {ref}.fund_purpose != '')"
+    )
+
+
+def _key_match(ref):
+    return (
+        f"user_id = COALESCE({ref}.user_id, 0) AND date = substr({ref}.date, 1, 10) "
+        f"AND type = {ref}.type AND category_id = COALESCE({ref}.category_id, 0) "
+        f"AND is_fund = ({ref}.fund_purpose IS NOT NULL AND {ref}.fund_purpose != '')"
+    )
+
+
+def _add_sql(ref):
+    return f'''
+        INSERT INTO daily_totals ({_KEY_COLUMNS}, total, tx_count)
+        VALUES ({_key_values(ref)}, {ref}.amount, 1)
+        ON CONFLICT ({_KEY_COLUMNS}) DO UPDATE
+        SET total = total + excluded.total, tx_count = tx_count + 1;
+    '''
+
+
+def _remove_sql(ref):
+    return f'''
+        UPDATE daily_totals SET total = total - {ref}.amount, tx_count = tx_count - 1
+        WHERE {_key_match(ref)};
+        DELETE FROM daily_totals WHERE {_key_match(ref)} AND tx_count <= 0;
+    '''
+
+
+DAILY_TOTALS_SCHEMA = [
+    f'''
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL, -- YYYY-MM-DD
+            type TEXT NOT NULL, -- 'Thu' or 'Chi'
+            category_id INTEGER NOT NULL, -- 0 nếu giao dịch không có danh mục
+            is_fund INTEGER NOT NULL, -- 1 nếu có fund_purpose
+            total REAL NOT NULL DEFAULT 0,
+            tx_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY ({_KEY_COLUMNS})
+        ) WITHOUT ROWID
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_daily_totals_insert
+        AFTER INSERT ON transactions
+        BEGIN
+            {_add_sql('NEW')}
+        END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_daily_totals_delete
+        AFTER DELETE ON transactions
+        BEGIN
+            {_remove_sql('OLD')}
+        END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_daily_totals_update
+        AFTER UPDATE OF user_id, date, type, category_id, amount, fund_purpose ON transactions
+        BEGIN
+            {_remove_sql('OLD')}
+            {_add_sql('NEW')}
+        END
+    ''',
+]
+
+
+def rebuild_daily_totals(conn):
+    """Tính lại toàn bộ daily_totals từ transactions (người gọi tự commit).
+
+    Trả về số dòng tổng hợp sau khi dựng lại.
+    """
+    conn.execute('DELETE FROM daily_totals')
+    conn.execute(f'''
+        INSERT INTO daily_totals ({_KEY_COLUMNS}, total, tx_count)
+        SELECT {_key_values('t')}, SUM(t.amount), COUNT(*)
+        FROM transactions t
+        GROUP BY 1, 2, 3, 4, 5
+    ''')
+    return conn.execute('SELECT COUNT(*) FROM daily_totals').fetchone()[0]
@@ -0,0 +1,197 @@
+"""
+Snapshot nhị phân của database.db (backup/restore nhanh)
+
+Dùng SQLite online backup API (``sqlite3.Connection.backup``):
+- Tạo snapshot: sao chép từng nhóm SNAPSHOT_PAGES trang, giữa các bước nhả lock
+  nên request khác vẫn đọc/ghi bình thường; file kết quả được nén gzip.
+- Khôi phục: giải nén ra file tạm, kiểm tra toàn vẹn rồi backup ngược vào DB
+  đang chạy trong một bước duy nhất - DB đích bị khóa ghi suốt bước đó nên các
+  kết nối khác chỉ thấy dữ liệu cũ hoặc mới, không bao giờ thấy trạng thái dở dang.
+
+Khác với Excel, snapshot giữ nguyên ID, mật khẩu đã hash và mọi bảng phụ.
+"""
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+from datetime import datetime
+import click
+from config import config
+from utils.db_utils import get_db_connection
+
+SNAPSHOT_SUFFIX = '.db.gz'
+_NAME_PATTERN = re.compile(r'^snapshot_\d{8}_\d{6}(_[a-z0-9_]+)?\.db\.gz$')
+_REQUIRED_TABLES = {'users', 'categories', 'transactions'}
+
+
+def snapshot_dir():
+    os.makedirs(config.SNAPSHOT_DIR, exist_ok=True)
+    return config.SNAPSHOT_DIR
+
+
+def snapshot_path(name):
+    """Đường dẫn của snapshot theo tên; ValueError nếu tên không hợp lệ (chặn path traversal)"""
+    if not _NAME_PATTERN.match(name or ''):
+        raise ValueError('Tên snapshot không hợp lệ')
+    return os.path.join(snapshot_dir(), name)
+
+
+def new_snapshot_name(label=None):
+    """Tên snapshot mới theo thời điểm tạo (thêm số thứ tự nếu trùng trong cùng giây)"""
+    base = f"snapshot_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    if label:
+        base += f'_{label}'
+    name, counter = base + SNAPSHOT_SUFFIX, 1
+    while os.path.exists(os.path.join(snapshot_dir(), name)):
+        counter += 1
+        name = f'{base}_{counter}{SNAPSHOT_SUFFIX}'
+    return name
+
+
+def list_snapshots():
+    """Các snapshot đang lưu, mới nhất trước"""
+    items = []
+    for name in os.listdir(snapshot_dir()):
+        if not _NAME_PATTERN.match(name):
+            continue
+        stat = os.stat(os.path.join(snapshot_dir(), name))
+        items.append({
+            'name': name,
+            'size': stat.st_size,
+            'created_at': datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M:%S'),
+        })
+    items.sort(key=lambda item: item['name'], reverse=True)
+    return items
+
+
+def _prune_snapshots():
+    for item in list_snapshots()[config.SNAPSHOT_KEEP:]:
+        os.remove(os.path.join(snapshot_dir(), item['name']))
+
+
+def create_snapshot(label=None, progress=None):
+    """Chụp database.db vào một file .db.gz mới trong SNAPSHOT_DIR. Trả về tên file.
+
+    ``progress(remaining, total)`` (tùy chọn) được gọi sau mỗi bước sao chép trang.
+    """
+    name = new_snapshot_name(label)
+    path = os.path.join(snapshot_dir(), name)
+    fd, raw_path = tempfile.mkstemp(suffix='.db', dir=snapshot_dir())
+    os.close(fd)
+    src = get_db_connection()
+    try:
+        dst = sqlite3.connect(raw_path)
+        try:
+            src.backup(dst, pages=config.SNAPSHOT_PAGES,
+                       progress=(lambda status, remaining, total: progress(remaining, total)) if progress else None)
+            # Snapshot là một file độc lập, không kèm -wal/-shm
+            dst.execute('PRAGMA journal_mode = DELETE')
+        finally:
+            dst.close()
+
+        tmp_gz = path + '.tmp'
+        with open(raw_path, 'rb') as raw, gzip.open(tmp_gz, 'wb', compresslevel=6) as out:
+            shutil.copyfileobj(raw, out, 1024 * 1024)
+        os.replace(tmp_gz, path)
+    finally:
+        src.close()
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+        if os.path.exists(path + '.tmp'):
+            os.remove(path + '.tmp')
+    _prune_snapshots()
+    return name
+
+
+def _extract(path):
+    """Giải nén snapshot ra file .db tạm (file .db chưa nén cũng được chấp nhận)"""
+    fd, raw_path = tempfile.mkstemp(suffix='.db', dir=snapshot_dir())
+    os.close(fd)
+    with open(path, 'rb') as f:
+        compressed = f.read(2) == b'\x1f\x8b'
+    opener = gzip.open if compressed else open
+    try:
+        with opener(path, 'rb') as src, open(raw_path, 'wb') as out:
+            shutil.copyfileobj(src, out, 1024 * 1024)
+    except Exception:
+        os.remove(raw_path)
+        raise
+    return raw_path
+
+
+def _validate(conn):
+    try:
+        result = conn.execute('PRAGMA quick_check').fetchone()[0]
+    except sqlite3.DatabaseError as e:
+        raise ValueError(f'File không phải snapshot SQLite hợp lệ: {e}')
+    if result != 'ok':
+        raise ValueError(f'Snapshot bị hỏng: {result}')
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    missing = _REQUIRED_TABLES - tables
+    if missing:
+        raise ValueError(f"Snapshot thiếu bảng: {', '.join(sorted(missing))}")
+
+
+def restore_snapshot(path, keep_current=True):
+    """Thay toàn bộ nội dung database.db bằng snapshot ``path`` (nguyên tử).
+
+    Raise ValueError nếu file không phải snapshot hợp lệ. Trước khi chép vào DB đang
+    chạy, bản giải nén được chạy các migration còn thiếu (snapshot cũ hơn code) và
+    mọi bộ đếm data_versions được đẩy lên cao hơn mọi giá trị DB hiện tại từng có,
+    để cache trong các worker không khớp nhầm stamp cũ.
+
+    ``keep_current``: chụp DB hiện tại ('pre_restore') sau khi snapshot đã qua kiểm tra.
+    Trả về tên bản chụp đó (None nếu không chụp).
+    """
+    # Import muộn: migrations import ngược lại db_utils
+    from utils.migrations import run_migrations
+
+    raw_path = _extract(path)
+    try:
+        src = sqlite3.connect(raw_path)
+        try:
+            _validate(src)
+            run_migrations(src)
+            backup_name = create_snapshot('pre_restore') if keep_current else None
+
+            live = get_db_connection()
+            try:
+                before = live.execute('SELECT scope, version FROM data_versions').fetchall()
+                ceiling = max((r['version'] for r in before), default=0) + 1
+                src.execute('UPDATE data_versions SET version = version + ?', (ceiling,))
+                src.executemany(
+                    'INSERT OR IGNORE INTO data_versions (scope, version) VALUES (?, ?)',
+                    [(r['scope'], ceiling) for r in before]
+                )
+                src.commit()
+
+                src.backup(live)  # pages=-1: chép trong một bước duy nhất
+            finally:
+                live.close()
+        finally:
+            src.close()
+    finally:
+        os.remove(raw_path)
+    return backup_name
+
+
+def init_app(app):
+    app.cli.add_command(snapshot_command)
+    app.cli.add_command(restore_snapshot_command)
+
+
+@click.command('snapshot')
+def snapshot_command():
+    """Tạo snapshot database.db (flask --app app snapshot)."""
+    name = create_snapshot()
+    click.echo(f'Đã tạo snapshot: {os.path.join(snapshot_dir(), name)}')
+
+
+@click.command('restore-snapshot')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def restore_snapshot_command(path):
+    """Khôi phục database.db từ snapshot (flask --app app restore-snapshot PATH)."""
+    backup_name = restore_snapshot(path)
+    click.echo(f'Đã khôi phục dữ liệu từ snapshot. Bản trước khi khôi phục: {backup_name}')
@@ -0,0 +1,58 @@
+"""
+Stream kết quả truy vấn thành response (CSV / NDJSON) không qua bộ nhớ
+
+Generator được Flask lặp sau khi app context của request đã kết thúc, nên mỗi
+stream tự mượn một kết nối từ pool (db_connection) và trả lại khi lặp xong hoặc
+khi client ngắt kết nối (GeneratorExit).
+"""
+import csv
+import io
+import json
+import zlib
+from utils.db_utils import db_connection
+
+STREAM_CHUNK_SIZE = 1000
+
+
+def iter_query_chunks(sql, params=(), chunk_size=STREAM_CHUNK_SIZE):
+    """Các lô dòng (sqlite3.Row) của truy vấn, đọc dần bằng fetchmany"""
+    with db_connection() as conn:
+        cur = conn.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+
+
+def csv_stream(columns, chunks):
+    """Dòng tiêu đề rồi từng lô dòng dạng CSV (mỗi lô một chuỗi)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    for rows in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(tuple(row) for row in rows)
+        yield buffer.getvalue()
+
+
+def ndjson_stream(chunks):
+    """Mỗi dòng một object JSON (mỗi lô một chuỗi)"""
+    for rows in chunks:
+        yield ''.join(json.dumps(dict(row), ensure_ascii=False) + '\n' for row in rows)
+
+
+def encode_stream(parts, compress=False):
+    """Mã hóa UTF-8 và (tùy chọn) nén gzip từng phần khi đang stream"""
+    if not compress:
+        for part in parts:
+            yield part.encode('utf-8')
+        return
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for part in parts:
+        data = compressor.compress(part.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
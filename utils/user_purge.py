@@ -0,0 +1,75 @@
+"""
+Xóa user hai bước: xóa mềm ngay, dọn dữ liệu ở nền
+
+- ``soft_delete_user``: một transaction đánh dấu users.deleted_at, khóa tài khoản và
+  gỡ user khỏi nhóm quỹ/liên kết quỹ - từ đây user không đăng nhập được, không còn
+  trong danh sách và không còn trong đồ thị thành viên quỹ.
+- ``purge_user``: xóa giao dịch theo lô USER_PURGE_BATCH dòng, mỗi lô một transaction
+  ngắn nên request khác vẫn ghi được giữa các lô. Trigger trên transactions cập nhật
+  daily_totals, data_versions và nhật ký đồng bộ cho từng dòng như mọi đường xóa khác.
+  Cuối cùng xóa dòng users; ON DELETE CASCADE (migration 12) dọn nốt giao dịch ghi
+  chen vào trong lúc purge.
+
+Purge bị dừng giữa chừng (worker restart) chỉ để lại user đã xóa mềm với một phần
+giao dịch; gọi lại ``purge_user`` sẽ tiếp tục từ chỗ còn lại.
+"""
+from datetime import datetime
+from config import config
+from utils.db_utils import db_connection, get_db_connection
+
+
+def soft_delete_user(user_id):
+    """Đánh dấu user đã xóa (giữ mốc lần đầu nếu đã đánh dấu trước đó)"""
+    with db_connection() as conn:
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'UPDATE users SET active = 0, deleted_at = COALESCE(deleted_at, ?) WHERE id = ?',
+                (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), user_id)
+            )
+            conn.execute('DELETE FROM fund_links WHERE user1_id = ? OR user2_id = ?', (user_id, user_id))
+            conn.execute('DELETE FROM fund_group_members WHERE user_id = ?', (user_id,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def purge_user(user_id, batch_size=None, progress=None):
+    """Xóa hẳn user đã xóa mềm cùng giao dịch và dữ liệu tổng hợp; trả về số giao dịch đã xóa.
+
+    ``progress(deleted, total)`` được gọi sau mỗi lô.
+    """
+    batch_size = batch_size or config.USER_PURGE_BATCH
+    conn = get_db_connection()
+    try:
+        total = conn.execute('SELECT COUNT(*) FROM transactions WHERE user_id = ?', (user_id,)).fetchone()[0]
+        deleted = 0
+        while True:
+            conn.execute('BEGIN IMMEDIATE')
+            count = conn.execute('''
+                DELETE FROM transactions WHERE id IN (
+                    SELECT id FROM transactions WHERE user_id = ? LIMIT ?
+                )
+            ''', (user_id, batch_size)).rowcount
+            conn.commit()
+            if not count:
+                break
+            deleted += count
+            if progress:
+                progress(deleted, max(total, deleted))
+
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('DELETE FROM users WHERE id = ? AND deleted_at IS NOT NULL', (user_id,))
+        # Dòng tổng hợp và tombstone đồng bộ của user không còn ai đọc. Xóa sau user:
+        # giao dịch ghi lọt sau lô cuối bị cascade khi xóa user, trigger của chúng lại
+        # sinh dòng daily_totals/transaction_changes
+        conn.execute('DELETE FROM daily_totals WHERE user_id = ?', (user_id,))
+        conn.execute('DELETE FROM transaction_changes WHERE user_id = ?', (user_id,))
+        conn.commit()
+        return deleted
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
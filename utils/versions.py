@@ -0,0 +1,166 @@
+"""
+Phiên bản dữ liệu (data_versions) và cache trong process dựa trên phiên bản
+
+Bảng data_versions giữ một bộ đếm tăng dần cho mỗi "scope":
+- 'user:<id>': tăng khi giao dịch của user đó thay đổi
+- 'categories': tăng khi bảng categories thay đổi
+- 'fund_groups': tăng khi nhóm quỹ / thành viên nhóm thay đổi
+- 'users': tăng khi thông tin user (trừ mật khẩu) thay đổi
+
+Tổng mọi bộ đếm (``global_data_version``) tăng sau mỗi lần ghi bất kỳ nên dùng
+được làm stamp cho những thứ phụ thuộc toàn bộ DB (vd. file export).
+
+Các bộ đếm được tăng bằng trigger nên mọi đường ghi đều được tính, và vì
+nằm trong file DB nên mọi gunicorn worker nhìn thấy cùng một giá trị.
+Cache trong từng worker chỉ cần so sánh stamp để biết giá trị còn đúng không.
+"""
+import threading
+from collections import OrderedDict
+from utils.db_utils import query_db
+
+
+def _bump_sql(scope_expr):
+    return f'''
+        INSERT INTO data_versions (scope, version) VALUES ({scope_expr}, 1)
+        ON CONFLICT (scope) DO UPDATE SET version = version + 1;
+    '''
+
+
+def _user_scope(ref):
+    return f"'user:' || COALESCE({ref}.user_id, 0)"
+
+
+DATA_VERSIONS_SCHEMA = [
+    '''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            scope TEXT PRIMARY KEY NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_versions_tx_insert
+        AFTER INSERT ON transactions
+        BEGIN
+            {_bump_sql(_user_scope('NEW'))}
+        END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_versions_tx_delete
+        AFTER DELETE ON transactions
+        BEGIN
+            {_bump_sql(_user_scope('OLD'))}
+        END
+    ''',
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_versions_tx_update
+        AFTER UPDATE ON transactions
+        BEGIN
+            {_bump_sql(_user_scope('OLD'))}
+            {_bump_sql(_user_scope('NEW'))}
+        END
+    ''',
+]
+
+for _event in ('INSERT', 'UPDATE', 'DELETE'):
+    DATA_VERSIONS_SCHEMA.append(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_versions_categories_{_event.lower()}
+        AFTER {_event} ON categories
+        BEGIN
+            {_bump_sql("'categories'")}
+        END
+    ''')
+
+# Thêm ở migration sau (5) nên tách danh sách riêng
+FUND_GROUP_VERSION_TRIGGERS = []
+for _table, _events in (('fund_group_members', ('INSERT', 'UPDATE', 'DELETE')), ('fund_groups', ('DELETE',))):
+    for _event in _events:
+        FUND_GROUP_VERSION_TRIGGERS.append(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_versions_{_table}_{_event.lower()}
+            AFTER {_event} ON {_table}
+            BEGIN
+                {_bump_sql("'fund_groups'")}
+            END
+        ''')
+
+# Thêm ở migration 10: các thay đổi còn lại có trong file export
+# (user mới/sửa/xóa, nhóm quỹ mới/đổi tên)
+USER_VERSION_TRIGGERS = []
+for _table, _events, _scope in (
+    ('users', ('INSERT', 'UPDATE OF username, name, role, active', 'DELETE'), 'users'),
+    ('fund_groups', ('INSERT', 'UPDATE'), 'fund_groups'),
+):
+    for _event in _events:
+        USER_VERSION_TRIGGERS.append(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_versions_{_table}_{_event.split()[0].lower()}
+            AFTER {_event} ON {_table}
+            BEGIN
+                {_bump_sql(f"'{_scope}'")}
+            END
+        ''')
+
+# Migration 14 thay trigger update users ở trên: xóa mềm (deleted_at) cũng tăng 'users'
+USERS_UPDATE_VERSION_TRIGGER = f'''
+    CREATE TRIGGER IF NOT EXISTS trg_versions_users_update
+    AFTER UPDATE OF username, name, role, active, deleted_at ON users
+    BEGIN
+        {_bump_sql("'users'")}
+    END
+'''
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+def get_versions(scopes):
+    """Đọc phiên bản hiện tại của các scope trong một truy vấn (scope chưa có = 0)."""
+    scopes = list(scopes)
+    versions = dict.fromkeys(scopes, 0)
+    if scopes:
+        placeholders = ','.join(['?'] * len(scopes))
+        rows = query_db(f'SELECT scope, version FROM data_versions WHERE scope IN ({placeholders})', scopes)
+        versions.update((r['scope'], r['version']) for r in rows)
+    return versions
+
+
+def global_data_version(conn=None):
+    """Bộ đếm thay đổi toàn DB: tổng mọi phiên bản (mỗi lần trigger tăng một scope thì tổng tăng).
+
+    Truyền ``conn`` để đọc trong cùng transaction với các truy vấn khác.
+    """
+    sql = 'SELECT COALESCE(SUM(version), 0) FROM data_versions'
+    if conn is not None:
+        return conn.execute(sql).fetchone()[0]
+    return query_db(sql, one=True)[0]
+
+
+class VersionedCache:
+    """Cache LRU trong một worker; mỗi giá trị được lưu kèm stamp lúc tính.
+
+    ``get`` chỉ trả về giá trị khi stamp hiện tại trùng với stamp đã lưu,
+    nên không cần chủ động xóa khi dữ liệu thay đổi.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, stamp):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] != stamp:
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, stamp, value):
+        with self._lock:
+            self._data[key] = (stamp, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()